@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# Thread vs async throughput benchmark
+#
+# Fetches documents from the local stand-in mirror (see standin_server.py),
+# once with the thread-based pipeline (fetch_many)
+# and once with the async API (async_fetch),
+# and compares the number of documents fetched per second.
+# The stand-in adds a fixed latency to each response
+# to simulate a remote mirror.
+#
+# Needs the package aiohttp (for both the async API and the stand-in)
+#
+# Usage: python benchmark/async_throughput.py [--docs N] [--latency MS]
+#                                             [--threads N] [--concurrency N]
+
+import argparse
+import asyncio
+import tempfile
+import time
+
+# also puts the repo root on the path
+from standin_server import StandInServer
+
+import shdlCore
+
+
+def run_threads(identifiers: list, options_kwargs: dict,
+                thread_count: int) -> float:
+    """
+    Fetch with the thread-based pipeline
+
+    :return: float.
+        Seconds taken
+    """
+    options = shdlCore.FetchOptions(**options_kwargs,
+                                    metaworkers=thread_count,
+                                    linkworkers=thread_count,
+                                    dlworkers=thread_count,
+                                    poolsize=thread_count)
+    start_time = time.perf_counter()
+    results = list(shdlCore.fetch_many(identifiers, options))
+    elapsed = time.perf_counter() - start_time
+    assert all(result.ok for result in results), results
+    return elapsed
+
+
+def run_async(identifiers: list, options_kwargs: dict,
+              concurrency: int) -> float:
+    """
+    Fetch with the async API
+
+    :return: float.
+        Seconds taken
+    """
+    options = shdlCore.FetchOptions(**options_kwargs)
+
+    async def fetch_all():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch_one(identifier):
+            async with semaphore:
+                return await shdlCore.async_fetch(identifier, options)
+
+        try:
+            return await asyncio.gather(*map(fetch_one, identifiers))
+        finally:
+            await shdlCore.async_http_transport.close()
+
+    start_time = time.perf_counter()
+    results = asyncio.run(fetch_all())
+    elapsed = time.perf_counter() - start_time
+    assert all(result.ok for result in results), results
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare thread and async fetching throughput")
+    parser.add_argument('--docs', type=int, default=200,
+                        help="Number of documents. Default: 200")
+    parser.add_argument('--latency', type=int, default=50,
+                        help="Latency of each mirror response, "
+                             "in milliseconds. Default: 50")
+    parser.add_argument('--size', type=int, default=16 * 1024,
+                        help="Size of each document, in bytes. "
+                             "Default: 16384")
+    parser.add_argument('--threads', type=int, default=16,
+                        help="Worker threads in each pipeline stage. "
+                             "Default: 16")
+    parser.add_argument('--concurrency', type=int, default=200,
+                        help="Documents fetched at the same time "
+                             "in async mode. Default: 200")
+    args = parser.parse_args()
+    identifiers = [f'10.5555/bench{idx}' for idx in range(args.docs)]
+    with StandInServer(latency=args.latency / 1000,
+                       file_size=args.size) as server, \
+            tempfile.TemporaryDirectory() as download_dir:
+        options_kwargs = {'mirror': server.mirror_url,
+                          'dir':    download_dir,
+                          'cache':  '',
+                          # the stand-in mirror needs no politeness
+                          'hostlimit': '127.0.0.1,0'}
+        for label, elapsed in (
+                (f'threads ({args.threads} per stage)',
+                 run_threads(identifiers, options_kwargs, args.threads)),
+                (f'async (concurrency {args.concurrency})',
+                 run_async(identifiers, options_kwargs, args.concurrency))):
+            print(f"{label}: {args.docs} documents in {elapsed:.2f} s, "
+                  f"{args.docs / elapsed:.1f} documents/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,528 @@
+#!/usr/bin/env python3
+
+# Local stand-in for the servers shdl talks to
+#
+# Imitates each endpoint used by the repo handlers:
+# the DOI resolver (CSL-JSON), the Crossref works query (JSON),
+# the arXiv API (Atom), PubMed esummary (JSON),
+# the IEEE, JSTOR and ScienceDirect citation exports (RIS),
+# a mirror answering queries with a page in the shape link_extractor parses,
+# and file serving with Range support (as for segmented downloads).
+# Metadata is made up from the identifier, so any identifier is found.
+# The Crossref works query, the arXiv API and esummary
+# answer many ids at once.
+#
+# Latency, bandwidth, error rate and throttling can be configured.
+# Requests to the real hosts are sent to the stand-in with route_requests,
+# which rewrites their URLs in the shared transport,
+# e.g. https://doi.org/10.5555/x -> http://127.0.0.1:<port>/doi.org/10.5555/x.
+# The mirror is the stand-in itself, at <url>/mirror/.
+#
+# Needs the package aiohttp
+#
+# Usage: python benchmark/standin_server.py [--port N] [--latency MS]
+#                                           [--bandwidth KIB] [--errors P]
+#                                           [--throttle N] [--size BYTES]
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
+
+_repo_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(_repo_root))
+
+# hosts whose requests are sent to the stand-in by route_requests
+routed_host_tuple = ('doi.org',
+                     'api.crossref.org',
+                     'export.arxiv.org',
+                     'arxiv.org',
+                     'eutils.ncbi.nlm.nih.gov',
+                     'ieeexplore.ieee.org',
+                     'www.jstor.org',
+                     'www.sciencedirect.com')
+# repo name -> identifier format, filled with a document number
+identifier_format_dict = {
+    'DOI':           'doi: 10.5555/bench{}',
+    'arXiv':         'arxiv: 2101.{:05d}',
+    'PMID':          'pmid: {}',
+    'IEEE':          'ieee: {}',
+    'JSTOR':         'jstor: {}',
+    'ScienceDirect': 'scidir: pii/S{:016d}',
+}
+
+
+def make_identifiers(repo_name: str, count: int, start: int = 0) -> List[str]:
+    """
+    Get identifiers of documents the stand-in knows of
+
+    :param repo_name: str.
+        The repo name, a key of identifier_format_dict
+    :param count: int.
+        The number of identifiers
+    :param start: int.
+        The number of the first document
+    :return: list[str].
+        Raw identifiers, as given on the commandline
+    """
+    return [identifier_format_dict[repo_name].format(doc_num)
+            for doc_num in range(start + 1, start + count + 1)]
+
+
+def _get_ris(doc_key: str, title_tag: str, author_list: List[str]) -> str:
+    return '\r\n'.join(['TY  - JOUR',
+                        f'{title_tag}  - Stand-in document {doc_key}',
+                        *(f'AU  - {author}' for author in author_list),
+                        'PY  - 2021',
+                        f'DO  - 10.5555/{doc_key}',
+                        'ER  - ',
+                        ''])
+
+
+class StandInServer:
+    """
+    The stand-in server, run in a background thread
+
+    Every response is delayed by the latency.
+    Each response fails with HTTP 503 with probability error_rate.
+    Requests to each host (or to the mirror, or to files)
+    above throttle per second are answered with HTTP 429 and Retry-After.
+    File bodies are sent at most at bandwidth bytes per second each
+    """
+
+    def __init__(self,
+                 latency: float = 0.0,
+                 bandwidth: int = 0,
+                 error_rate: float = 0.0,
+                 throttle: float = 0.0,
+                 file_size: int = 64 * 1024,
+                 seed: Optional[int] = None):
+        """
+        :param latency: float.
+            Seconds before each response
+        :param bandwidth: int.
+            Bytes per second of each file download. 0 for no limit
+        :param error_rate: float.
+            The fraction of responses that fail with HTTP 503
+        :param throttle: float.
+            Requests per second allowed to each host. 0 for no limit
+        :param file_size: int.
+            Size of the served files, in bytes
+        :param seed: int, or None.
+            The seed for choosing failing responses
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.throttle = throttle
+        self.file_size = file_size
+        self.url: Optional[str] = None
+        self._random = random.Random(seed)
+        # host -> (tokens, time of last update), for throttling
+        self._bucket_dict: Dict[str, Tuple[float, float]] = dict()
+        self._file_body = (b'%PDF-1.4\n'
+                           + bytes(range(256)) * (file_size // 256 + 1)
+                           )[:file_size]
+        self._lock = threading.Lock()
+        # (host, status) -> number of responses
+        self._response_counter = Counter()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> 'StandInServer':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.stop()
+
+    @property
+    def mirror_url(self) -> str:
+        return f'{self.url}mirror/'
+
+    def start(self, port: int = 0) -> str:
+        """
+        Start serving in a background thread
+
+        :param port: int.
+            The port to listen on. 0 for any free port
+        :return: str.
+            The URL of the server, ending with /
+        """
+        from aiohttp import web
+
+        @web.middleware
+        async def imitate_network(request, handler):
+            return await self._imitate_network(request, handler)
+
+        app = web.Application(middlewares=[imitate_network])
+        app.router.add_get('/doi.org/{doi:.+}', self._csl_json)
+        app.router.add_get('/api.crossref.org/works', self._crossref_works)
+        app.router.add_get('/export.arxiv.org/api/query', self._arxiv_atom)
+        app.router.add_get('/eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+                           'esummary.fcgi', self._esummary)
+        app.router.add_get('/ieeexplore.ieee.org/rest/search/citation/format',
+                           self._ieee_ris)
+        app.router.add_get('/www.jstor.org/citation/ris/{id:.+}',
+                           self._jstor_ris)
+        app.router.add_get('/www.sciencedirect.com/sdfe/arp/cite',
+                           self._scidir_ris)
+        app.router.add_get('/mirror/', self._mirror_home)
+        app.router.add_route('*', '/mirror/{identifier:.+}',
+                             self._mirror_query)
+        app.router.add_get('/files/{name}', self._file)
+        app.router.add_get('/arxiv.org/pdf/{name}', self._file)
+        url_ready = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            runner = web.AppRunner(app, access_log=None)
+            self._loop.run_until_complete(runner.setup())
+            site = web.TCPSite(runner, '127.0.0.1', port, backlog=4096)
+            self._loop.run_until_complete(site.start())
+            self.url = (f'http://127.0.0.1:'
+                        f'{site._server.sockets[0].getsockname()[1]}/')
+            url_ready.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=serve, daemon=True)
+        self._thread.start()
+        url_ready.wait()
+        return self.url
+
+    def stop(self) -> None:
+        """
+        Stop serving
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    def response_stats(self) -> Dict[str, Dict[int, int]]:
+        """
+        Get the number of responses sent
+
+        :return: dict[str, dict[int, int]].
+            Maps host (or 'mirror', or 'files') to a dict
+            mapping HTTP status to the number of responses
+        """
+        stat_dict = dict()
+        with self._lock:
+            for (host, status), count in sorted(self._response_counter.items()):
+                stat_dict.setdefault(host, dict())[status] = count
+        return stat_dict
+
+    def _take_token(self, host: str) -> float:
+        # returns seconds until a request to host is allowed, 0 if it is
+        now = time.monotonic()
+        burst = max(1.0, self.throttle)
+        with self._lock:
+            tokens, last_time = self._bucket_dict.get(host, (burst, now))
+            tokens = min(burst, tokens + (now - last_time) * self.throttle)
+            if tokens < 1:
+                self._bucket_dict[host] = (tokens, now)
+                return (1 - tokens) / self.throttle
+            self._bucket_dict[host] = (tokens - 1, now)
+            return 0.0
+
+    async def _imitate_network(self, request, handler):
+        from aiohttp import web
+
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        host = request.path.split('/', 2)[1]
+        if self.throttle > 0 and (wait_time := self._take_token(host)) > 0:
+            # fractional seconds, which shdl accepts
+            response = web.Response(status=429,
+                                    headers={'Retry-After':
+                                             f'{wait_time:.3f}'})
+        elif self.error_rate > 0 and self._random.random() < self.error_rate:
+            response = web.Response(status=503)
+        else:
+            response = await handler(request)
+        with self._lock:
+            self._response_counter[(host, response.status)] += 1
+        return response
+
+    @staticmethod
+    def _doc_key(identifier: str) -> str:
+        return ''.join(c if c.isalnum() else '_' for c in identifier)
+
+    def _get_csl(self, doi: str) -> dict:
+        return {
+            'DOI':    doi,
+            'type':   'article-journal',
+            'title':  f'Stand-in document {self._doc_key(doi)}',
+            'author': [{'given': 'Ada', 'family': 'Lovelace'},
+                       {'given': 'Charles', 'family': 'Babbage'}],
+            'issued': {'date-parts': [[2021, 1, 1]]},
+        }
+
+    async def _csl_json(self, request):
+        from aiohttp import web
+
+        return web.Response(
+            text=json.dumps(self._get_csl(request.match_info['doi'])),
+            content_type='application/vnd.citationstyles.csl+json')
+
+    async def _crossref_works(self, request):
+        from aiohttp import web
+
+        item_list = list()
+        # filter=doi:A,doi:B,...
+        for doi_filter in request.query.get('filter', '').split(','):
+            csl = self._get_csl(doi_filter.split(':', 1)[-1])
+            # titles are lists, unlike in CSL-JSON
+            item_list.append({**csl,
+                              'type':  'journal-article',
+                              'title': [csl['title']]})
+        return web.json_response({
+            'status':       'ok',
+            'message-type': 'work-list',
+            'message':      {'total-results': len(item_list),
+                             'items':         item_list},
+        })
+
+    async def _arxiv_atom(self, request):
+        from aiohttp import web
+
+        # one entry for each of the comma-separated ids
+        entry_list = [
+            '<entry>\n'
+            f'<id>http://arxiv.org/abs/{arxiv_id}v1</id>\n'
+            '<updated>2021-01-01T00:00:00Z</updated>\n'
+            f'<title>Stand-in document {self._doc_key(arxiv_id)}</title>\n'
+            '<author><name>Ada Lovelace</name></author>\n'
+            '<author><name>Charles Babbage</name></author>\n'
+            '</entry>\n'
+            for arxiv_id in request.query.get('id_list', '').split(',')
+        ]
+        return web.Response(
+            text='<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<feed xmlns="http://www.w3.org/2005/Atom">\n'
+                 + ''.join(entry_list)
+                 + '</feed>\n',
+            content_type='application/atom+xml')
+
+    async def _esummary(self, request):
+        from aiohttp import web
+
+        # the handler sends a single id with a trailing ]
+        pmid_list = request.query.get('id', '').rstrip(']').split(',')
+        return web.json_response({'result': {
+            'uids': pmid_list,
+            **{pmid: {'uid':     pmid,
+                      'title':   f'Stand-in document pmid{pmid}.',
+                      'authors': [{'name': 'Lovelace A', 'authtype': 'Author'},
+                                  {'name': 'Babbage C', 'authtype': 'Author'}],
+                      'pubdate': '2021 Jan'}
+               for pmid in pmid_list},
+        }})
+
+    async def _ieee_ris(self, request):
+        from aiohttp import web
+
+        return web.json_response({'data': _get_ris(
+            f"ieee{request.query.get('recordIds', '')}",
+            'TI',
+            ['Ada Lovelace', 'Charles Babbage'])})
+
+    async def _jstor_ris(self, request):
+        from aiohttp import web
+
+        return web.Response(
+            text=_get_ris(f"jstor{request.match_info['id']}",
+                          'TI',
+                          ['Lovelace, Ada', 'Babbage, Charles']),
+            content_type='application/x-research-info-systems')
+
+    async def _scidir_ris(self, request):
+        from aiohttp import web
+
+        ris = _get_ris(f"scidir{request.query.get('pii', '')}",
+                       'T1',
+                       ['Lovelace, Ada', 'Babbage, Charles'])
+        return web.Response(
+            # DOI as a URL, as ScienceDirect gives it
+            text=ris.replace('DO  - ', 'DO  - https://doi.org/'),
+            content_type='application/x-research-info-systems')
+
+    async def _mirror_home(self, request):
+        from aiohttp import web
+
+        return web.Response(text='<html><body>mirror</body></html>',
+                            content_type='text/html')
+
+    async def _mirror_query(self, request):
+        from aiohttp import web
+
+        # PMID queries are posted as a form
+        identifier = (request.match_info['identifier']
+                      if request.method != 'POST'
+                      else (await request.post()).get('request', ''))
+        return web.Response(
+            text='<html><body>\n'
+                 '<div id="buttons">\n'
+                 '<button onclick = "location.href='
+                 f"'{self.url}files/{self._doc_key(identifier)}.pdf"
+                 '?download=true\'">&darr; save</button>\n'
+                 '</div>\n'
+                 '</body></html>\n',
+            content_type='text/html')
+
+    async def _file(self, request):
+        from aiohttp import web
+
+        body = self._file_body
+        header_dict = {'Accept-Ranges': 'bytes',
+                       'ETag': f'"{len(body)}"',
+                       'Content-Type': 'application/pdf'}
+        status = 200
+        range_header = request.headers.get('Range', '')
+        if range_header.startswith('bytes=') \
+                and request.headers.get('If-Range',
+                                        header_dict['ETag']) \
+                == header_dict['ETag']:
+            first_str, last_str = range_header[6:].split('-', 1)
+            first = int(first_str)
+            last = min(int(last_str or len(body) - 1), len(body) - 1)
+            if first > last:
+                return web.Response(
+                    status=416,
+                    headers={'Content-Range': f'bytes */{len(body)}'})
+            header_dict['Content-Range'] = f'bytes {first}-{last}/{len(body)}'
+            body = body[first:last + 1]
+            status = 206
+        header_dict['Content-Length'] = str(len(body))
+        response = web.StreamResponse(status=status, headers=header_dict)
+        await response.prepare(request)
+        if request.method == 'HEAD':
+            return response
+        chunk_size = 16 * 1024
+        start_time = time.monotonic()
+        for offset in range(0, len(body), chunk_size):
+            await response.write(body[offset:offset + chunk_size])
+            if self.bandwidth > 0:
+                # pace by the total sent, so that sleeps do not add up
+                await asyncio.sleep(
+                    start_time
+                    + (offset + chunk_size) / self.bandwidth
+                    - time.monotonic())
+        await response.write_eof()
+        return response
+
+
+class _RoutedSession:
+    # used in place of requests.Session,
+    # sending requests to routed hosts to the stand-in
+
+    def __init__(self, server_url: str):
+        from shdlCore import http_transport
+
+        self._server_url = server_url
+        self._transport = http_transport
+        self._lock = threading.Lock()
+        # created on first use, with the arguments of the request
+        self._session = None
+
+    def request(self, method: str, url: str, **kwargs):
+        with self._lock:
+            if self._session is None:
+                self._session = self._transport.create_session()
+            session = self._session
+        parsed_url = urlparse(url)
+        if parsed_url.hostname not in routed_host_tuple:
+            return session.request(method, url, **kwargs)
+        response = session.request(
+            method,
+            self._server_url + parsed_url.netloc + parsed_url.path
+            + ('' if parsed_url.query == '' else '?' + parsed_url.query),
+            **kwargs)
+        # as if from the real host
+        response.url = url
+        return response
+
+    def get(self, url: str, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+@contextmanager
+def route_requests(server: StandInServer) -> Iterator[StandInServer]:
+    """
+    Send requests to the hosts in routed_host_tuple to the stand-in
+    within the context
+
+    Only requests of the blocking transport are routed.
+    Host limits still apply by the real host names
+
+    :param server: StandInServer.
+        The started stand-in
+    :return: Iterator[StandInServer].
+        Yields server
+    """
+    from shdlCore import http_transport
+
+    routed_session = _RoutedSession(server.url)
+    with http_transport.use_session(routed_session):
+        try:
+            yield server
+        finally:
+            routed_session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve the stand-in until interrupted")
+    parser.add_argument('--port', type=int, default=8000,
+                        help="Port to listen on. Default: 8000")
+    parser.add_argument('--latency', type=int, default=0,
+                        help="Latency of each response, in milliseconds. "
+                             "Default: 0")
+    parser.add_argument('--bandwidth', type=int, default=0,
+                        help="KiB per second of each file download. "
+                             "0 for no limit. Default: 0")
+    parser.add_argument('--errors', type=float, default=0,
+                        help="Fraction of responses failing with HTTP 503. "
+                             "Default: 0")
+    parser.add_argument('--throttle', type=float, default=0,
+                        help="Requests per second allowed to each host. "
+                             "0 for no limit. Default: 0")
+    parser.add_argument('--size', type=int, default=64 * 1024,
+                        help="Size of each file, in bytes. Default: 65536")
+    args = parser.parse_args()
+    server = StandInServer(latency=args.latency / 1000,
+                           bandwidth=args.bandwidth * 1024,
+                           error_rate=args.errors,
+                           throttle=args.throttle,
+                           file_size=args.size)
+    server.start(args.port)
+    print(f"Serving on {server.url}, mirror at {server.mirror_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        for host, status_dict in server.response_stats().items():
+            print(f"{host}: {status_dict}")
+
+
+if __name__ == '__main__':
+    main()
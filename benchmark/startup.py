@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# Startup time benchmark
+#
+# Measures the wall-clock time from process start
+# to the first network request made by shdl.
+# The first request is intercepted and the process exits there,
+# so no actual network access is needed.
+#
+# Usage: python benchmark/startup.py [--runs N] [-- shdl arguments ...]
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+_repo_root = Path(__file__).resolve().parent.parent
+
+# run in the child process
+_child_code = '''
+import os, sys, time
+import requests
+
+def _first_request(self, method, url, *args, **kwargs):
+    print(time.time(), url, flush=True)
+    os._exit(0)
+
+requests.Session.request = _first_request
+sys.path.insert(0, {repo_root!r})
+from shdlCore import main
+sys.argv = ['shdl'] + {shdl_args!r}
+main()
+'''
+
+_default_shdl_args = ['10.1109/5.771073',
+                      '--dryrun', '--config', '', '--cache', '',
+                      '--mirror', 'mirror.invalid']
+
+
+def measure_once(shdl_args: list) -> float:
+    """
+    Run shdl once and measure time until its first request
+
+    :param shdl_args: list[str].
+        The commandline arguments passed to shdl
+    :return: float.
+        Seconds from spawning the process to the first request
+    """
+    start_time = time.time()
+    child_out = subprocess.run(
+        [sys.executable, '-c',
+         _child_code.format(repo_root=str(_repo_root),
+                            shdl_args=shdl_args)],
+        capture_output=True, text=True, check=True).stdout
+    first_line = next((line
+                       for line in child_out.splitlines()
+                       if line.split(' ', 1)[0]
+                       .replace('.', '', 1).isdigit()),
+                      None)
+    if first_line is None:
+        raise RuntimeError("shdl exited without making any request. "
+                           f"Output: {child_out}")
+    return float(first_line.split(' ', 1)[0]) - start_time
+
+
+def measure_import() -> float:
+    """
+    Measure the time to start the interpreter and import shdlCore
+
+    :return: float.
+        Seconds from spawning the process to the end of import
+    """
+    start_time = time.time()
+    subprocess.run([sys.executable, '-c', 'import shdlCore'],
+                   cwd=str(_repo_root), check=True)
+    return time.time() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure shdl startup time")
+    parser.add_argument('--runs', type=int, default=10,
+                        help="Number of runs. Default: 10")
+    parser.add_argument('shdl_args', nargs='*',
+                        help="Arguments passed to shdl. "
+                             f"Default: {' '.join(_default_shdl_args)}")
+    args = parser.parse_args()
+    shdl_args = (args.shdl_args
+                 if len(args.shdl_args) != 0
+                 else _default_shdl_args)
+    import_times = [measure_import() for _ in range(args.runs)]
+    startup_times = [measure_once(shdl_args) for _ in range(args.runs)]
+    for label, times in (('import shdlCore', import_times),
+                         ('start to first request', startup_times)):
+        print(f"{label}: "
+              f"median {statistics.median(times) * 1000:.1f} ms, "
+              f"min {min(times) * 1000:.1f} ms, "
+              f"max {max(times) * 1000:.1f} ms "
+              f"({args.runs} runs)")
+
+
+if __name__ == '__main__':
+    main()
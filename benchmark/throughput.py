@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+
+# End-to-end throughput benchmark
+#
+# Fetches documents of every repo type from the local stand-in
+# (see standin_server.py), with metadata (--autoname) and download,
+# and reports documents per second, bytes per second
+# and the latency of each stage (from the trace) of:
+#   single/<repo>: documents of a repo fetched one after another with fetch
+#   batch: documents of all repos fetched together with fetch_many
+# Results can be saved as a baseline,
+# and compared with a saved baseline to catch regressions.
+# Exits with status 1 if a result is worse than the baseline
+# by more than the tolerance.
+#
+# Needs the package aiohttp (for the stand-in)
+#
+# Usage: python benchmark/throughput.py [--docs N] [--runs N] [--threads N]
+#                                       [--latency MS] [--bandwidth KIB]
+#                                       [--errors P] [--throttle N]
+#                                       [--size BYTES] [--segments N]
+#                                       [--save FILE] [--baseline FILE]
+#                                       [--tolerance PERCENT]
+
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+# also puts the repo root on the path
+from standin_server import StandInServer, identifier_format_dict, \
+    make_identifiers, route_requests
+
+import shdlCore
+from shdlCore.src import default_host_limit_dict, open_tracer
+
+# the settings a baseline is only comparable with
+_setting_key_tuple = ('docs', 'runs', 'threads', 'latency', 'bandwidth',
+                      'errors', 'throttle', 'size', 'segments')
+# compared with the baseline (higher is better),
+# along with the p50 latency of each stage (lower is better)
+_compared_key_tuple = ('docs_per_s', 'bytes_per_s')
+# stage latencies changing less than this (in ms) are noise,
+# e.g. of stages without requests
+_min_latency_change_ms = 1.0
+
+
+def run_scenario(identifiers: List[str],
+                 options_kwargs: dict,
+                 work_dir: Path,
+                 is_batch: bool) -> dict:
+    """
+    Fetch the documents and measure
+
+    :param identifiers: list[str].
+        The raw identifiers
+    :param options_kwargs: dict.
+        Keyword arguments of FetchOptions
+    :param work_dir: Path.
+        An empty directory for the downloads and the trace
+    :param is_batch: bool.
+        If fetched with fetch_many, or else one by one with fetch
+    :return: dict.
+        The result, with keys docs, failed, seconds, docs_per_s, bytes_per_s,
+        and stage mapping each stage to its p50_ms and p95_ms
+    """
+    trace_path = work_dir / 'trace.jsonl'
+    options = shdlCore.FetchOptions(**options_kwargs,
+                                    dir=str(work_dir),
+                                    trace=str(trace_path))
+    start_time = time.perf_counter()
+    if is_batch:
+        results = list(shdlCore.fetch_many(identifiers, options))
+    else:
+        results = [shdlCore.fetch(identifier, options)
+                   for identifier in identifiers]
+    elapsed = time.perf_counter() - start_time
+    byte_count = sum(result.path.stat().st_size
+                     for result in results
+                     if result.ok)
+    tracer = open_tracer(trace_path)
+    stage_summary = tracer.summary()['stage']
+    tracer.close()
+    return {
+        'docs':        len(results),
+        'failed':      sum(not result.ok for result in results),
+        'seconds':     elapsed,
+        'docs_per_s':  len(results) / elapsed,
+        'bytes_per_s': byte_count / elapsed,
+        'stage':       {stage: {'p50_ms': percentile_dict['p50'] * 1000,
+                                'p95_ms': percentile_dict['p95'] * 1000}
+                        for stage, percentile_dict in stage_summary.items()},
+    }
+
+
+def print_result(name: str, result: dict) -> None:
+    print(f"{name}: {result['docs']} documents "
+          f"({result['failed']} failed) in {result['seconds']:.2f} s, "
+          f"{result['docs_per_s']:.1f} documents/s, "
+          f"{result['bytes_per_s'] / 1024 ** 2:.2f} MiB/s")
+    for stage, latency_dict in result['stage'].items():
+        print(f"    {stage:<12} p50 {latency_dict['p50_ms']:8.1f} ms"
+              f"   p95 {latency_dict['p95_ms']:8.1f} ms")
+
+
+def compare_with_baseline(result_dict: Dict[str, dict],
+                          baseline_dict: Dict[str, dict],
+                          tolerance: float) -> List[str]:
+    """
+    Find results worse than the baseline by more than tolerance
+
+    :param result_dict: dict[str, dict].
+        Maps scenario name to its result
+    :param baseline_dict: dict[str, dict].
+        The same, from the baseline
+    :param tolerance: float.
+        The allowed change, as a fraction
+    :return: list[str].
+        A description of each regression
+    """
+    regression_list = list()
+    for name, result in result_dict.items():
+        if (baseline := baseline_dict.get(name)) is None:
+            continue
+        value_pair_list = [(key, result[key], baseline[key], True)
+                           for key in _compared_key_tuple]
+        value_pair_list.extend(
+            (f"{stage} p50_ms",
+             latency_dict['p50_ms'],
+             baseline['stage'][stage]['p50_ms'],
+             False)
+            for stage, latency_dict in result['stage'].items()
+            if stage in baseline['stage']
+            and abs(latency_dict['p50_ms']
+                    - baseline['stage'][stage]['p50_ms'])
+            >= _min_latency_change_ms)
+        for key, value, baseline_value, higher_better in value_pair_list:
+            if baseline_value == 0:
+                continue
+            change = value / baseline_value - 1
+            if (-change if higher_better else change) > tolerance:
+                regression_list.append(f"{name} {key}: {value:.2f} "
+                                       f"(baseline {baseline_value:.2f}, "
+                                       f"{change:+.0%})")
+    return regression_list
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure end-to-end fetching throughput "
+                    "against the local stand-in")
+    parser.add_argument('--docs', type=int, default=120,
+                        help="Number of documents in the batch. "
+                             "Default: 120")
+    parser.add_argument('--runs', type=int, default=10,
+                        help="Number of documents of each repo "
+                             "fetched one by one. Default: 10")
+    parser.add_argument('--threads', type=int, default=8,
+                        help="Worker threads in each pipeline stage. "
+                             "Default: 8")
+    parser.add_argument('--latency', type=int, default=20,
+                        help="Latency of each response, in milliseconds. "
+                             "Default: 20")
+    parser.add_argument('--bandwidth', type=int, default=0,
+                        help="KiB per second of each file download. "
+                             "0 for no limit. Default: 0")
+    parser.add_argument('--errors', type=float, default=0,
+                        help="Fraction of responses failing with HTTP 503. "
+                             "Default: 0")
+    parser.add_argument('--throttle', type=float, default=0,
+                        help="Requests per second allowed to each host. "
+                             "0 for no limit. Default: 0")
+    parser.add_argument('--size', type=int, default=256 * 1024,
+                        help="Size of each document, in bytes. "
+                             "Default: 262144")
+    parser.add_argument('--segments', type=int, default=1,
+                        help="Segments of each download. Default: 1")
+    parser.add_argument('--save', type=str,
+                        help="Save the results as a baseline to this file")
+    parser.add_argument('--baseline', type=str,
+                        help="Compare the results with the baseline "
+                             "saved in this file")
+    parser.add_argument('--tolerance', type=float, default=20,
+                        help="Percentage a result can be worse "
+                             "than the baseline. Default: 20")
+    args = parser.parse_args()
+    settings = {key: getattr(args, key) for key in _setting_key_tuple}
+    options_kwargs = {'cache':       '',
+                      'autoname':    True,
+                      'segments':    args.segments,
+                      'metaworkers': args.threads,
+                      'linkworkers': args.threads,
+                      'dlworkers':   args.threads,
+                      'poolsize':    args.threads,
+                      # the stand-in needs no politeness
+                      'hostlimit':   [f'{host},0'
+                                      for host in default_host_limit_dict]}
+    result_dict = dict()
+    with StandInServer(latency=args.latency / 1000,
+                       bandwidth=args.bandwidth * 1024,
+                       error_rate=args.errors,
+                       throttle=args.throttle,
+                       file_size=args.size,
+                       seed=0) as server, \
+            route_requests(server):
+        options_kwargs['mirror'] = server.mirror_url
+        scenario_list = [
+            (f'single/{repo_name}',
+             make_identifiers(repo_name, args.runs),
+             False)
+            for repo_name in identifier_format_dict
+        ]
+        # documents of all repos, interleaved
+        repo_count = len(identifier_format_dict)
+        scenario_list.append((
+            'batch',
+            [identifier
+             for identifier_tuple in zip(*(
+                 make_identifiers(repo_name,
+                                  -(-args.docs // repo_count),
+                                  start=args.runs)
+                 for repo_name in identifier_format_dict))
+             for identifier in identifier_tuple][:args.docs],
+            True))
+        for name, identifiers, is_batch in scenario_list:
+            with tempfile.TemporaryDirectory() as work_dir:
+                result_dict[name] = run_scenario(identifiers,
+                                                 options_kwargs,
+                                                 Path(work_dir),
+                                                 is_batch)
+            print_result(name, result_dict[name])
+        shdlCore.http_transport.close()
+        print("Responses by host and status: "
+              f"{server.response_stats()}")
+
+    if args.save is not None:
+        Path(args.save).write_text(json.dumps({'settings': settings,
+                                               'results':  result_dict},
+                                              indent=2) + '\n',
+                                   encoding='utf-8')
+        print(f"Baseline saved to {args.save}")
+    if args.baseline is not None:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        if baseline['settings'] != settings:
+            print("WARNING: baseline was measured with different settings: "
+                  f"{baseline['settings']}")
+        regression_list = compare_with_baseline(result_dict,
+                                                baseline['results'],
+                                                args.tolerance / 100)
+        if len(regression_list) != 0:
+            print(f"Worse than the baseline by more than "
+                  f"{args.tolerance:g}%:")
+            for regression in regression_list:
+                print(f"    {regression}")
+            sys.exit(1)
+        print(f"No result worse than the baseline by more than "
+              f"{args.tolerance:g}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,20 @@
+import json
+from typing import Iterable, Iterator, NamedTuple
+
 from shdlCore.src import *
 
 
-def main():
+def _classify_identifier(raw_identifier: str):
+    with trace_span('classify', identifier=raw_identifier) as classify_span:
+        repo_obj = _find_repo(raw_identifier)
+        classify_span.repo = repo_obj.repo_name
+        classify_span.identifier = repo_obj.identifier
+    info_print(f"Detected identifier type: {PColor.INFO(repo_obj.repo_name)}")
+    info_print(f"Sanitized identifier: {PColor.PATH(repo_obj.identifier)}")
+    return repo_obj
+
+
+def _find_repo(raw_identifier: str):
     # check repo
     test_repo_list = registered_repo_list
     if cliArg['type'] is not None:
@@ -9,28 +22,40 @@ def main():
                    + PColor.INFO(cliArg['type']))
         test_repo_list = (registered_repo_list[
                               registered_repo_name.index(cliArg['type'])],)
-        cliArg['identifier'] = cliArg['type'] + ": " + cliArg['identifier']
+        raw_identifier = cliArg['type'] + ": " + raw_identifier
     repo_obj = next((obj
                      for cls in test_repo_list
-                     if (obj := cls(cliArg['identifier'])).is_query_valid),
+                     if (obj := cls(raw_identifier)).is_query_valid),
                     None)
     if repo_obj is None:
         if cliArg['type'] is None:
             console_print(PColor.WARNING("WARNING:"), end=" ")
             console_print("Input query format not recognized. "
                           "Assuming it is sanitized DOI")
-            repo_obj = DOIRepoHandler('doi: ' + cliArg['identifier'])
+            repo_obj = DOIRepoHandler('doi: ' + raw_identifier)
         else:
-            quit_with_error(ErrorType.QUERY_INVALID,
+            raise ShdlError(ErrorType.QUERY_INVALID,
                             error_msg=f"Input identifier is not a valid "
                                       f"identifier of type {cliArg['type']}")
-    info_print(f"Detected identifier type: {PColor.INFO(repo_obj.repo_name)}")
-    info_print(f"Sanitized identifier: {PColor.PATH(repo_obj.identifier)}")
+    return repo_obj
+
+
+def _is_metadata_needed() -> bool:
+    # metadata is only used for autoname and debug display
+    return (cliArg['output'] is None and cliArg['autoname']) \
+        or cliArg['verbose'] >= VerboseLevel.DEBUG
+
+
+def _resolve_proposed_name(repo_obj) -> Optional[str]:
+    if not _is_metadata_needed():
+        console_print("Metadata not needed. Skipped",
+                      msg_verbose_level=VerboseLevel.VERBOSE)
+        return cliArg['output']
 
     # check metadata
     console_print("Metadata response: ", msg_verbose_level=VerboseLevel.DEBUG)
     if not repo_obj.is_meta_response_valid:
-        quit_with_error(ErrorType.QUERY_INVALID,
+        raise ShdlError(ErrorType.QUERY_INVALID,
                         error_msg="No metadata found")
     for _k, _v in repo_obj.metadata.items():
         console_print(PColor.INFO(_k) + ": " + str(_v),
@@ -44,7 +69,6 @@ def main():
             console_print("Unable to fetch metadata "
                           f"for identifier {repo_obj.identifier}")
             console_print("Name falls back to remote name")
-            cliArg['autoname'] = False  # not really necessary
         else:
             assert isinstance(repo_obj.metadata, dict)
             assert 'title' in repo_obj.metadata
@@ -69,38 +93,414 @@ def main():
                 # as ext is yet not known
                 console_print("Proposed name: " + PColor.PATH(proposed_name),
                               msg_verbose_level=VerboseLevel.VERBOSE)
+    return proposed_name
 
-    # get download link
+
+def _get_usable_mirrors(repo_obj) -> Tuple[str]:
     if len(repo_obj.mirror_list) == 0:
-        quit_with_error(
+        raise ShdlError(
             ErrorType.ARG_INVALID,
             error_msg="No known mirror. "
                       "Please specify mirrors with --mirror switch"
         )
     # assert len(repo_obj.mirror_list) != 0
+    return mirror_health.usable_mirrors(repo_obj.mirror_list)
 
-    dl_url = next(
-        (lnk
-         for mirrorURL in repo_obj.mirror_list
-         if (lnk := repo_obj.get_download_url(mirrorURL)) is not None),
-        None
-    )
+
+def _check_download_url(dl_url: Optional[str]) -> str:
     if dl_url is None:
-        quit_with_error(ErrorType.FILE_NOT_FOUND)
+        raise ShdlError(ErrorType.FILE_NOT_FOUND)
     console_print("Download link: " + PColor.PATH(dl_url),
                   msg_verbose_level=VerboseLevel.VERBOSE)
+    return dl_url
 
-    # download
+
+def _resolve_download_url(repo_obj) -> str:
+    # get download link
+    mirror_list = _get_usable_mirrors(repo_obj)
+    if cliArg['race'] and len(mirror_list) > 1:
+        dl_url = repo_obj.race_download_url(mirror_list)
+    else:
+        dl_url = next(
+            (lnk
+             for mirrorURL in mirror_list
+             if (lnk := repo_obj.get_download_url(mirrorURL)) is not None),
+            None
+        )
+    return _check_download_url(dl_url)
+
+
+async def _async_resolve_download_url(repo_obj) -> str:
+    # same as _resolve_download_url
+    mirror_list = _get_usable_mirrors(repo_obj)
+    if cliArg['race'] and len(mirror_list) > 1:
+        dl_url = await repo_obj.async_race_download_url(mirror_list)
+    else:
+        dl_url = None
+        for mirrorURL in mirror_list:
+            if (dl_url := await repo_obj.async_get_download_url(mirrorURL)) \
+                    is not None:
+                break
+    return _check_download_url(dl_url)
+
+
+def _get_download_path(dl_url: str, proposed_name: Optional[str]) -> Path:
     if proposed_name is None:
         proposed_name = dl_url.rsplit('/', 1)[-1].rsplit('.', 1)[0]
     download_path = cliArg['dir'] / (
             proposed_name + '.' + dl_url.rsplit('.', 1)[-1])
     console_print("Download path: " + PColor.PATH(str(download_path)),
                   msg_verbose_level=VerboseLevel.VERBOSE)
-    if not fetch_url_to_local_path(dl_url, download_path):
-        quit_with_error(ErrorType.OUTPUT_ERROR,
-                        error_msg="Failed to download file ")
+    return download_path
+
+
+def _trace_download(repo_obj, dl_url: str):
+    return trace_span('download',
+                      repo=repo_obj.repo_name,
+                      identifier=repo_obj.identifier,
+                      url=dl_url)
+
+
+def _download_document(repo_obj,
+                       dl_url: str,
+                       proposed_name: Optional[str]) -> Path:
+    # download
+    download_path = _get_download_path(dl_url, proposed_name)
+    with _trace_download(repo_obj, dl_url) as download_span:
+        if not fetch_url_to_local_path(dl_url, download_path):
+            # the link may have expired
+            link_cache.forget_link(repo_obj.repo_name,
+                                   repo_obj.identifier,
+                                   dl_url)
+            raise ShdlError(ErrorType.OUTPUT_ERROR,
+                            error_msg="Failed to download file ")
+        if download_path.is_file():
+            download_span.bytes = download_path.stat().st_size
+    return download_path
+
+
+def _create_batch_pipeline() -> StagedPipeline:
+    # each document is passed on as soon as a stage is done with it
+    # so a slow download does not hold up metadata of other documents
+    # the deadline of each document is passed along
+    # and only counts time spent in stages
+    # documents waiting for metadata are fetched together where possible
+    # a network error fails only its document
+    metadata_batcher = MetadataBatcher(cliArg['metabatch'])
+
+    def classify(raw_identifier: str):
+        info_print(f"Fetching {PColor.ID(raw_identifier)}")
+        with Deadline.for_document().applied() as deadline:
+            repo_obj = _classify_identifier(raw_identifier)
+            if _is_metadata_needed():
+                metadata_batcher.add(repo_obj)
+            return deadline, repo_obj
+
+    def resolve_name(stage_input):
+        deadline, repo_obj = stage_input
+        with deadline.applied(), network_error_as_shdl_error():
+            if _is_metadata_needed():
+                metadata_batcher.fetch(repo_obj)
+            return deadline, repo_obj, _resolve_proposed_name(repo_obj)
+
+    def resolve_url(stage_input):
+        deadline, repo_obj, proposed_name = stage_input
+        with deadline.applied(), network_error_as_shdl_error():
+            return (deadline, repo_obj, _resolve_download_url(repo_obj),
+                    proposed_name)
+
+    def download(stage_input):
+        deadline, repo_obj, dl_url, proposed_name = stage_input
+        with deadline.applied(), network_error_as_shdl_error():
+            return _download_document(repo_obj, dl_url, proposed_name)
+
+    return StagedPipeline(
+        (PipelineStage('classify', classify, 1),
+         # so that a chunk of metadata requests can fill
+         PipelineStage('metadata', resolve_name, cliArg['metaworkers'],
+                       max(cliArg['queuesize'], cliArg['metabatch'])),
+         PipelineStage('link', resolve_url, cliArg['linkworkers']),
+         PipelineStage('download', download, cliArg['dlworkers'])),
+        queue_size=cliArg['queuesize']
+    )
+
+
+def fetch_document(raw_identifier: str) -> Path:
+    """
+    Fetch a single document with the configured pipeline
+
+    :param raw_identifier: str.
+        The raw identifier as inputted by user
+    :return: Path.
+        The path the document is downloaded to
+    :raise ShdlError: if the document cannot be fetched
+    """
+    with Deadline.for_document().applied(), network_error_as_shdl_error():
+        repo_obj = _classify_identifier(raw_identifier)
+        proposed_name = _resolve_proposed_name(repo_obj)
+        dl_url = _resolve_download_url(repo_obj)
+        return _download_document(repo_obj, dl_url, proposed_name)
+
+
+async def async_fetch_document(raw_identifier: str) -> Path:
+    """
+    Async version of fetch_document
+
+    :param raw_identifier: str.
+        The raw identifier as inputted by user
+    :return: Path.
+        The path the document is downloaded to
+    :raise ShdlError: if the document cannot be fetched
+    """
+    with Deadline.for_document().applied(), \
+            async_network_error_as_shdl_error():
+        repo_obj = _classify_identifier(raw_identifier)
+        if _is_metadata_needed():
+            # so that metadata is not fetched blocking
+            # in _resolve_proposed_name
+            await repo_obj.async_get_metadata()
+        proposed_name = _resolve_proposed_name(repo_obj)
+        dl_url = await _async_resolve_download_url(repo_obj)
+        download_path = _get_download_path(dl_url, proposed_name)
+        with _trace_download(repo_obj, dl_url) as download_span:
+            if not await async_fetch_url_to_local_path(dl_url,
+                                                       download_path):
+                link_cache.forget_link(repo_obj.repo_name,
+                                       repo_obj.identifier,
+                                       dl_url)
+                raise ShdlError(ErrorType.OUTPUT_ERROR,
+                                error_msg="Failed to download file ")
+            if download_path.is_file():
+                download_span.bytes = download_path.stat().st_size
+        return download_path
+
+
+class FetchOptions:
+    """
+    Arguments for fetch and fetch_many
+
+    Keyword arguments are named after the long commandline switches,
+    e.g. FetchOptions(mirror=['sci-hub.st'], dir='~/papers', autoname=True).
+    Unlike the commandline, no config file is read unless config is given,
+    and nothing is printed unless piping=False is given.
+
+    An instance can be reused, and shared between threads
+    """
+
+    def __init__(self, **kwargs):
+        """
+        :raise ShdlError: if arguments are invalid
+        """
+        arg_dict = default_arg_dict()
+        arg_dict.update(config='', piping=True)
+        unknown_key_list = sorted(set(kwargs) - set(arg_dict))
+        if len(unknown_key_list) != 0:
+            raise ShdlError(ErrorType.ARG_INVALID,
+                            error_msg="Unknown options: "
+                                      + ', '.join(unknown_key_list))
+        arg_dict.update(kwargs)
+        for list_key in ('mirror', 'hostlimit'):
+            if isinstance(arg_dict[list_key], str):
+                arg_dict[list_key] = [arg_dict[list_key]]
+        for path_key in ('dir', 'cache', 'trace', 'profile'):
+            if isinstance(arg_dict[path_key], Path):
+                arg_dict[path_key] = str(arg_dict[path_key])
+        with use_arg_dict(arg_dict):
+            process_cli_arg()
+        self.arg_dict = arg_dict
+
+
+class FetchResult(NamedTuple):
+    """
+    Result of fetching a document
+
+    status is ErrorType.SUCCEED if the document is fetched,
+    path is where it is saved (None if failed)
+    """
+    identifier: str
+    status: ErrorType
+    path: Optional[Path]
+    message: str
+
+    @property
+    def ok(self) -> bool:
+        return self.status == ErrorType.SUCCEED
+
+
+def _to_fetch_result(identifier: str,
+                     download_path: Optional[Path] = None,
+                     error: Optional[ShdlError] = None) -> FetchResult:
+    if error is None:
+        return FetchResult(identifier, ErrorType.SUCCEED, download_path,
+                           ErrorType.SUCCEED.description())
+    return FetchResult(identifier, error.error_type, None, error.error_msg)
+
+
+def fetch(identifier: str,
+          options: Optional[FetchOptions] = None) -> FetchResult:
+    """
+    Fetch a document without using commandline arguments
+
+    Safe to call repeatedly and from multiple threads.
+    Failures, including network errors, are returned in the result
+
+    :param identifier: str.
+        The raw identifier, in any format accepted by commandline
+    :param options: FetchOptions, or None.
+        The arguments used. If None, will use the defaults
+    :return: FetchResult.
+    """
+    if options is None:
+        options = FetchOptions()
+    with use_arg_dict(options.arg_dict), profile_by_arg():
+        try:
+            download_path = fetch_document(identifier)
+        except ShdlError as e:
+            return _to_fetch_result(identifier, error=e)
+    return _to_fetch_result(identifier, download_path=download_path)
+
+
+async def async_fetch(identifier: str,
+                      options: Optional[FetchOptions] = None) -> FetchResult:
+    """
+    Async version of fetch
+
+    Needs the package aiohttp.
+    Many documents can be fetched concurrently in one event loop,
+    e.g. with asyncio.gather.
+    Call async_http_transport.close() before the event loop ends
+
+    :param identifier: str.
+        The raw identifier, in any format accepted by commandline
+    :param options: FetchOptions, or None.
+        The arguments used. If None, will use the defaults
+    :return: FetchResult.
+    """
+    if options is None:
+        options = FetchOptions()
+    with use_arg_dict(options.arg_dict):
+        try:
+            download_path = await async_fetch_document(identifier)
+        except ShdlError as e:
+            return _to_fetch_result(identifier, error=e)
+    return _to_fetch_result(identifier, download_path=download_path)
+
+
+def fetch_many(identifiers: Iterable[str],
+               options: Optional[FetchOptions] = None) \
+        -> Iterator[FetchResult]:
+    """
+    Fetch documents concurrently without using commandline arguments
+
+    Documents go through the same staged pipeline as in batch mode,
+    with worker counts given by options.
+    Identifiers are consumed lazily,
+    and each result is yielded as soon as the document is done
+
+    :param identifiers: Iterable[str].
+        The raw identifiers
+    :param options: FetchOptions, or None.
+        The arguments used. If None, will use the defaults
+    :return: Iterator[FetchResult].
+        The results, in the order the documents are done
+    """
+    if options is None:
+        options = FetchOptions()
+    with use_arg_dict(options.arg_dict):
+        job_profile = profile_by_arg()
+    # profiling starts before workers so that they are profiled,
+    # and ends when all results are yielded
+    with job_profile:
+        # workers copy the context when started, so it need not stay set
+        with use_arg_dict(options.arg_dict):
+            result_iter = _create_batch_pipeline().run(identifiers)
+        for identifier, download_path, error in result_iter:
+            if error is not None and not isinstance(error, ShdlError):
+                # not a failure of the document, but a bug
+                raise error
+            yield _to_fetch_result(identifier, download_path, error)
+
+
+def _print_batch_record(raw_identifier: str,
+                        download_path: Optional[Path] = None,
+                        error: Optional[ShdlError] = None) -> None:
+    if cliArg['piping']:
+        # one JSON object per line for scripts
+        console_print(json.dumps({
+            'identifier': raw_identifier,
+            'status':     int(ErrorType.SUCCEED
+                              if error is None
+                              else error.error_type),
+            'path':       (None
+                           if download_path is None
+                           else str(download_path)),
+            'message':    (ErrorType.SUCCEED.description()
+                           if error is None
+                           else error.error_msg),
+        }), print_suppress=False, flush=True)
+    elif error is None:
+        console_print(f"{PColor.INFO('Done:')} {raw_identifier} -> "
+                      + PColor.PATH(str(download_path)), flush=True)
+    else:
+        console_print(f"{PColor.ERROR('Failed:')} {raw_identifier} "
+                      f"({error.error_msg})", flush=True)
+
+
+def _print_host_stats() -> None:
+    console_print("Requests sent: ", msg_verbose_level=VerboseLevel.VERBOSE)
+    for host, host_stat in http_transport.host_stats().items():
+        console_print(f"{PColor.PATH(host)}: {host_stat['requests']} "
+                      f"({host_stat['errors']} failed)",
+                      msg_verbose_level=VerboseLevel.VERBOSE)
+
+
+def main():
+    setup()
+    console_print(PColor.INFO("Setup done"),
+                  msg_verbose_level=VerboseLevel.INFO)
+    try:
+        with profile_by_arg(), cassette_by_arg():
+            _main()
+    finally:
+        _print_host_stats()
+        http_transport.close()
+        close_tracers()
+
 
+def _main():
+    if not cliArg['isBatch']:
+        raw_identifier = next(iter_identifiers())
+        try:
+            download_path = fetch_document(raw_identifier)
+        except ShdlError as e:
+            quit_with_error(e.error_type, error_msg=e.error_msg)
+        if cliArg['piping'] and not cliArg['dryrun']:
+            console_print(str(download_path.resolve(True)),
+                          print_suppress=False)
+        return
 
-console_print(PColor.INFO("Setup done"),
-              msg_verbose_level=VerboseLevel.INFO)
+    # batch mode: setup is done only once for all identifiers
+    first_error = None
+    doc_count = 0
+    fail_count = 0
+    for raw_identifier, download_path, error \
+            in _create_batch_pipeline().run(iter_identifiers()):
+        doc_count += 1
+        if error is None:
+            _print_batch_record(raw_identifier,
+                                download_path=download_path)
+            continue
+        if not isinstance(error, ShdlError):
+            raise error
+        fail_count += 1
+        if first_error is None:
+            first_error = error
+        _print_batch_record(raw_identifier, error=error)
+    info_print(f"Batch done. {doc_count - fail_count} of {doc_count} "
+               "documents fetched")
+    if (tracer := get_tracer()) is not None:
+        tracer.print_summary()
+    if first_error is not None:
+        quit_with_error(first_error.error_type,
+                        error_msg=f"{fail_count} of {doc_count} "
+                                  "documents failed")
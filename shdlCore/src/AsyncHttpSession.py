@@ -0,0 +1,426 @@
+import asyncio
+import time
+import weakref
+from collections import Counter
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from contextvars import copy_context
+from datetime import timedelta
+from typing import Any, AsyncIterator, Dict, Iterator, Optional
+from urllib.parse import urlparse
+
+import requests as rq
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from .CommonUtil import *
+from .Hedging import hedge_policy
+from .HostScheduler import host_scheduler
+from .HttpSession import RequestSteps, StepsRace, _RaceTally, \
+    http_transport, network_error_as_shdl_error
+from .RequestTimeout import RequestKind, check_deadline, get_remaining_time, \
+    get_request_timeout
+from .RetryPolicy import retry_policy
+
+
+# aiohttp (and aiohttp_socks) are optional dependencies
+# only imported when used, as they are slow to import
+
+
+@contextmanager
+def _as_requests_error():
+    # so that handlers catch the same exceptions with either transport
+    import aiohttp
+    try:
+        yield
+    except aiohttp.ClientProxyConnectionError as e:
+        raise rq.exceptions.ProxyError(str(e)) from e
+    except aiohttp.InvalidURL as e:
+        raise rq.exceptions.InvalidURL(str(e)) from e
+    except (aiohttp.ServerTimeoutError, asyncio.TimeoutError) as e:
+        raise rq.exceptions.Timeout(str(e)) from e
+    except aiohttp.ClientConnectionError as e:
+        raise rq.exceptions.ConnectionError(str(e)) from e
+    except aiohttp.ClientError as e:
+        raise rq.exceptions.RequestException(str(e)) from e
+
+
+def _import_aiohttp():
+    try:
+        import aiohttp
+    except ImportError:
+        raise ShdlError(ErrorType.ARG_INVALID,
+                        error_msg="Package aiohttp is needed "
+                                  "for async fetching")
+    return aiohttp
+
+
+@contextmanager
+def async_network_error_as_shdl_error() -> Iterator[None]:
+    """
+    Same as network_error_as_shdl_error,
+    also for aiohttp exceptions
+
+    :raise ShdlError: if aiohttp is not installed
+    """
+    _import_aiohttp()
+    with network_error_as_shdl_error(), _as_requests_error():
+        yield
+
+
+class AsyncStreamResponse:
+    """
+    A response whose body is read in chunks,
+    see AsyncHttpTransport.stream
+    """
+
+    def __init__(self, aio_response: 'aiohttp.ClientResponse'):
+        self._aio_response = aio_response
+        self.status_code = aio_response.status
+        self.headers = CaseInsensitiveDict(aio_response.headers)
+        self.url = str(aio_response.url)
+
+    async def iter_content(self, chunk_size: int) -> AsyncIterator[bytes]:
+        """
+        Iterate over the body
+
+        :param chunk_size: int.
+            The maximum size of each chunk, in bytes
+        :return: AsyncIterator[bytes]
+        """
+        with _as_requests_error():
+            async for data_chunk \
+                    in self._aio_response.content.iter_chunked(chunk_size):
+                yield data_chunk
+
+
+class AsyncHttpTransport:
+    """
+    The asyncio counterpart of HttpTransport, using aiohttp
+
+    Responses are read in full and returned as requests.Response,
+    and errors are raised as the corresponding requests exceptions,
+    so handlers parse responses and catch errors in the same way
+    with either transport.
+    A session (and so its connection pool) is kept
+    for each event loop and proxy.
+    Requests wait for their hosts to allow them,
+    temporary failures are retried,
+    and slow metadata requests and mirror queries may be hedged,
+    as in HttpTransport.
+    SOCKS proxies (e.g. Tor) need the package aiohttp-socks.
+    Requests can be sent through another session instead,
+    e.g. one recording or replaying them, see use_session.
+
+    Needs the package aiohttp.
+    ShdlError (ErrorType.ARG_INVALID) is raised on first use if not installed
+    """
+
+    def __init__(self):
+        # event loop -> {proxy URL: session}
+        self._session_dict = weakref.WeakKeyDictionary()
+        self._host_counter = Counter()
+        self._host_error_counter = Counter()
+        # set by use_session
+        self._session = None
+
+    @contextmanager
+    def use_session(self, session) -> Iterator[Optional[Any]]:
+        """
+        Send requests through another session within the context,
+        e.g. one recording or replaying them, see Cassette
+
+        :param session:
+            The session, whose request method is used
+            as in aiohttp.ClientSession
+        :return: Iterator[Any, or None].
+            Yields the session used before,
+            or None if it is the session of each event loop
+        """
+        previous_session, self._session = self._session, session
+        try:
+            yield previous_session
+        finally:
+            self._session = previous_session
+
+    def get_loop_session(self) -> 'aiohttp.ClientSession':
+        """
+        Get the session of the running event loop and the configured proxy,
+        created on first use
+
+        :return: aiohttp.ClientSession
+        """
+        aiohttp = _import_aiohttp()
+        proxy_url = (None
+                     if cliArg['proxy'] is None
+                     else cliArg['proxy']['https'])
+        loop_session_dict = self._session_dict.setdefault(
+            asyncio.get_running_loop(), dict())
+        if (session := loop_session_dict.get(proxy_url)) is not None \
+                and not session.closed:
+            return session
+        connector = None
+        if proxy_url is not None \
+                and urlparse(proxy_url).scheme.startswith('socks'):
+            try:
+                from aiohttp_socks import ProxyConnector
+            except ImportError:
+                raise ShdlError(ErrorType.ARG_INVALID,
+                                error_msg="Package aiohttp-socks is needed "
+                                          "for SOCKS proxy "
+                                          "in async fetching")
+            # socks5h: let the proxy resolve host names
+            connector = ProxyConnector.from_url(
+                proxy_url.replace('socks5h://', 'socks5://', 1),
+                rdns=urlparse(proxy_url).scheme == 'socks5h')
+        session = aiohttp.ClientSession(connector=connector)
+        loop_session_dict[proxy_url] = session
+        return session
+
+    @asynccontextmanager
+    async def _open(self, method: str, url: str, **kwargs) \
+            -> AsyncIterator['aiohttp.ClientResponse']:
+        kwargs['headers'] = {**cliArg['rqKwargs']['headers'],
+                             **kwargs.get('headers', dict())}
+        # SOCKS proxy is set in the session
+        if cliArg['proxy'] is not None \
+                and not cliArg['proxy']['https'].startswith('socks'):
+            kwargs['proxy'] = cliArg['proxy']['https']
+        aiohttp = _import_aiohttp()
+        timeout = kwargs.pop('timeout', RequestKind.METADATA)
+        host_name = urlparse(url).hostname or ''
+        attempt = 0
+        while True:
+            check_deadline()
+            retry_policy.check_host(host_name)
+            connect_timeout, read_timeout = get_request_timeout(timeout)
+            attempt_kwargs = {
+                **kwargs,
+                'timeout': aiohttp.ClientTimeout(sock_connect=connect_timeout,
+                                                 sock_read=read_timeout)
+            }
+            async with AsyncExitStack() as exit_stack:
+                try:
+                    aio_response = await exit_stack.enter_async_context(
+                        self._send(method, url, attempt_kwargs))
+                except rq.exceptions.RequestException as e:
+                    if (delay := retry_policy.get_retry_delay(
+                            host_name, attempt, error=e)) is None:
+                        raise
+                    retry_reason = str(e)
+                else:
+                    if (delay := retry_policy.get_retry_delay(
+                            host_name,
+                            attempt,
+                            status_code=aio_response.status,
+                            retry_after=aio_response.headers.get(
+                                'Retry-After'))) is None:
+                        yield aio_response
+                        return
+                    retry_reason = f"HTTP {aio_response.status}"
+            console_print(f"Request to {PColor.PATH(url)} failed "
+                          f"({retry_reason}). "
+                          f"Retrying in {delay :.1f} s",
+                          msg_verbose_level=VerboseLevel.VERBOSE)
+            if (remaining := get_remaining_time()) is not None:
+                # the deadline is checked again after waiting
+                delay = min(delay, max(remaining, 0))
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    @asynccontextmanager
+    async def _send(self, method: str, url: str, kwargs: dict) \
+            -> AsyncIterator['aiohttp.ClientResponse']:
+        # send a single attempt of the request
+        session = (self._session
+                   if self._session is not None
+                   else self.get_loop_session())
+        host = urlparse(url).netloc
+        self._host_counter[host] += 1
+        try:
+            with _as_requests_error():
+                async with host_scheduler.async_slot(
+                        urlparse(url).hostname or ''), \
+                        session.request(method, url, **kwargs) \
+                        as aio_response:
+                    yield aio_response
+        except rq.exceptions.ConnectionError:
+            self._host_error_counter[host] += 1
+            # raises ShdlError if the network is the problem
+            await asyncio.get_running_loop().run_in_executor(
+                None,
+                copy_context().run,
+                http_transport.check_network_connectivity)
+            raise
+        except rq.exceptions.RequestException:
+            self._host_error_counter[host] += 1
+            raise
+
+    async def request(self, method: str, url: str, **kwargs) -> rq.Response:
+        """
+        Send a request and read the whole response
+
+        :param method: str.
+            The HTTP method
+        :param url: str.
+            The URL to request
+        :param kwargs:
+            Other keyword arguments, as in requests.Session.request.
+            Headers given here are merged with the configured headers.
+            timeout can also be a RequestKind (default RequestKind.METADATA).
+            Proxy is always the configured one
+        :return: requests.Response
+        """
+        host_name = urlparse(url).hostname or ''
+        timeout = kwargs.get('timeout', RequestKind.METADATA)
+        if (hedge_delay := hedge_policy.get_hedge_delay(host_name,
+                                                        timeout)) is None:
+            return await self._read(method, url, **kwargs)
+        # send the request again if it has not answered after hedge_delay,
+        # and return whichever answers first
+        primary_task = asyncio.ensure_future(self._read(method, url, **kwargs))
+        task_set = {primary_task}
+        try:
+            done_set, _ = await asyncio.wait(task_set, timeout=hedge_delay)
+            if done_set or not hedge_policy.try_use_hedge():
+                return await primary_task
+            console_print(f"No response from {PColor.PATH(url)} "
+                          f"after {hedge_delay :.2f} s. "
+                          "Sending a hedged request",
+                          msg_verbose_level=VerboseLevel.VERBOSE)
+            task_set.add(asyncio.ensure_future(
+                self._read(method, url, **kwargs)))
+            pending_set = task_set
+            while pending_set:
+                done_set, pending_set = await asyncio.wait(
+                    pending_set, return_when=asyncio.FIRST_COMPLETED)
+                for task in done_set:
+                    if task.exception() is None:
+                        return task.result()
+            # both failed, report as if not hedged
+            return primary_task.result()
+        finally:
+            # cancel the slower request, or both if cancelled
+            for task in task_set:
+                task.cancel()
+
+    async def _read(self, method: str, url: str, **kwargs) -> rq.Response:
+        # send the request, retrying temporary failures, and read it
+        start_time = time.monotonic()
+        async with self._open(method, url, **kwargs) as aio_response:
+            elapsed = time.monotonic() - start_time
+            content = await aio_response.read()
+        hedge_policy.record_latency(urlparse(url).hostname or '',
+                                    kwargs.get('timeout',
+                                               RequestKind.METADATA),
+                                    time.monotonic() - start_time)
+        response = rq.Response()
+        response.status_code = aio_response.status
+        response.reason = aio_response.reason
+        response.headers = CaseInsensitiveDict(aio_response.headers)
+        response.url = str(aio_response.url)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.elapsed = timedelta(seconds=elapsed)
+        # the body is already read
+        response._content = content
+        return response
+
+    async def get(self, url: str, **kwargs) -> rq.Response:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> rq.Response:
+        return await self.request('POST', url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) \
+            -> AsyncIterator[AsyncStreamResponse]:
+        """
+        Send a request without reading the body
+
+        :param method: str.
+            The HTTP method
+        :param url: str.
+            The URL to request
+        :param kwargs:
+            Same as in self.request
+        :return: AsyncIterator[AsyncStreamResponse].
+            An async context manager giving the response
+        """
+        async with self._open(method, url, **kwargs) as aio_response:
+            yield AsyncStreamResponse(aio_response)
+
+    async def run_steps(self, request_steps: RequestSteps) -> Any:
+        """
+        Async version of HttpTransport.run_steps
+
+        :param request_steps: RequestSteps.
+            The generator of requests
+        :return:
+            The value returned by request_steps
+        """
+        try:
+            next_request = next(request_steps)
+            while True:
+                if isinstance(next_request, StepsRace):
+                    next_request = request_steps.send(
+                        await self._run_race(next_request))
+                    continue
+                try:
+                    response = await self.request(next_request.method,
+                                                  next_request.url,
+                                                  **next_request.kwargs)
+                except rq.exceptions.RequestException as e:
+                    next_request = request_steps.throw(e)
+                else:
+                    next_request = request_steps.send(response)
+        except StopIteration as e:
+            return e.value
+
+    async def _run_race(self, steps_race: StepsRace) -> Dict[int, Any]:
+        # same as HttpTransport._run_race, with a task for each steps
+        race_tally = _RaceTally(steps_race)
+        pending_dict = {
+            asyncio.ensure_future(self.run_steps(request_steps)): steps_idx
+            for steps_idx, request_steps
+            in enumerate(steps_race.steps_tuple)
+        }
+        try:
+            while not race_tally.is_decided:
+                done_set, _ = await asyncio.wait(
+                    pending_dict,
+                    timeout=race_tally.get_wait_timeout(),
+                    return_when=asyncio.FIRST_COMPLETED)
+                for future in done_set:
+                    steps_idx = pending_dict.pop(future)
+                    try:
+                        race_tally.add_result(steps_idx, future.result())
+                    except rq.exceptions.RequestException as e:
+                        race_tally.add_failure(steps_idx, e)
+        finally:
+            for future in pending_dict:
+                future.cancel()
+        return race_tally.result_dict
+
+    def host_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Get the number of requests sent to each host
+
+        :return: dict[str, dict[str, int]].
+            Maps host to a dict with keys 'requests' and 'errors'
+        """
+        return {
+            host: {'requests': count,
+                   'errors':   self._host_error_counter[host]}
+            for host, count in self._host_counter.items()
+        }
+
+    async def close(self) -> None:
+        """
+        Close the sessions of the running event loop
+        """
+        loop_session_dict = self._session_dict.pop(
+            asyncio.get_running_loop(), dict())
+        for session in loop_session_dict.values():
+            await session.close()
+
+
+async_http_transport = AsyncHttpTransport()
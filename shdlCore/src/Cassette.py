@@ -0,0 +1,381 @@
+import base64
+import json
+import threading
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from datetime import timedelta
+from typing import AsyncIterator, ContextManager, Deque, Dict, Iterator, \
+    List, Optional, Tuple, Union
+
+import requests as rq
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from .AsyncHttpSession import async_http_transport
+from .CommonUtil import *
+from .HttpSession import http_transport
+
+
+class UnrecordedRequestError(LookupError):
+    """
+    Raised when replaying a request that is not in the cassette
+
+    Not a requests exception, so that it is not retried or handled
+    as a network failure
+    """
+
+
+# request method, URL, body, Range header
+_InteractionKey = Tuple[str, str, Optional[str], Optional[str]]
+
+
+def _get_interaction_key(method: str,
+                         url: str,
+                         data=None,
+                         headers: Optional[dict] = None) -> _InteractionKey:
+    if data is not None and not isinstance(data, str):
+        data = json.dumps(data, sort_keys=True)
+    # parts of a segmented or resumed download differ only by range
+    return (method.upper(),
+            url,
+            data,
+            CaseInsensitiveDict(headers or dict()).get('Range'))
+
+
+class Cassette:
+    """
+    Request and response pairs, recorded from real requests
+    and replayed in place of them
+
+    Saved as a JSON file holding a list of interactions,
+    each with the request (method, url, data, range)
+    and the response (status, reason, url, headers, body).
+    Bodies are kept as text if they are UTF-8, and in base64 otherwise.
+
+    When replaying, each request is answered with the recorded responses
+    of the same method, URL, body and Range header, in the recorded order.
+    The last one is repeated if the request is sent more times
+    than recorded.
+    Requests of both transports (http_transport and async_http_transport)
+    are recorded and replayed
+    """
+
+    format_version = 1
+
+    def __init__(self, cassette_path: Union[str, Path]):
+        """
+        :param cassette_path: str, or Path.
+            The cassette file
+        """
+        self.cassette_path = Path(cassette_path).expanduser()
+        self._lock = threading.Lock()
+        self.interaction_list: List[dict] = list()
+
+    @classmethod
+    def load(cls, cassette_path: Union[str, Path]) -> 'Cassette':
+        """
+        Read a cassette file
+
+        :param cassette_path: str, or Path.
+            The cassette file
+        :return: Cassette
+        :raise ShdlError: if the file cannot be read or is invalid
+        """
+        cassette = cls(cassette_path)
+        try:
+            cassette_dict = json.loads(
+                cassette.cassette_path.read_text(encoding='utf-8'))
+            if cassette_dict.get('version') != cls.format_version:
+                raise ValueError("unknown version")
+            cassette.interaction_list = list(cassette_dict['interactions'])
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) \
+                as e:
+            raise ShdlError(ErrorType.ARG_INVALID,
+                            error_msg="Cannot read cassette "
+                                      f"{cassette.cassette_path}: {e}")
+        return cassette
+
+    def save(self) -> None:
+        """
+        Write the cassette file
+
+        :raise OSError: if the file cannot be written
+        """
+        with self._lock:
+            cassette_dict = {'version':      self.format_version,
+                             'interactions': list(self.interaction_list)}
+        self.cassette_path.write_text(
+            json.dumps(cassette_dict, indent=2, ensure_ascii=False) + '\n',
+            encoding='utf-8')
+
+    def record(self,
+               method: str,
+               url: str,
+               kwargs: dict,
+               response: rq.Response) -> None:
+        """
+        Add a request and its response
+
+        The body of the response is read
+
+        :param method: str.
+            The HTTP method
+        :param url: str.
+            The URL requested
+        :param kwargs: dict.
+            The other keyword arguments of the request
+        :param response: requests.Response.
+            The response
+        """
+        _, _, data, range_header = _get_interaction_key(
+            method, url, kwargs.get('data'), kwargs.get('headers'))
+        content = response.content
+        try:
+            body, body_encoding = content.decode('utf-8'), 'text'
+        except UnicodeDecodeError:
+            body, body_encoding = base64.b64encode(content).decode(), 'base64'
+        header_dict = {
+            key: value
+            for key, value in response.headers.items()
+            # the body is kept decoded
+            if key.lower() not in ('content-encoding', 'transfer-encoding',
+                                   'set-cookie')
+        }
+        if 'Content-Length' in response.headers:
+            header_dict['Content-Length'] = str(len(content))
+        with self._lock:
+            self.interaction_list.append({
+                'request':  {'method': method.upper(),
+                             'url':    url,
+                             'data':   data,
+                             'range':  range_header},
+                'response': {'status':        response.status_code,
+                             'reason':        response.reason,
+                             'url':           response.url,
+                             'headers':       header_dict,
+                             'body':          body,
+                             'body_encoding': body_encoding},
+            })
+
+    def get_replay_dict(self) -> Dict[_InteractionKey, Deque[dict]]:
+        """
+        Get the recorded responses of each request
+
+        :return: dict[tuple, deque[dict]].
+            Maps (method, URL, body, Range header)
+            to the recorded responses, in order
+        """
+        replay_dict = defaultdict(deque)
+        with self._lock:
+            for interaction in self.interaction_list:
+                request_dict = interaction['request']
+                replay_dict[(request_dict['method'],
+                             request_dict['url'],
+                             request_dict.get('data'),
+                             request_dict.get('range'))].append(
+                    interaction['response'])
+        return replay_dict
+
+    @contextmanager
+    def recording(self) -> Iterator['Cassette']:
+        """
+        Record requests sent within the context,
+        and save the cassette when it ends
+
+        :return: Iterator[Cassette].
+            Yields self
+        """
+        recording_session = _RecordingSession(self)
+        async_recording_session = _AsyncRecordingSession(self)
+        with http_transport.use_session(recording_session) \
+                as previous_session, \
+                async_http_transport.use_session(async_recording_session) \
+                as async_previous_session:
+            # e.g. recording from a cassette being replayed
+            recording_session.inner_session = previous_session
+            async_recording_session.inner_session = async_previous_session
+            try:
+                yield self
+            finally:
+                recording_session.close()
+                try:
+                    self.save()
+                except OSError as e:
+                    console_print(PColor.ERROR("ERROR:"), end=" ")
+                    console_print(f"Cannot write cassette: {e}")
+                else:
+                    info_print(f"{len(self.interaction_list)} requests "
+                               "recorded to "
+                               + PColor.PATH(str(self.cassette_path)))
+
+    @contextmanager
+    def replaying(self) -> Iterator['Cassette']:
+        """
+        Answer requests sent within the context
+        from the cassette, without using the network
+
+        :return: Iterator[Cassette].
+            Yields self
+        :raise UnrecordedRequestError: if a request is not in the cassette
+        """
+        # both transports take the responses from the same queues
+        replay_session = _ReplaySession(self)
+        with http_transport.use_session(replay_session), \
+                async_http_transport.use_session(
+                    _AsyncReplaySession(replay_session)):
+            yield self
+
+
+class _RecordingSession:
+    # used in place of requests.Session, recording what it sends
+
+    def __init__(self, cassette: Cassette):
+        self._cassette = cassette
+        self._lock = threading.Lock()
+        # the session sending the requests,
+        # created on first use (with the arguments of the request) if None
+        self.inner_session = None
+        self._own_session: Optional[rq.Session] = None
+
+    def request(self, method: str, url: str, **kwargs) -> rq.Response:
+        with self._lock:
+            if self.inner_session is None:
+                self.inner_session = self._own_session \
+                    = http_transport.create_session()
+            session = self.inner_session
+        response = session.request(method, url, **kwargs)
+        self._cassette.record(method, url, kwargs, response)
+        return response
+
+    def get(self, url: str, **kwargs) -> rq.Response:
+        return self.request('GET', url, **kwargs)
+
+    def close(self) -> None:
+        # only the session created here,
+        # the one used before is still used after recording
+        with self._lock:
+            if self._own_session is not None:
+                self._own_session.close()
+                self._own_session = None
+
+
+class _ReplaySession:
+    # used in place of requests.Session, answering from a cassette
+
+    def __init__(self, cassette: Cassette):
+        self._lock = threading.Lock()
+        self._replay_dict = cassette.get_replay_dict()
+
+    def request(self, method: str, url: str, **kwargs) -> rq.Response:
+        interaction_key = _get_interaction_key(method,
+                                               url,
+                                               kwargs.get('data'),
+                                               kwargs.get('headers'))
+        with self._lock:
+            if len(response_queue := self._replay_dict.get(interaction_key,
+                                                           ())) == 0:
+                raise UnrecordedRequestError(f"{method.upper()} {url} "
+                                             "is not in the cassette")
+            response_dict = (response_queue.popleft()
+                             if len(response_queue) > 1
+                             else response_queue[0])
+        response = rq.Response()
+        response.status_code = response_dict['status']
+        response.reason = response_dict.get('reason')
+        response.headers = CaseInsensitiveDict(response_dict['headers'])
+        response.url = response_dict['url']
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.elapsed = timedelta(0)
+        # the body is already read, also when streamed
+        response._content = (
+            base64.b64decode(response_dict['body'])
+            if response_dict.get('body_encoding') == 'base64'
+            else response_dict['body'].encode('utf-8'))
+        response._content_consumed = True
+        return response
+
+    def get(self, url: str, **kwargs) -> rq.Response:
+        return self.request('GET', url, **kwargs)
+
+    def close(self) -> None:
+        pass
+
+
+class _AsyncResponse:
+    # used in place of aiohttp.ClientResponse, with the body already read
+
+    def __init__(self, response: rq.Response):
+        self.status = response.status_code
+        self.reason = response.reason
+        self.headers = response.headers
+        self.url = response.url
+        self.content = _AsyncContent(response.content)
+
+    async def read(self) -> bytes:
+        return self.content.data
+
+
+class _AsyncContent:
+    # used in place of aiohttp.StreamReader
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def iter_chunked(self, chunk_size: int) -> AsyncIterator[bytes]:
+        for chunk_start in range(0, len(self.data), chunk_size):
+            yield self.data[chunk_start:chunk_start + chunk_size]
+
+
+class _AsyncRecordingSession:
+    # used in place of aiohttp.ClientSession, recording what it sends
+
+    def __init__(self, cassette: Cassette):
+        self._cassette = cassette
+        # the session sending the requests,
+        # the session of the event loop if None
+        self.inner_session = None
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, **kwargs) \
+            -> AsyncIterator[_AsyncResponse]:
+        session = (self.inner_session
+                   if self.inner_session is not None
+                   else async_http_transport.get_loop_session())
+        async with session.request(method, url, **kwargs) as aio_response:
+            # the body is read to be recorded, also when streamed
+            response = rq.Response()
+            response.status_code = aio_response.status
+            response.reason = aio_response.reason
+            response.headers = CaseInsensitiveDict(aio_response.headers)
+            response.url = str(aio_response.url)
+            response._content = await aio_response.read()
+        self._cassette.record(method, url, kwargs, response)
+        yield _AsyncResponse(response)
+
+
+class _AsyncReplaySession:
+    # used in place of aiohttp.ClientSession, answering from a cassette
+
+    def __init__(self, replay_session: _ReplaySession):
+        self._replay_session = replay_session
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, **kwargs) \
+            -> AsyncIterator[_AsyncResponse]:
+        yield _AsyncResponse(
+            self._replay_session.request(method, url, **kwargs))
+
+
+def cassette_by_arg() -> ContextManager:
+    """
+    Record to cliArg['record'], or replay cliArg['replay']
+
+    :return: ContextManager.
+        Cassette.recording or Cassette.replaying,
+        or a context doing nothing if neither is given
+    """
+    if cliArg['record'] is not None:
+        return Cassette(cliArg['record']).recording()
+    if cliArg['replay'] is not None:
+        return cliArg['replay'].replaying()
+    return nullcontext()
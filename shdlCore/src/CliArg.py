@@ -1,8 +1,12 @@
 import argparse
-from pathlib import Path
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional
 
 # ONLY IMPORT THIS TO READ CLI ARGUMENTS
-# To get (processed) CLI arguments, import CommonUtil
+# Arguments are parsed and processed in CommonUtil.setup
+# Library calls use their own arguments, see use_arg_dict
 
 _parser = argparse.ArgumentParser(
     description="A simple script for downloading files by their identifiers",
@@ -21,11 +25,90 @@ _parser.add_argument(
 _parser.add_argument(
     "identifier",
     type=str,
+    nargs='*',
     help="The identifier of the document. "
          "If the string contains spaces, "
          "it must be quoted. "
          "Strings that are not recognized "
-         "will be taken as stripped DOI"
+         "will be taken as stripped DOI. "
+         "Can specify multiple identifiers to fetch them in one run"
+)
+_parser.add_argument(
+    "--batch", "-b",
+    type=str,
+    help="Read identifiers from this file, one per line, "
+         "after those given in commandline. "
+         "Use - to read from stdin. "
+         "Empty lines and lines starting with # are ignored"
+)
+_parser.add_argument(
+    "--metaworkers",
+    type=int,
+    help="In batch mode, "
+         "the number of documents whose metadata are fetched "
+         "at the same time. "
+         "Default: "
+         "4"
+)
+_parser.add_argument(
+    "--linkworkers",
+    type=int,
+    help="In batch mode, "
+         "the number of documents whose download links are found "
+         "at the same time. "
+         "Default: "
+         "4"
+)
+_parser.add_argument(
+    "--dlworkers",
+    type=int,
+    help="In batch mode, "
+         "the number of documents downloaded at the same time. "
+         "Default: "
+         "2"
+)
+_parser.add_argument(
+    "--queuesize",
+    type=int,
+    help="In batch mode, "
+         "the number of documents that can wait for each step. "
+         "Default: "
+         "8"
+)
+_parser.add_argument(
+    "--metabatch",
+    type=int,
+    help="In batch mode, "
+         "the number of documents whose metadata are fetched "
+         "in one request, for types that support it (arXiv, PMID). "
+         "1 to fetch each on its own. "
+         "Default: "
+         "20"
+)
+_parser.add_argument(
+    "--crossref",
+    type=str,
+    help="The base URL of the Crossref REST API. "
+         "In batch mode, the metadata of DOIs are fetched from its works "
+         "query, up to --metabatch DOIs in one request. "
+         "DOIs not found are fetched from doi.org on their own. "
+         "Pass an empty string to fetch all from doi.org. "
+         "Default: "
+         "https://api.crossref.org"
+)
+_parser.add_argument(
+    "--metapriority",
+    type=str,
+    help="Comma-separated metadata sources of DOIs, most preferred first, "
+         "from csl (doi.org), jstor, aims, royalsocpub and springer. "
+         "The publisher source of a DOI with a known publisher "
+         "is queried at the same time as doi.org, "
+         "and the most preferred complete metadata found "
+         "within --racewindow of the first is used. "
+         "Sources not listed are not used, "
+         "except csl, which is used last. "
+         "Default: "
+         "csl,jstor,aims,royalsocpub,springer"
 )
 _parser.add_argument(
     "--proxy", "-p",
@@ -48,6 +131,142 @@ _parser.add_argument(
          "Can specify multiple times to try "
          "different mirrors. "
 )
+_parser.add_argument(
+    "--race",
+    action='store_true',
+    help="Query all mirrors at the same time "
+         "and use the first download link found, "
+         "instead of trying them one by one"
+)
+_parser.add_argument(
+    "--racewindow",
+    type=int,
+    help="With --race, "
+         "wait this many milliseconds after the first link is found "
+         "for mirrors specified earlier, "
+         "and use their link instead if found. "
+         "Default: "
+         "0"
+)
+_parser.add_argument(
+    "--connecttimeout",
+    type=int,
+    help="Seconds to wait for a connection to a host. "
+         "Default: "
+         "15"
+)
+_parser.add_argument(
+    "--metatimeout",
+    type=int,
+    help="Seconds to wait for a response to a metadata request. "
+         "Default: "
+         "30"
+)
+_parser.add_argument(
+    "--probetimeout",
+    type=int,
+    help="Seconds to wait for a response "
+         "when checking if a mirror is online. "
+         "Default: "
+         "15"
+)
+_parser.add_argument(
+    "--querytimeout",
+    type=int,
+    help="Seconds to wait for a response to a mirror query. "
+         "Default: "
+         "30"
+)
+_parser.add_argument(
+    "--stalltimeout",
+    type=int,
+    help="Seconds to wait for more data while downloading a file "
+         "before the download is taken as failed. "
+         "Default: "
+         "60"
+)
+_parser.add_argument(
+    "--deadline",
+    type=int,
+    help="Seconds within which each document must be fetched, "
+         "including retries, or it is taken as failed. "
+         "In batch mode, time waiting for a free worker is not counted. "
+         "0 means no deadline. "
+         "Default: "
+         "0"
+)
+_parser.add_argument(
+    "--retries",
+    type=int,
+    help="Retry a request this many times "
+         "if it fails to connect, times out, "
+         "or gets a temporary error (HTTP 408, 429, 500, 502, 503, 504). "
+         "Interrupted downloads are resumed this many times. "
+         "Default: "
+         "3"
+)
+_parser.add_argument(
+    "--backoff",
+    type=int,
+    help="Wait up to this many milliseconds (chosen at random) "
+         "before the first retry, doubling for each later retry, "
+         "unless the server says how long to wait. "
+         "Default: "
+         "500"
+)
+_parser.add_argument(
+    "--breaker",
+    type=int,
+    help="After this many failed requests in a row to a host, "
+         "stop sending requests to it for --breakercooldown seconds. "
+         "0 means never. "
+         "Default: "
+         "5"
+)
+_parser.add_argument(
+    "--breakercooldown",
+    type=int,
+    help="Seconds before trying again a host "
+         "that is stopped by --breaker. "
+         "Default: "
+         "60"
+)
+_parser.add_argument(
+    "--hedge",
+    type=int,
+    help="Send a metadata request or mirror query again "
+         "if it has not answered within this percentile "
+         "of recent response times from the same host, "
+         "and use whichever answers first. "
+         "0 means never. "
+         "Default: "
+         "0"
+)
+_parser.add_argument(
+    "--hedgebudget",
+    type=int,
+    help="Send at most this many requests again with --hedge "
+         "for every 100 requests that may be hedged. "
+         "Default: "
+         "5"
+)
+_parser.add_argument(
+    "--hostlimit",
+    type=str,
+    action='append',
+    help="Limit requests to a host, "
+         "in the form HOST,RATE[,INFLIGHT[,BURST]]: "
+         "at most RATE requests per second on average "
+         "(BURST at once, default RATE rounded up), "
+         "and at most INFLIGHT requests at the same time "
+         "(default unlimited). "
+         "0 means unlimited. "
+         "Use * as HOST for hosts not listed, each limited separately. "
+         "Can specify multiple times for different hosts. "
+         "Default: "
+         "*,4,4 doi.org,5,4 api.crossref.org,5,1 "
+         "export.arxiv.org,0.333,1,1 eutils.ncbi.nlm.nih.gov,3,3,1"
+)
 _parser.add_argument(
     "--output", "-o",
     type=str,
@@ -73,6 +292,24 @@ _parser.add_argument(
          "Default: "
          "8192"
 )
+_parser.add_argument(
+    "--segments",
+    type=int,
+    help="Download a large file "
+         "with this many connections at the same time, "
+         "if the server supports it. "
+         "May help on high latency connections, e.g. Tor. "
+         "Default: "
+         "1"
+)
+_parser.add_argument(
+    "--poolsize",
+    type=int,
+    help="Maximum number of connections kept alive "
+         "for each remote host. "
+         "Default: "
+         "10"
+)
 _parser.add_argument(
     "--useragent",
     type=str,
@@ -129,6 +366,60 @@ _parser.add_argument(
     help="Do not actually write on disk or "
          "download the file"
 )
+_parser.add_argument(
+    "--trace",
+    type=str,
+    help="Append the timing of each stage of fetching "
+         "(with repo, host, status and bytes) "
+         "to this file as JSON lines, "
+         "and print a summary by stage and by host after a batch. "
+         "Default: "
+         "no trace"
+)
+_parser.add_argument(
+    "--profile",
+    type=str,
+    help="Profile CPU time with cProfile, "
+         "write the profile (pstats) to this file, "
+         "and a summary of the hot functions "
+         "to this file with .txt appended. "
+         "Default: "
+         "no profiling"
+)
+_parser.add_argument(
+    "--profilemem",
+    action='store_true',
+    help="With --profile, also trace memory allocations with tracemalloc "
+         "and add the top allocation sites to the summary. "
+         "Makes fetching much slower"
+)
+_parser.add_argument(
+    "--profiletop",
+    type=int,
+    help="The number of functions and allocation sites "
+         "in the --profile summary. "
+         "Default: "
+         "20"
+)
+_record_group = _parser.add_mutually_exclusive_group()
+_record_group.add_argument(
+    "--record",
+    type=str,
+    help="Record the requests sent and their responses "
+         "to this cassette file (JSON), "
+         "to be replayed with --replay. "
+         "Default: "
+         "no recording"
+)
+_record_group.add_argument(
+    "--replay",
+    type=str,
+    help="Answer requests from this cassette file "
+         "recorded with --record, without using the network. "
+         "Requests not in the file fail. "
+         "Default: "
+         "no replaying"
+)
 _parser.add_argument(
     "--config",
     type=str,
@@ -138,12 +429,80 @@ _parser.add_argument(
          "the following configs will have their"
          "default values read from this file"
          "if they are present: "
-         "proxy, mirror, dir, chunk, useragent, "
-         "autoname, autoformat, nocolor. "
+         "proxy, mirror, dir, chunk, segments, poolsize, useragent, "
+         "autoname, autoformat, nocolor, "
+         "cache, cachettl, cachesize, nocache, mirrorttl, linkttl, missttl, "
+         "race, racewindow, connecttimeout, metatimeout, probetimeout, "
+         "querytimeout, stalltimeout, deadline, "
+         "retries, backoff, breaker, breakercooldown, "
+         "hedge, hedgebudget, hostlimit, "
+         "metaworkers, linkworkers, dlworkers, queuesize, metabatch, "
+         "crossref, metapriority. "
          "Pass an empty string to disable this. "
          "Default: "
          "~/.shdlconfig"
 )
+_parser.add_argument(
+    "--cache",
+    type=str,
+    help="The path to the local cache database. "
+         "Fetched metadata are stored in it "
+         "and reused in later runs. "
+         "Pass an empty string to disable caching. "
+         "Default: "
+         "~/.shdlcache"
+)
+_parser.add_argument(
+    "--cachettl",
+    type=int,
+    help="Seconds before a cached metadata expires. "
+         "Default: "
+         "2592000 (30 days)"
+)
+_parser.add_argument(
+    "--cachesize",
+    type=int,
+    help="Maximum number of metadata kept in cache. "
+         "Least recently used ones are removed first. "
+         "Default: "
+         "10000"
+)
+_parser.add_argument(
+    "--nocache",
+    action='store_true',
+    help="Do not read from or write to the cache"
+)
+_parser.add_argument(
+    "--refreshcache",
+    action='store_true',
+    help="Do not read from the cache, "
+         "but store the newly fetched results in it"
+)
+_parser.add_argument(
+    "--mirrorttl",
+    type=int,
+    help="Seconds for which the recorded health of a mirror is trusted. "
+         "Mirrors that failed within this time are skipped, "
+         "and those online within this time are not checked again. "
+         "Default: "
+         "600"
+)
+_parser.add_argument(
+    "--linkttl",
+    type=int,
+    help="Seconds for which a download link found at a mirror "
+         "is reused from the cache instead of querying the mirror again. "
+         "Default: "
+         "3600"
+)
+_parser.add_argument(
+    "--missttl",
+    type=int,
+    help="Seconds for which a mirror that had no download link "
+         "for a document is not queried again for it. "
+         "Default: "
+         "604800 (7 days)"
+)
 _parser.add_argument(
     "--type",
     type=str,
@@ -162,4 +521,79 @@ _parser.add_argument(
 )
 
 
-cliArg = vars(_parser.parse_args())
+def default_arg_dict() -> dict:
+    """
+    Get a new dict of the (unprocessed) default arguments
+
+    :return: dict.
+    """
+    return vars(_parser.parse_args([]))
+
+
+# the commandline arguments, parser defaults until parse_cli_arg is called
+_process_arg_dict = default_arg_dict()
+_current_arg_dict = ContextVar('shdl_arg_dict', default=_process_arg_dict)
+
+
+class _ArgDictView(MutableMapping):
+    """
+    The argument dict used in the current context
+
+    Reads and writes go to the commandline arguments,
+    unless inside use_arg_dict,
+    so that library calls with different arguments can run
+    in the same process, or in different threads at the same time
+    """
+
+    def __getitem__(self, key):
+        return _current_arg_dict.get()[key]
+
+    def __setitem__(self, key, value):
+        _current_arg_dict.get()[key] = value
+
+    def __delitem__(self, key):
+        del _current_arg_dict.get()[key]
+
+    def __iter__(self):
+        return iter(_current_arg_dict.get())
+
+    def __len__(self):
+        return len(_current_arg_dict.get())
+
+    def __repr__(self):
+        return repr(_current_arg_dict.get())
+
+
+cliArg = _ArgDictView()
+
+
+@contextmanager
+def use_arg_dict(arg_dict: dict) -> Iterator[dict]:
+    """
+    Make cliArg refer to arg_dict within the context
+
+    Threads started inside should run in a copy of the current context
+    (see contextvars.copy_context) to see the same arguments
+
+    :param arg_dict: dict.
+        The argument dict
+    :return: Iterator[dict].
+        Yields arg_dict
+    """
+    token = _current_arg_dict.set(arg_dict)
+    try:
+        yield arg_dict
+    finally:
+        _current_arg_dict.reset(token)
+
+
+def parse_cli_arg(argv: Optional[List[str]] = None) -> None:
+    """
+    Parse commandline arguments into cliArg (in place)
+
+    :param argv: list[str], or None.
+        The commandline arguments. If None, will use sys.argv
+    """
+    parsed_arg = vars(_parser.parse_args(argv))
+    cliArg.clear()
+    cliArg.update(parsed_arg)
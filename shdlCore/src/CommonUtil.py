@@ -1,14 +1,10 @@
 from enum import Enum, IntEnum, unique
-from typing import Optional, NoReturn
+from typing import Iterator, List, Optional, NoReturn
 from pathlib import Path
 from urllib.parse import urlparse, urlunparse, unquote
 
-import requests as rq
+from .CliArg import cliArg, default_arg_dict, parse_cli_arg, use_arg_dict
 
-from .CliArg import cliArg
-
-
-# functions defined before cliArg postprocessing use only verbose, piping
 
 @unique
 class VerboseLevel(IntEnum):
@@ -29,8 +25,10 @@ def console_print(
         msg: str,
         *args,
         msg_verbose_level: VerboseLevel = VerboseLevel.PRINT,
-        print_suppress: bool = cliArg['piping'],
+        print_suppress: Optional[bool] = None,
         **kwargs) -> None:
+    if print_suppress is None:
+        print_suppress = cliArg['piping']
     if not print_suppress \
             and msg_verbose_level <= cliArg['verbose']:
         print(msg, *args, **kwargs)
@@ -71,97 +69,6 @@ class ErrorType(IntEnum):
         }.get(self.value, "UNKNOWN ERROR")
 
 
-console_print("Raw cli arguments: ",
-              msg_verbose_level=VerboseLevel.DEBUG)
-for _k, _v in cliArg.items():
-    console_print(f"{_k}: {str(_v)}",
-                  msg_verbose_level=VerboseLevel.DEBUG)
-
-# do cliArg postprocess
-
-_defaultDict = {
-    # default arguments for arg that may be overridden in shdlconfig
-    'useragent':  'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:78.0) '
-                  'Gecko/20100101 Firefox/78.0',
-    'autoformat': '[{authors}, {repo} {identifier}]{title}',
-    'dir':        '.',
-    'proxy':      '',
-    'chunk':      8192,
-}
-# check if has config file
-if cliArg['config'] != '':
-    configFileHandle = None
-    configDict = dict()
-    try:
-        # cannot use color print
-        configPath = Path(cliArg['config']).expanduser().resolve(strict=True)
-        console_print(f"Looking for config file {configPath}",
-                      msg_verbose_level=VerboseLevel.DEBUG)
-        if not configPath.is_file():
-            raise FileNotFoundError
-        configFileHandle = configPath.open('rt')
-        console_print("Config file opened",
-                      msg_verbose_level=VerboseLevel.DEBUG)
-        console_print(f"Reading config file {configPath}",
-                      msg_verbose_level=VerboseLevel.DEBUG)
-        for configLine in configFileHandle:
-            if '=' not in configLine:
-                continue
-            splittedLine = configLine.strip().split('=', 1)
-            lineHeader = splittedLine[0].lower()
-            lineContent = '' if len(splittedLine) <= 1 else splittedLine[1]
-            isValidHeader = True
-            if lineHeader in ('proxy', 'dir', 'useragent', 'autoformat'):
-                configDict[lineHeader] = lineContent
-            elif lineHeader == 'mirror':
-                if 'mirror' not in configDict:
-                    configDict['mirror'] = list((lineContent,))
-                else:
-                    configDict['mirror'].append(lineContent)
-            elif lineHeader == 'chunk':
-                # raise ValueError if casting fails
-                configDict['chunk'] = int(lineContent)
-            elif lineHeader in ('autoname', 'nocolor'):
-                configDict[lineHeader] = lineContent = True
-            else:
-                isValidHeader = False
-            if isValidHeader:
-                console_print(f"Config {lineHeader} found "
-                              f"with key {lineContent}",
-                              msg_verbose_level=VerboseLevel.DEBUG)
-        configFileHandle.close()
-        console_print(f"Config file specified {list(configDict.keys())}",
-                      msg_verbose_level=VerboseLevel.DEBUG)
-    except (FileNotFoundError, IsADirectoryError):
-        if cliArg['config'] == '~/.shdlconfig':  # is default
-            info_print("'~/.shdlconfig' not found")
-        else:
-            info_print("Config file not found "
-                       f"at {cliArg['config']}.")
-    except PermissionError:
-        info_print("ERROR:", end=" ")
-        info_print("Cannot read specified config file "
-                   f"{cliArg['config']}")
-    except (ValueError, RuntimeError):
-        # force close configFileHandle if possible
-        getattr(configFileHandle, 'close', lambda: None)()
-        info_print("ERROR:", end=" ")
-        info_print("Cannot parse config file. "
-                   "Will revert to CLI arguments")
-    else:
-        # config file read to configDict
-        _defaultDict.update(configDict)
-else:
-    console_print("No config file",
-                  msg_verbose_level=VerboseLevel.VERBOSE)
-
-# assign default parameter (may be overriden in config file)
-for _k, _v in _defaultDict.items():
-    if cliArg[_k] is None or cliArg[_k] is False:
-        cliArg[_k] = _v
-
-
-# default is applied, can define these two
 # print colors for xterm-256color
 class PColor(Enum):
     ID = '\033[94m'
@@ -173,7 +80,9 @@ class PColor(Enum):
 
     def __call__(self,
                  msg: str,
-                 color_display: bool = not cliArg['nocolor']) -> str:
+                 color_display: Optional[bool] = None) -> str:
+        if color_display is None:
+            color_display = not cliArg['nocolor']
         if not color_display:
             return msg
         else:
@@ -194,93 +103,389 @@ def quit_with_error(with_this_code: ErrorType = ErrorType.SUCCEED,
         sys.exit(int(with_this_code))
 
 
-# start checking parameters validity
-console_print("Start checking cli arguments",
-              msg_verbose_level=VerboseLevel.DEBUG)
-cliArg['identifier'] = unquote(cliArg['identifier'])
-assert isinstance(cliArg['dir'], str)
-try:
-    cliArg['dir'] = (
-            Path.cwd() / Path(cliArg['dir'].strip(" '\"")).expanduser()
-    ).resolve(strict=True)
-    if not cliArg['dir'].is_dir():
-        raise NotADirectoryError
-except (NotADirectoryError, FileNotFoundError):
-    quit_with_error(ErrorType.ARG_INVALID,
-                    error_msg=f"{str(cliArg['dir'])} is not a valid directory")
-
-if cliArg['mirror'] is None:
-    # should not quit without mirror: arxiv never needs one
-    # quit_with_error(ErrorType.ARG_INVALID,
-    #                 error_msg="No mirror provided. "
-    #                           "Please specify at least a mirror "
-    #                           "in commandline argument "
-    #                           "or in shdlconfig file")
-    cliArg['mirror'] = tuple()
-else:
-    cliArg['mirror'] = tuple(
-        # enforce https unless specified, dirty hack
-        urlunparse(
-            urlparse(('//' if '//' not in mirrorURL else '') + mirrorURL,
-                     scheme="https")
-        )
-        for mirrorURL in cliArg['mirror']
-    )
-
-if cliArg['proxy'] == '':
-    cliArg['proxy'] = None
-if cliArg['proxy'] is not None:
-    cliArg['proxy'] = {
-            'nop': None,
-            'tor': 'socks5h://127.0.0.1:9050',
-            'tbb': 'socks5h://127.0.0.1:9150',
-        }.get(cliArg['proxy'].lower(), cliArg['proxy'])
-    cliArg['proxy'] = { scheme: cliArg['proxy'] for scheme in ('http', 'https') } \
-        if cliArg['proxy'] is not None \
-        else None
-if cliArg['proxy'] is None:
-    console_print(PColor.WARNING.__call__("WARNING:"), end=" ",
-                  msg_verbose_level=VerboseLevel.INFO)
-    console_print("No proxy configured",
-                  msg_verbose_level=VerboseLevel.INFO)
-
-# network para
-cliArg['rqKwargs'] = {
-    'proxies': cliArg['proxy'],
-    'headers': {'User-Agent': cliArg['useragent'], }
+class ShdlError(Exception):
+    """
+    Error raised when fetching a single document fails
+
+    Carries the ErrorType so that the caller can decide whether to quit
+    (single document) or to record it and carry on (batch mode)
+    """
+
+    def __init__(self,
+                 error_type: ErrorType,
+                 error_msg: Optional[str] = None):
+        super().__init__(error_type.description()
+                         if error_msg is None
+                         else error_msg)
+        self.error_type = error_type
+        self.error_msg = str(self)
+
+
+def iter_identifiers() -> Iterator[str]:
+    """
+    Iterate over all identifiers to fetch
+
+    Identifiers given in commandline come first,
+    then those read line by line from the --batch file (or stdin).
+    The batch input is never read into memory as a whole
+
+    :return: Iterator[str].
+        The unquoted raw identifiers
+    """
+    for raw_identifier in cliArg['identifier']:
+        yield unquote(raw_identifier)
+    if cliArg['batch'] is None:
+        return
+    if cliArg['batch'] == '-':
+        import sys
+        batch_file_handle = sys.stdin
+    else:
+        batch_file_handle = cliArg['batch'].open('rt')
+    with batch_file_handle:
+        for batch_line in batch_file_handle:
+            batch_line = batch_line.strip()
+            if len(batch_line) == 0 or batch_line.startswith('#'):
+                continue
+            yield unquote(batch_line)
+
+
+class CliArgView:
+    """
+    Class attribute that always reads the current value of cliArg[key]
+
+    Used instead of reading cliArg when the class is defined,
+    which happens before setup
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+
+    def __get__(self, obj, obj_type=None):
+        return cliArg[self.key]
+
+
+_defaultDict = {
+    # default arguments for arg that may be overridden in shdlconfig
+    'useragent':  'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:78.0) '
+                  'Gecko/20100101 Firefox/78.0',
+    'autoformat': '[{authors}, {repo} {identifier}]{title}',
+    'dir':        '.',
+    'proxy':      '',
+    'chunk':      8192,
+    'segments':   1,
+    'poolsize':   10,
+    'cache':      '~/.shdlcache',
+    'cachettl':   30 * 24 * 60 * 60,
+    'cachesize':  10000,
+    'mirrorttl':  600,
+    'linkttl':    60 * 60,
+    'missttl':    7 * 24 * 60 * 60,
+    'racewindow': 0,
+    'connecttimeout': 15,
+    'metatimeout': 30,
+    'probetimeout': 15,
+    'querytimeout': 30,
+    'stalltimeout': 60,
+    'deadline':   0,
+    'retries':    3,
+    'backoff':    500,
+    'breaker':    5,
+    'breakercooldown': 60,
+    'hedge':      0,
+    'hedgebudget': 5,
+    'hostlimit':  tuple(),
+    'metaworkers': 4,
+    'linkworkers': 4,
+    'dlworkers':  2,
+    'queuesize':  8,
+    'metabatch':  20,
+    'crossref':   'https://api.crossref.org',
+    'metapriority': 'csl,jstor,aims,royalsocpub,springer',
+    'profiletop': 20,
 }
-info_print("Testing network connectivity ...")
-try:
-    rq.get('https://example.com/', **cliArg['rqKwargs'])
-except rq.exceptions.ProxyError:
-    quit_with_error(ErrorType.ARG_INVALID,
-                    error_msg="Proxy config is invalid")
-except rq.ConnectionError:
-    quit_with_error(ErrorType.NETWORK_ERROR,
-                    error_msg="Failed to connect to the internet. "
-                              + ("Maybe proxy is not setup correctly?"
-                                 if cliArg['proxy'] is not None
-                                 else ""))
-except Exception as e:
-    quit_with_error(ErrorType.NETWORK_ERROR,
-                    error_msg=("Unknown error occurred "
-                               "when testing network connectivity. \n"
-                               + str(e)))
-else:
-    if cliArg['proxy'] is not None:
-        info_print(f"Using proxy {cliArg['proxy']['https']}")
 
-if cliArg['type'] is not None:
-    cliArg['type'] = cliArg['type'].lower()
-    from .RepoHandler.RegisteredRepo import registered_repo_name
 
-    if cliArg['type'] not in registered_repo_name:
-        quit_with_error(ErrorType.ARG_INVALID,
-                        error_msg=f"Input type {cliArg['type']} does not "
-                                  "match any known repo name")
+def process_cli_arg() -> None:
+    """
+    Apply config file and defaults to cliArg, then check and normalize it
 
-console_print("Processed cli arguments: ",
-              msg_verbose_level=VerboseLevel.DEBUG)
-for _k, _v in cliArg.items():
-    console_print(PColor.INFO.__call__(_k) + ": " + str(_v),
+    :raise ShdlError: if arguments are invalid
+    """
+    console_print("Raw cli arguments: ",
                   msg_verbose_level=VerboseLevel.DEBUG)
+    for _k, _v in cliArg.items():
+        console_print(f"{_k}: {str(_v)}",
+                      msg_verbose_level=VerboseLevel.DEBUG)
+
+    defaultDict = dict(_defaultDict)
+    # check if has config file
+    if cliArg['config'] != '':
+        configFileHandle = None
+        configDict = dict()
+        try:
+            # cannot use color print
+            configPath = (Path(cliArg['config'])
+                          .expanduser()
+                          .resolve(strict=True))
+            console_print(f"Looking for config file {configPath}",
+                          msg_verbose_level=VerboseLevel.DEBUG)
+            if not configPath.is_file():
+                raise FileNotFoundError
+            configFileHandle = configPath.open('rt')
+            console_print("Config file opened",
+                          msg_verbose_level=VerboseLevel.DEBUG)
+            console_print(f"Reading config file {configPath}",
+                          msg_verbose_level=VerboseLevel.DEBUG)
+            for configLine in configFileHandle:
+                if '=' not in configLine:
+                    continue
+                splittedLine = configLine.strip().split('=', 1)
+                lineHeader = splittedLine[0].lower()
+                lineContent = ('' if len(splittedLine) <= 1
+                               else splittedLine[1])
+                isValidHeader = True
+                if lineHeader in ('proxy', 'dir', 'useragent', 'autoformat',
+                                  'cache', 'crossref', 'metapriority'):
+                    configDict[lineHeader] = lineContent
+                elif lineHeader in ('mirror', 'hostlimit'):
+                    if lineHeader not in configDict:
+                        configDict[lineHeader] = list((lineContent,))
+                    else:
+                        configDict[lineHeader].append(lineContent)
+                elif lineHeader in ('chunk', 'segments', 'poolsize',
+                                    'cachettl', 'cachesize', 'mirrorttl',
+                                    'linkttl', 'missttl',
+                                    'racewindow', 'connecttimeout',
+                                    'metatimeout', 'probetimeout',
+                                    'querytimeout', 'stalltimeout',
+                                    'deadline', 'retries', 'backoff',
+                                    'breaker', 'breakercooldown',
+                                    'hedge', 'hedgebudget',
+                                    'metaworkers', 'linkworkers',
+                                    'dlworkers', 'queuesize', 'metabatch'):
+                    # raise ValueError if casting fails
+                    configDict[lineHeader] = int(lineContent)
+                elif lineHeader in ('autoname', 'nocolor', 'nocache', 'race'):
+                    configDict[lineHeader] = lineContent = True
+                else:
+                    isValidHeader = False
+                if isValidHeader:
+                    console_print(f"Config {lineHeader} found "
+                                  f"with key {lineContent}",
+                                  msg_verbose_level=VerboseLevel.DEBUG)
+            configFileHandle.close()
+            console_print(f"Config file specified {list(configDict.keys())}",
+                          msg_verbose_level=VerboseLevel.DEBUG)
+        except (FileNotFoundError, IsADirectoryError):
+            if cliArg['config'] == '~/.shdlconfig':  # is default
+                info_print("'~/.shdlconfig' not found")
+            else:
+                info_print("Config file not found "
+                           f"at {cliArg['config']}.")
+        except PermissionError:
+            info_print("ERROR:", end=" ")
+            info_print("Cannot read specified config file "
+                       f"{cliArg['config']}")
+        except (ValueError, RuntimeError):
+            # force close configFileHandle if possible
+            getattr(configFileHandle, 'close', lambda: None)()
+            info_print("ERROR:", end=" ")
+            info_print("Cannot parse config file. "
+                       "Will revert to CLI arguments")
+        else:
+            # config file read to configDict
+            defaultDict.update(configDict)
+    else:
+        console_print("No config file",
+                      msg_verbose_level=VerboseLevel.VERBOSE)
+
+    # assign default parameter (may be overriden in config file)
+    for _k, _v in defaultDict.items():
+        if cliArg[_k] is None or cliArg[_k] is False:
+            cliArg[_k] = _v
+
+    # start checking parameters validity
+    console_print("Start checking cli arguments",
+                  msg_verbose_level=VerboseLevel.DEBUG)
+    assert isinstance(cliArg['dir'], str)
+    try:
+        cliArg['dir'] = (
+                Path.cwd() / Path(cliArg['dir'].strip(" '\"")).expanduser()
+        ).resolve(strict=True)
+        if not cliArg['dir'].is_dir():
+            raise NotADirectoryError
+    except (NotADirectoryError, FileNotFoundError):
+        raise ShdlError(ErrorType.ARG_INVALID,
+                        error_msg=f"{str(cliArg['dir'])} "
+                                  "is not a valid directory")
+
+    for count_key in ('segments', 'metaworkers', 'linkworkers', 'dlworkers',
+                      'queuesize', 'metabatch', 'connecttimeout',
+                      'metatimeout', 'probetimeout', 'querytimeout',
+                      'stalltimeout'):
+        if cliArg[count_key] < 1:
+            raise ShdlError(ErrorType.ARG_INVALID,
+                            error_msg=f"{count_key} must be at least 1")
+    for count_key in ('deadline', 'retries', 'backoff', 'breaker',
+                      'breakercooldown', 'hedgebudget', 'linkttl',
+                      'missttl'):
+        if cliArg[count_key] < 0:
+            raise ShdlError(ErrorType.ARG_INVALID,
+                            error_msg=f"{count_key} must not be negative")
+    if not 0 <= cliArg['hedge'] <= 100:
+        raise ShdlError(ErrorType.ARG_INVALID,
+                        error_msg="hedge must be between 0 and 100")
+
+    from .RepoHandler.DOIRepoHandler import DOIRepoHandler
+
+    # from the commandline and config file as a string,
+    # or as a list from FetchOptions
+    if isinstance(cliArg['metapriority'], str):
+        cliArg['metapriority'] = cliArg['metapriority'].split(',')
+    cliArg['metapriority'] = tuple(dict.fromkeys(
+        source_name.strip().lower()
+        for source_name in cliArg['metapriority']
+        if source_name.strip() != ''))
+    # doi.org is always used, also telling if the DOI exists
+    if 'csl' not in cliArg['metapriority']:
+        cliArg['metapriority'] += ('csl',)
+    metadata_source_tuple = ('csl',
+                             *DOIRepoHandler.alt_metadata_source_dict)
+    if len(unknown_source_list := [
+            source_name
+            for source_name in cliArg['metapriority']
+            if source_name not in metadata_source_tuple]) != 0:
+        raise ShdlError(ErrorType.ARG_INVALID,
+                        error_msg="Unknown metadata sources: "
+                                  f"{', '.join(unknown_source_list)}. "
+                                  "Should be from "
+                                  f"{', '.join(metadata_source_tuple)}")
+
+    if cliArg['cache'] == '':
+        cliArg['cache'] = None
+    else:
+        cliArg['cache'] = Path(cliArg['cache'].strip(" '\"")).expanduser()
+
+    if cliArg['trace'] is not None:
+        cliArg['trace'] = (
+                Path.cwd() / Path(cliArg['trace'].strip(" '\"")).expanduser()
+        ).resolve()
+        from .Tracing import open_tracer
+
+        # fail early if the file cannot be written
+        open_tracer(cliArg['trace'])
+
+    if cliArg['profile'] is not None:
+        cliArg['profile'] = (
+                Path.cwd()
+                / Path(cliArg['profile'].strip(" '\"")).expanduser()
+        ).resolve()
+        if cliArg['profiletop'] < 1:
+            raise ShdlError(ErrorType.ARG_INVALID,
+                            error_msg="profiletop must be at least 1")
+
+    if cliArg['record'] is not None:
+        cliArg['record'] = (
+                Path.cwd() / Path(cliArg['record'].strip(" '\"")).expanduser()
+        ).resolve()
+    if cliArg['replay'] is not None:
+        from .Cassette import Cassette
+
+        # loaded once here, raises ShdlError if invalid
+        cliArg['replay'] = Cassette.load(
+            Path.cwd() / Path(cliArg['replay'].strip(" '\"")).expanduser())
+
+    if cliArg['mirror'] is None:
+        # should not quit without mirror: arxiv never needs one
+        # quit_with_error(ErrorType.ARG_INVALID,
+        #                 error_msg="No mirror provided. "
+        #                           "Please specify at least a mirror "
+        #                           "in commandline argument "
+        #                           "or in shdlconfig file")
+        cliArg['mirror'] = tuple()
+    else:
+        cliArg['mirror'] = tuple(
+            # enforce https unless specified, dirty hack
+            urlunparse(
+                urlparse(('//' if '//' not in mirrorURL else '') + mirrorURL,
+                         scheme="https")
+            )
+            for mirrorURL in cliArg['mirror']
+        )
+
+    from .HostScheduler import default_host_limit_dict, parse_host_limit
+
+    # listed hosts replace their defaults, others keep them
+    cliArg['hostlimit'] = {
+        **default_host_limit_dict,
+        **dict(map(parse_host_limit, cliArg['hostlimit']))
+    }
+
+    if cliArg['proxy'] == '':
+        cliArg['proxy'] = None
+    if cliArg['proxy'] is not None:
+        cliArg['proxy'] = {
+                'nop': None,
+                'tor': 'socks5h://127.0.0.1:9050',
+                'tbb': 'socks5h://127.0.0.1:9150',
+            }.get(cliArg['proxy'].lower(), cliArg['proxy'])
+        cliArg['proxy'] = {scheme: cliArg['proxy']
+                           for scheme in ('http', 'https')} \
+            if cliArg['proxy'] is not None \
+            else None
+    if cliArg['proxy'] is None:
+        console_print(PColor.WARNING.__call__("WARNING:"), end=" ",
+                      msg_verbose_level=VerboseLevel.INFO)
+        console_print("No proxy configured",
+                      msg_verbose_level=VerboseLevel.INFO)
+
+    # network para
+    cliArg['rqKwargs'] = {
+        'proxies': cliArg['proxy'],
+        'headers': {'User-Agent': cliArg['useragent'], }
+    }
+    if cliArg['type'] is not None:
+        cliArg['type'] = cliArg['type'].lower()
+        from .RepoHandler.RegisteredRepo import registered_repo_name
+
+        if cliArg['type'] not in registered_repo_name:
+            raise ShdlError(ErrorType.ARG_INVALID,
+                            error_msg=f"Input type {cliArg['type']} does not "
+                                      "match any known repo name")
+
+    console_print("Processed cli arguments: ",
+                  msg_verbose_level=VerboseLevel.DEBUG)
+    for _k, _v in cliArg.items():
+        console_print(PColor.INFO.__call__(_k) + ": " + str(_v),
+                      msg_verbose_level=VerboseLevel.DEBUG)
+
+
+def setup(argv: Optional[List[str]] = None) -> None:
+    """
+    Parse and process the commandline arguments.
+    Must be called before fetching documents.
+
+    No network request is made here.
+    Network connectivity is checked only when a request fails
+
+    :param argv: list[str], or None.
+        The commandline arguments. If None, will use sys.argv
+    """
+    parse_cli_arg(argv)
+    try:
+        process_cli_arg()
+    except ShdlError as e:
+        quit_with_error(e.error_type, error_msg=e.error_msg)
+    if cliArg['batch'] is not None and cliArg['batch'] != '-':
+        cliArg['batch'] = Path(cliArg['batch']).expanduser()
+        if not cliArg['batch'].is_file():
+            quit_with_error(ErrorType.ARG_INVALID,
+                            error_msg=f"Batch file {str(cliArg['batch'])} "
+                                      "does not exist")
+    if len(cliArg['identifier']) == 0 and cliArg['batch'] is None:
+        quit_with_error(ErrorType.ARG_INVALID,
+                        error_msg="No identifier given. "
+                                  "Please specify identifiers in commandline "
+                                  "or with --batch switch")
+    cliArg['isBatch'] = (cliArg['batch'] is not None
+                         or len(cliArg['identifier']) > 1)
@@ -0,0 +1,108 @@
+import math
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from .CommonUtil import *
+from .HostScheduler import host_scheduler
+from .RequestTimeout import RequestKind
+
+
+class HedgePolicy:
+    """
+    Decide when a slow request is hedged,
+    i.e. sent again without waiting for the first one to answer
+
+    Only metadata requests and mirror queries are hedged,
+    as they are small and their latency is on the critical path.
+    A request is hedged if it has not answered
+    within the cliArg['hedge'] percentile of recent response times
+    of the same kind of request to the same host
+    (no hedging if 0, or if too few response times are known).
+    Requests to hosts allowing only one request in flight are not hedged,
+    as the hedge would wait for the request it hedges.
+    Hedges are limited to cliArg['hedgebudget'] percent
+    of the requests that may be hedged, so that they add little load
+    """
+
+    hedged_kind_set = frozenset((RequestKind.METADATA, RequestKind.QUERY))
+    # response times kept for each host and request kind
+    latency_history_size = 100
+    # no hedging with fewer response times known
+    min_latency_sample = 10
+    # unused hedges carried over, so that a burst of slow requests
+    # can still be hedged
+    max_saved_hedge = 10
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency_dict: Dict[Tuple[str, RequestKind],
+                                 Deque[float]] = dict()
+        self._hedge_allowance = 0.0
+
+    def record_latency(self,
+                       host: str,
+                       request_kind: RequestKind,
+                       latency: float) -> None:
+        """
+        Record the response time of a request
+
+        :param host: str.
+            The host name
+        :param request_kind: RequestKind.
+            The kind of the request
+        :param latency: float.
+            Seconds before the response arrived
+        """
+        if request_kind not in self.hedged_kind_set:
+            return
+        with self._lock:
+            self._latency_dict.setdefault(
+                (host, request_kind),
+                deque(maxlen=self.latency_history_size)).append(latency)
+
+    def get_hedge_delay(self,
+                        host: str,
+                        request_kind: RequestKind) -> Optional[float]:
+        """
+        Get the time to wait before hedging a request
+
+        Also counts the request towards the hedge budget
+
+        :param host: str.
+            The host name
+        :param request_kind: RequestKind.
+            The kind of the request
+        :return: float, or None.
+            Seconds to wait, or None if the request is not to be hedged
+        """
+        if cliArg['hedge'] == 0 \
+                or request_kind not in self.hedged_kind_set \
+                or host_scheduler.get_limit(host).inflight == 1:
+            return None
+        with self._lock:
+            self._hedge_allowance = min(
+                self.max_saved_hedge,
+                self._hedge_allowance + cliArg['hedgebudget'] / 100)
+            latency_list = sorted(self._latency_dict.get((host, request_kind),
+                                                         ()))
+        if len(latency_list) < self.min_latency_sample:
+            return None
+        return latency_list[
+            math.ceil(cliArg['hedge'] / 100 * len(latency_list)) - 1]
+
+    def try_use_hedge(self) -> bool:
+        """
+        Take a hedge from the budget
+
+        :return: bool.
+            If a hedge can be sent
+        """
+        with self._lock:
+            if self._hedge_allowance < 1:
+                return False
+            self._hedge_allowance -= 1
+            return True
+
+
+hedge_policy = HedgePolicy()
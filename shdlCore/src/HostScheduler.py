@@ -0,0 +1,244 @@
+import asyncio
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Callable, Dict, Iterator, NamedTuple, \
+    Optional, Tuple
+
+from .CommonUtil import *
+from .RequestTimeout import check_deadline, get_remaining_time
+
+
+class HostLimit(NamedTuple):
+    """
+    Politeness limits for requests to a host
+
+    0 means unlimited
+    """
+    # requests started per second, on average
+    rate: float
+    # requests waiting for or receiving a response at the same time
+    inflight: int
+    # requests that can be started at once after being idle
+    burst: int
+
+
+# limits of hosts not listed, applied to each host separately
+default_host_key = '*'
+default_host_limit_dict = {
+    default_host_key:          HostLimit(rate=4, inflight=4, burst=4),
+    'doi.org':                 HostLimit(rate=5, inflight=4, burst=5),
+    # Crossref public API: five requests per second, one at a time
+    'api.crossref.org':        HostLimit(rate=5, inflight=1, burst=5),
+    # arXiv API terms of use: one request every three seconds
+    'export.arxiv.org':        HostLimit(rate=1 / 3, inflight=1, burst=1),
+    # NCBI E-utilities: three requests per second without an API key
+    'eutils.ncbi.nlm.nih.gov': HostLimit(rate=3, inflight=3, burst=1),
+}
+
+
+def parse_host_limit(limit_str: str) -> Tuple[str, HostLimit]:
+    """
+    Parse a host limit of the form HOST,RATE[,INFLIGHT[,BURST]]
+
+    INFLIGHT is unlimited if not given,
+    BURST is RATE rounded up (at least 1) if not given.
+    HOST * gives the limits of hosts not listed
+
+    :param limit_str: str.
+        The host limit, e.g. "doi.org,5,4"
+    :return: tuple[str, HostLimit].
+        The host name (lowercase) and its limits
+    :raise ShdlError: if limit_str is invalid
+    """
+    part_list = [part.strip() for part in limit_str.split(',')]
+    try:
+        if not 2 <= len(part_list) <= 4 or part_list[0] == '':
+            raise ValueError
+        rate = float(part_list[1])
+        inflight = int(part_list[2]) if len(part_list) >= 3 else 0
+        burst = (int(part_list[3])
+                 if len(part_list) >= 4
+                 else max(1, math.ceil(rate)))
+        if not math.isfinite(rate) or rate < 0 or inflight < 0 or burst < 1:
+            raise ValueError
+    except ValueError:
+        raise ShdlError(ErrorType.ARG_INVALID,
+                        error_msg=f"Host limit {limit_str} is invalid. "
+                                  "Expected HOST,RATE[,INFLIGHT[,BURST]]")
+    return part_list[0].lower(), HostLimit(rate, inflight, burst)
+
+
+class _HostState:
+    __slots__ = ('tokens', 'last_refill', 'inflight')
+
+    def __init__(self, tokens: float):
+        self.tokens = tokens
+        self.last_refill = time.monotonic()
+        self.inflight = 0
+
+
+class HostScheduler:
+    """
+    Enforce the per-host limits in cliArg['hostlimit']
+    on requests made by both transports
+
+    Each host has a token bucket for its request rate
+    and a count of requests in flight.
+    A request waits until both allow it,
+    so that concurrent fetching runs as fast as each host permits,
+    but no faster.
+    Limits are read on each request,
+    so that library calls with different arguments can share the state,
+    but hosts are always counted across all of them
+    """
+
+    # seconds between checks for a free in-flight slot in async waiting
+    async_poll_interval = 0.05
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._host_state_dict: Dict[str, _HostState] = dict()
+
+    @staticmethod
+    def get_limit(host: str) -> HostLimit:
+        """
+        Get the limits that apply to host
+
+        :param host: str.
+            The host name
+        :return: HostLimit
+        """
+        host_limit_dict = cliArg['hostlimit']
+        return host_limit_dict.get(host.lower(),
+                                   host_limit_dict[default_host_key])
+
+    def _try_acquire(self, host: str, limit: HostLimit) -> Optional[float]:
+        # must hold self._lock
+        # returns None if acquired, otherwise seconds to wait
+        # (math.inf if waiting for an in-flight request to finish)
+        if (state := self._host_state_dict.get(host)) is None:
+            state = self._host_state_dict[host] = _HostState(limit.burst)
+        if limit.inflight != 0 and state.inflight >= limit.inflight:
+            return math.inf
+        if limit.rate != 0:
+            now = time.monotonic()
+            state.tokens = min(limit.burst,
+                               state.tokens
+                               + (now - state.last_refill) * limit.rate)
+            state.last_refill = now
+            if state.tokens < 1:
+                return (1 - state.tokens) / limit.rate
+            state.tokens -= 1
+        state.inflight += 1
+        return None
+
+    def acquire(self, host: str) -> None:
+        """
+        Wait until a request to host is allowed, and count it as in flight
+
+        Must be followed by release(host)
+
+        :param host: str.
+            The host name
+        :raise ShdlError: if the deadline passes while waiting
+        """
+        limit = self.get_limit(host)
+        with self._lock:
+            while (wait_time := self._try_acquire(host, limit)) is not None:
+                check_deadline()
+                console_print(f"Waiting for request slot of {host}",
+                              msg_verbose_level=VerboseLevel.DETAIL)
+                if (remaining := get_remaining_time()) is not None:
+                    wait_time = min(wait_time, max(remaining, 0))
+                self._slot_freed.wait(None
+                                      if wait_time == math.inf
+                                      else wait_time)
+
+    async def async_acquire(self, host: str) -> None:
+        """
+        Async version of acquire
+
+        :param host: str.
+            The host name
+        :raise ShdlError: if the deadline passes while waiting
+        """
+        limit = self.get_limit(host)
+        while True:
+            with self._lock:
+                wait_time = self._try_acquire(host, limit)
+            if wait_time is None:
+                return
+            check_deadline()
+            console_print(f"Waiting for request slot of {host}",
+                          msg_verbose_level=VerboseLevel.DETAIL)
+            if wait_time == math.inf:
+                wait_time = self.async_poll_interval
+            if (remaining := get_remaining_time()) is not None:
+                wait_time = min(wait_time, max(remaining, 0))
+            await asyncio.sleep(wait_time)
+
+    def release(self, host: str) -> None:
+        """
+        Count a request to host as finished
+
+        :param host: str.
+            The host name
+        """
+        with self._lock:
+            self._host_state_dict[host].inflight -= 1
+            self._slot_freed.notify_all()
+
+    def get_releaser(self, host: str) -> Callable[[], None]:
+        """
+        Get a function that releases host, and does nothing if called again
+
+        For requests that end at an uncertain time, e.g. streamed responses
+
+        :param host: str.
+            The host name
+        :return: Callable[[], None]
+        """
+        is_released = threading.Event()
+
+        def release_once() -> None:
+            with self._lock:
+                if is_released.is_set():
+                    return
+                is_released.set()
+            self.release(host)
+
+        return release_once
+
+    @contextmanager
+    def slot(self, host: str) -> Iterator[None]:
+        """
+        Hold a request slot of host within the context
+
+        :param host: str.
+            The host name
+        """
+        self.acquire(host)
+        try:
+            yield
+        finally:
+            self.release(host)
+
+    @asynccontextmanager
+    async def async_slot(self, host: str) -> AsyncIterator[None]:
+        """
+        Async version of slot
+
+        :param host: str.
+            The host name
+        """
+        await self.async_acquire(host)
+        try:
+            yield
+        finally:
+            self.release(host)
+
+
+host_scheduler = HostScheduler()
@@ -0,0 +1,578 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, \
+    wait
+from contextlib import contextmanager
+from contextvars import copy_context
+from typing import Any, Callable, Dict, Generator, Iterator, NamedTuple, \
+    Optional, Set, Tuple, TypeVar, Union
+from urllib.parse import urlparse
+
+import requests as rq
+from requests.adapters import HTTPAdapter
+
+from .CommonUtil import *
+from .Hedging import hedge_policy
+from .HostScheduler import host_scheduler
+from .RequestTimeout import RequestKind, check_deadline, get_remaining_time, \
+    get_request_timeout
+from .RetryPolicy import retry_policy
+from .Tracing import trace_span
+
+
+class HttpRequest(NamedTuple):
+    """
+    A request to be sent by a transport
+
+    Yielded by request steps, see HttpTransport.run_steps
+    """
+    method: str
+    url: str
+    # keyword arguments as in requests.Session.request
+    kwargs: Dict[str, Any]
+
+    @classmethod
+    def get(cls, url: str, **kwargs) -> 'HttpRequest':
+        return cls('GET', url, kwargs)
+
+    @classmethod
+    def post(cls, url: str, **kwargs) -> 'HttpRequest':
+        return cls('POST', url, kwargs)
+
+    @classmethod
+    def head(cls, url: str, **kwargs) -> 'HttpRequest':
+        return cls('HEAD', url, kwargs)
+
+
+_StepResult = TypeVar('_StepResult')
+# a generator that yields the requests it needs,
+# is sent back their responses, and returns its result
+# so the same handler code can be run by blocking and async transports
+# (it may also yield a StepsRace, and is sent back its results)
+RequestSteps = Generator[Union[HttpRequest, 'StepsRace'],
+                         Union[rq.Response, Dict[int, Any]],
+                         _StepResult]
+
+
+class StepsRace(NamedTuple):
+    """
+    Request steps to be run at the same time by a transport
+
+    Yielded by request steps in place of a request.
+    Steps are in order of preference.
+    The first accepted result wins,
+    unless a more preferred steps also gives an accepted result
+    within window seconds.
+    The steps not needed then are cancelled,
+    those sending a request stop before their next request.
+    Steps failing with a requests exception are left out.
+
+    The transport sends back the results of the steps that finished,
+    as dict mapping the index of the steps to its result
+    """
+    steps_tuple: Tuple[RequestSteps, ...]
+    is_accepted: Callable[[Any], bool]
+    window: float = 0
+
+
+class _RaceTally:
+    # the results of a StepsRace so far, and whether it is decided
+    # shared by the transports
+
+    def __init__(self, steps_race: StepsRace):
+        self.steps_race = steps_race
+        self.result_dict: Dict[int, Any] = dict()
+        self.pending_index_set: Set[int] \
+            = set(range(len(steps_race.steps_tuple)))
+        self._window_end: Optional[float] = None
+
+    def add_result(self, steps_idx: int, result: Any) -> None:
+        self.pending_index_set.discard(steps_idx)
+        self.result_dict[steps_idx] = result
+        if self._window_end is None and self.steps_race.is_accepted(result):
+            self._window_end = time.monotonic() + self.steps_race.window
+
+    def add_failure(self, steps_idx: int, error: Exception) -> None:
+        self.pending_index_set.discard(steps_idx)
+        console_print(f"Raced request steps failed ({error})",
+                      msg_verbose_level=VerboseLevel.VERBOSE)
+
+    def get_wait_timeout(self) -> Optional[float]:
+        # None to wait until a steps finishes
+        if self._window_end is None:
+            return None
+        return max(0.0, self._window_end - time.monotonic())
+
+    @property
+    def is_decided(self) -> bool:
+        accepted_index_list = [
+            steps_idx
+            for steps_idx, result in self.result_dict.items()
+            if self.steps_race.is_accepted(result)
+        ]
+        return (len(self.pending_index_set) == 0
+                or (len(accepted_index_list) != 0
+                    and (all(steps_idx > min(accepted_index_list)
+                             for steps_idx in self.pending_index_set)
+                         or self.get_wait_timeout() == 0)))
+
+
+def _stop_on_event(request_steps: RequestSteps,
+                   stop_event: threading.Event) -> RequestSteps:
+    # the same steps, stopped (returning None)
+    # before the next request once stop_event is set
+    try:
+        next_request = next(request_steps)
+        while not stop_event.is_set():
+            try:
+                response = yield next_request
+            except rq.exceptions.RequestException as e:
+                next_request = request_steps.throw(e)
+            else:
+                next_request = request_steps.send(response)
+    except StopIteration as e:
+        return e.value
+    request_steps.close()
+    return None
+
+
+@contextmanager
+def network_error_as_shdl_error() -> Iterator[None]:
+    """
+    Raise requests exceptions from the context as ShdlError
+    (ErrorType.NETWORK_ERROR),
+    so that a network failure fails the document instead of the caller
+    """
+    try:
+        yield
+    except rq.exceptions.RequestException as e:
+        raise ShdlError(ErrorType.NETWORK_ERROR,
+                        error_msg=f"Network error: {e}") from e
+
+
+class HttpTransport:
+    """
+    The shared transport used for all network requests
+
+    Wraps a single requests.Session so that connections (and so their TLS
+    sessions) are kept alive and reused across requests to the same host,
+    e.g. the several doi.org and mirror requests made for a document,
+    or all documents in a batch.
+    Proxy and User-Agent are taken from cliArg['rqKwargs'] on each request,
+    so that library calls with different arguments can share the transport.
+    Pool sizes are taken from the arguments used when the session is created.
+
+    Network connectivity (and the proxy) is not tested in advance.
+    It is tested only when a request fails to connect,
+    to tell a dead host from a broken network.
+
+    Each request waits for its host to allow it, see HostScheduler.
+    A streamed response holds its request slot until it is closed,
+    so it must be closed (e.g. used in a with statement).
+    Temporary failures are retried, see RetryPolicy.
+    Requests time out as configured for their RequestKind,
+    and within the deadline of the current context, see Deadline.
+    Slow metadata requests and mirror queries may be hedged,
+    see HedgePolicy.
+    Request steps yielding a StepsRace have its steps run in threads
+    """
+
+    # number of hosts to keep connection pools for
+    pool_host_count = 20
+    # URL used for testing network connectivity
+    connectivity_test_url = 'https://example.com/'
+    # seconds before the connectivity test result is tested again
+    connectivity_test_interval = 60
+    # threads sending hedged requests and the requests they hedge
+    hedge_worker_count = 32
+    # threads running the steps of StepsRace
+    race_worker_count = 32
+
+    def __init__(self):
+        self._session = None
+        self._hedge_executor = None
+        self._race_executor = None
+        self._lock = threading.Lock()
+        self._host_counter = Counter()
+        self._host_error_counter = Counter()
+        self._network_check_lock = threading.Lock()
+        # proxy URL -> (time of test, error found)
+        self._network_check_result: \
+            Dict[Optional[str], Tuple[float, Optional[ShdlError]]] = dict()
+
+    @property
+    def session(self) -> rq.Session:
+        """
+        The underlying requests.Session, created on first use
+
+        :return: requests.Session
+        """
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self.create_session()
+        return self._session
+
+    def create_session(self) -> rq.Session:
+        """
+        Create a requests.Session configured as the shared one
+
+        Pool sizes are taken from the current arguments
+
+        :return: requests.Session
+        """
+        session = rq.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_host_count,
+                              pool_maxsize=cliArg['poolsize'],
+                              pool_block=False)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @contextmanager
+    def use_session(self, session) -> Iterator[Optional[rq.Session]]:
+        """
+        Send requests through another session within the context,
+        e.g. one recording or replaying them, see Cassette
+
+        :param session:
+            The session, with the request, get and close methods
+            of requests.Session
+        :return: Iterator[requests.Session, or None].
+            Yields the session used before,
+            or None if it is not yet created
+        """
+        with self._lock:
+            previous_session, self._session = self._session, session
+        try:
+            yield previous_session
+        finally:
+            with self._lock:
+                self._session = previous_session
+
+    def request(self, method: str, url: str, **kwargs) -> rq.Response:
+        """
+        Send a request through the shared session
+
+        Temporary failures are retried.
+        The last response is returned even if it is a temporary failure
+
+        :param method: str.
+            The HTTP method
+        :param url: str.
+            The URL to request
+        :param kwargs:
+            Other keyword arguments passed to requests.Session.request.
+            Headers given here are merged with the configured headers.
+            timeout can also be a RequestKind (default RequestKind.METADATA)
+        :return: requests.Response
+        :raise HostUnavailableError: if the host keeps failing
+        :raise ShdlError: if the deadline has passed
+        """
+        rq_kwargs = cliArg['rqKwargs']
+        kwargs['headers'] = {**rq_kwargs['headers'],
+                             **kwargs.get('headers', dict())}
+        kwargs.setdefault('proxies', rq_kwargs['proxies'])
+        timeout = kwargs.pop('timeout', RequestKind.METADATA)
+        if kwargs.get('stream', False) \
+                or (hedge_delay := hedge_policy.get_hedge_delay(
+                    urlparse(url).hostname or '', timeout)) is None:
+            return self._request_with_retry(method, url, timeout, kwargs)
+        return self._hedged_request(method, url, timeout, kwargs, hedge_delay)
+
+    def _get_hedge_executor(self) -> ThreadPoolExecutor:
+        if self._hedge_executor is None:
+            with self._lock:
+                if self._hedge_executor is None:
+                    self._hedge_executor = ThreadPoolExecutor(
+                        max_workers=self.hedge_worker_count,
+                        thread_name_prefix='shdl-hedge')
+        return self._hedge_executor
+
+    def _get_race_executor(self) -> ThreadPoolExecutor:
+        if self._race_executor is None:
+            with self._lock:
+                if self._race_executor is None:
+                    self._race_executor = ThreadPoolExecutor(
+                        max_workers=self.race_worker_count,
+                        thread_name_prefix='shdl-steps')
+        return self._race_executor
+
+    def _hedged_request(self,
+                        method: str,
+                        url: str,
+                        timeout: RequestKind,
+                        kwargs: dict,
+                        hedge_delay: float) -> rq.Response:
+        # send the request again if it has not answered after hedge_delay,
+        # and return whichever answers first
+        executor = self._get_hedge_executor()
+
+        def submit() -> Future:
+            # threads see the arguments and the deadline of the caller
+            return executor.submit(copy_context().run,
+                                   self._request_with_retry,
+                                   method, url, timeout, kwargs)
+
+        primary_future = submit()
+        if wait((primary_future,), timeout=hedge_delay).done \
+                or not hedge_policy.try_use_hedge():
+            return primary_future.result()
+        console_print(f"No response from {PColor.PATH(url)} "
+                      f"after {hedge_delay :.2f} s. "
+                      "Sending a hedged request",
+                      msg_verbose_level=VerboseLevel.VERBOSE)
+        pending_set = {primary_future, submit()}
+        while pending_set:
+            done_set, pending_set = wait(pending_set,
+                                         return_when=FIRST_COMPLETED)
+            for future in done_set:
+                if future.exception() is None:
+                    # a request being sent cannot be stopped,
+                    # so it is left to finish and discarded
+                    for other_future in pending_set:
+                        if not other_future.cancel():
+                            other_future.add_done_callback(
+                                self._close_unused_response)
+                    return future.result()
+        # both failed, report as if not hedged
+        return primary_future.result()
+
+    @staticmethod
+    def _close_unused_response(future: Future) -> None:
+        if not future.cancelled() and future.exception() is None:
+            future.result().close()
+
+    def _request_with_retry(self,
+                            method: str,
+                            url: str,
+                            timeout: Any,
+                            kwargs: dict) -> rq.Response:
+        # send the request, retrying temporary failures
+        host_name = urlparse(url).hostname or ''
+        start_time = time.monotonic()
+        attempt = 0
+        while True:
+            check_deadline()
+            retry_policy.check_host(host_name)
+            try:
+                response = self._send(
+                    method,
+                    url,
+                    {**kwargs, 'timeout': get_request_timeout(timeout)})
+            except rq.exceptions.RequestException as e:
+                if (delay := retry_policy.get_retry_delay(
+                        host_name, attempt, error=e)) is None:
+                    raise
+                retry_reason = str(e)
+            else:
+                if (delay := retry_policy.get_retry_delay(
+                        host_name,
+                        attempt,
+                        status_code=response.status_code,
+                        retry_after=response.headers.get('Retry-After'))) \
+                        is None:
+                    hedge_policy.record_latency(
+                        host_name, timeout, time.monotonic() - start_time)
+                    return response
+                response.close()
+                retry_reason = f"HTTP {response.status_code}"
+            console_print(f"Request to {PColor.PATH(url)} failed "
+                          f"({retry_reason}). "
+                          f"Retrying in {delay :.1f} s",
+                          msg_verbose_level=VerboseLevel.VERBOSE)
+            if (remaining := get_remaining_time()) is not None:
+                # the deadline is checked again after waiting
+                delay = min(delay, max(remaining, 0))
+            time.sleep(delay)
+            attempt += 1
+
+    def _send(self, method: str, url: str, kwargs: dict) -> rq.Response:
+        # send a single attempt of the request
+        host = urlparse(url).netloc
+        with self._lock:
+            self._host_counter[host] += 1
+        scheduled_host = urlparse(url).hostname or ''
+        host_scheduler.acquire(scheduled_host)
+        release_slot = host_scheduler.get_releaser(scheduled_host)
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except rq.exceptions.ConnectionError:
+            release_slot()
+            with self._lock:
+                self._host_error_counter[host] += 1
+            # raises ShdlError if the network is the problem
+            self.check_network_connectivity()
+            raise
+        except rq.exceptions.RequestException:
+            release_slot()
+            with self._lock:
+                self._host_error_counter[host] += 1
+            raise
+        except BaseException:
+            release_slot()
+            raise
+        if not kwargs.get('stream', False):
+            release_slot()
+            return response
+
+        # the request is in flight until the body is read
+        def close_response(close=response.close) -> None:
+            try:
+                close()
+            finally:
+                release_slot()
+
+        response.close = close_response
+        return response
+
+    def get(self, url: str, **kwargs) -> rq.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> rq.Response:
+        return self.request('POST', url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> rq.Response:
+        return self.request('HEAD', url, **kwargs)
+
+    def run_steps(self, request_steps: RequestSteps) -> Any:
+        """
+        Run request steps, sending the requests yielded through this transport
+
+        Exceptions raised when sending a request are thrown into the steps
+
+        :param request_steps: RequestSteps.
+            The generator of requests
+        :return:
+            The value returned by request_steps
+        """
+        try:
+            next_request = next(request_steps)
+            while True:
+                if isinstance(next_request, StepsRace):
+                    next_request = request_steps.send(
+                        self._run_race(next_request))
+                    continue
+                try:
+                    response = self.request(next_request.method,
+                                            next_request.url,
+                                            **next_request.kwargs)
+                except rq.exceptions.RequestException as e:
+                    next_request = request_steps.throw(e)
+                else:
+                    next_request = request_steps.send(response)
+        except StopIteration as e:
+            return e.value
+
+    def _run_race(self, steps_race: StepsRace) -> Dict[int, Any]:
+        # run each steps in a thread, see StepsRace
+        executor = self._get_race_executor()
+        stop_event = threading.Event()
+        race_tally = _RaceTally(steps_race)
+        # threads see the arguments and the deadline of the caller
+        pending_dict = {
+            executor.submit(copy_context().run,
+                            self.run_steps,
+                            _stop_on_event(request_steps, stop_event)):
+                steps_idx
+            for steps_idx, request_steps
+            in enumerate(steps_race.steps_tuple)
+        }
+        try:
+            while not race_tally.is_decided:
+                done_set, _ = wait(pending_dict,
+                                   timeout=race_tally.get_wait_timeout(),
+                                   return_when=FIRST_COMPLETED)
+                for future in done_set:
+                    steps_idx = pending_dict.pop(future)
+                    try:
+                        race_tally.add_result(steps_idx, future.result())
+                    except rq.exceptions.RequestException as e:
+                        race_tally.add_failure(steps_idx, e)
+        finally:
+            stop_event.set()
+            for future in pending_dict:
+                future.cancel()
+        return race_tally.result_dict
+
+    def check_network_connectivity(self) -> None:
+        """
+        Test if the internet can be reached with the configured proxy
+
+        The result is reused for connectivity_test_interval seconds
+
+        :raise ShdlError: if the proxy is invalid
+            or the internet cannot be reached
+        """
+        proxy_key = (None
+                     if cliArg['proxy'] is None
+                     else cliArg['proxy']['https'])
+        with self._network_check_lock:
+            if (last_result := self._network_check_result.get(proxy_key)) \
+                    is not None \
+                    and (time.monotonic() - last_result[0]
+                         < self.connectivity_test_interval):
+                if last_result[1] is not None:
+                    raise last_result[1]
+                return
+            info_print("Testing network connectivity ...")
+            network_error = None
+            try:
+                with trace_span('connectivity',
+                                url=self.connectivity_test_url) \
+                        as connectivity_span:
+                    connectivity_span.set_response(self.session.get(
+                        self.connectivity_test_url,
+                        timeout=get_request_timeout(RequestKind.PROBE),
+                        **cliArg['rqKwargs']))
+            except rq.exceptions.ProxyError:
+                network_error = ShdlError(
+                    ErrorType.ARG_INVALID,
+                    error_msg="Proxy config is invalid")
+            except rq.ConnectionError:
+                network_error = ShdlError(
+                    ErrorType.NETWORK_ERROR,
+                    error_msg="Failed to connect to the internet. "
+                              + ("Maybe proxy is not setup correctly?"
+                                 if cliArg['proxy'] is not None
+                                 else ""))
+            except Exception as e:
+                network_error = ShdlError(
+                    ErrorType.NETWORK_ERROR,
+                    error_msg=("Unknown error occurred "
+                               "when testing network connectivity. \n"
+                               + str(e)))
+            else:
+                if cliArg['proxy'] is not None:
+                    info_print(f"Using proxy {cliArg['proxy']['https']}")
+            self._network_check_result[proxy_key] = (time.monotonic(),
+                                                     network_error)
+            if network_error is not None:
+                raise network_error
+
+    def host_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Get the number of requests sent to each host
+
+        :return: dict[str, dict[str, int]].
+            Maps host to a dict with keys 'requests' and 'errors'
+        """
+        with self._lock:
+            return {
+                host: {'requests': count,
+                       'errors':   self._host_error_counter[host]}
+                for host, count in self._host_counter.items()
+            }
+
+    def close(self) -> None:
+        """
+        Close all pooled connections
+        """
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+http_transport = HttpTransport()
@@ -0,0 +1,603 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Optional, Tuple
+
+from .CommonUtil import *
+
+
+class _SqliteStore:
+    """
+    A table in the local cache database
+
+    The database file is shared by all shdl processes.
+    Each thread gets its own connection, and the database is put in WAL mode
+    so that readers do not block writers.
+    Any database error disables the store (for that database file)
+    for the rest of the run instead of failing the fetch.
+    """
+
+    # table name and "CREATE TABLE" statement, set by subclasses
+    table_name = None
+    table_schema = None
+    # "CREATE INDEX" statements of the table
+    index_schema_tuple = tuple()
+
+    # seconds to wait for a lock held by other processes
+    lock_timeout = 30
+
+    def __init__(self):
+        self._local = threading.local()
+        self._disabled_path_set = set()
+
+    @property
+    def is_enabled(self) -> bool:
+        return (not cliArg['nocache']
+                and cliArg['cache'] is not None
+                and str(cliArg['cache']) not in self._disabled_path_set)
+
+    @property
+    def is_readable(self) -> bool:
+        return self.is_enabled and not cliArg['refreshcache']
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        # different library calls may use different databases
+        if not hasattr(self._local, 'conn_dict'):
+            self._local.conn_dict = dict()
+        db_path = str(cliArg['cache'])
+        if (conn := self._local.conn_dict.get(db_path)) is not None:
+            return conn
+        try:
+            conn = sqlite3.connect(db_path,
+                                   timeout=self.lock_timeout,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(self.table_schema)
+            for index_schema in self.index_schema_tuple:
+                conn.execute(index_schema)
+        except sqlite3.Error as e:
+            self._disable(e)
+            return None
+        self._local.conn_dict[db_path] = conn
+        return conn
+
+    def _disable(self, error: Exception) -> None:
+        if str(cliArg['cache']) not in self._disabled_path_set:
+            info_print(PColor.WARNING("WARNING:"), end=" ")
+            info_print(f"Cannot use cache {self.table_name} "
+                       f"in {str(cliArg['cache'])} ({error}). "
+                       "Cache disabled")
+        self._disabled_path_set.add(str(cliArg['cache']))
+
+    def _execute(self, sql: str, *params) -> Optional[list]:
+        """
+        Run a statement in its own transaction
+
+        :param sql: str.
+            The SQL statement
+        :param params:
+            Parameters bound to the statement
+        :return: list, or None.
+            The fetched rows, or None if the cache is not usable
+        """
+        if (conn := self._connection()) is None:
+            return None
+        try:
+            return conn.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            self._disable(e)
+            return None
+
+    def _run_transaction(self, work: Callable[[sqlite3.Connection], Any]) \
+            -> Any:
+        """
+        Run statements in one transaction holding the write lock
+
+        Other processes cannot write between the statements,
+        so read-modify-write is not lost
+
+        :param work: Callable[[sqlite3.Connection], Any].
+            Runs the statements on the given connection
+        :return: Any.
+            The return value of work, or None if the cache is not usable
+        """
+        if (conn := self._connection()) is None:
+            return None
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = work(conn)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return result
+        except sqlite3.Error as e:
+            self._disable(e)
+            return None
+
+
+class MetadataCache(_SqliteStore):
+    """
+    Cache of the metadata dicts returned by extract_metadata,
+    keyed by (repo name, identifier)
+
+    Entries expire after --cachettl seconds.
+    At most --cachesize entries are kept,
+    the least recently used ones are evicted first.
+    Expired and evicted entries are removed on the first store of a run,
+    then every evict_interval stores.
+    """
+
+    table_name = 'metadata'
+    table_schema = ('CREATE TABLE IF NOT EXISTS metadata ('
+                    'repo TEXT NOT NULL, '
+                    'identifier TEXT NOT NULL, '
+                    'metadata TEXT NOT NULL, '
+                    'created REAL NOT NULL, '
+                    'last_access REAL NOT NULL, '
+                    'PRIMARY KEY (repo, identifier))')
+    index_schema_tuple = (
+        'CREATE INDEX IF NOT EXISTS metadata_created '
+        'ON metadata (created)',
+        'CREATE INDEX IF NOT EXISTS metadata_last_access '
+        'ON metadata (last_access)',
+    )
+
+    # number of stores between removals of expired and evicted entries
+    evict_interval = 100
+
+    def __init__(self):
+        super().__init__()
+        self._put_count_lock = threading.Lock()
+        self._put_count = 0
+
+    def get(self, repo_name: str, identifier: str) -> Optional[dict]:
+        """
+        Get cached metadata
+
+        :param repo_name: str.
+            The repo name of the handler
+        :param identifier: str.
+            The sanitized identifier
+        :return: dict, or None.
+            The cached metadata, or None if not cached or expired
+        """
+        if not self.is_readable:
+            return None
+        now = time.time()
+        rows = self._execute('SELECT metadata FROM metadata '
+                             'WHERE repo = ? AND identifier = ? '
+                             'AND created >= ?',
+                             repo_name, identifier, now - cliArg['cachettl'])
+        if not rows:
+            return None
+        self._execute('UPDATE metadata SET last_access = ? '
+                      'WHERE repo = ? AND identifier = ?',
+                      now, repo_name, identifier)
+        metadata = json.loads(rows[0][0])
+        # JSON has no tuple
+        metadata['author'] = tuple(metadata['author'])
+        return metadata
+
+    def put(self, repo_name: str, identifier: str, metadata: dict) -> None:
+        """
+        Store metadata in cache, evicting old entries if needed
+
+        :param repo_name: str.
+            The repo name of the handler
+        :param identifier: str.
+            The sanitized identifier
+        :param metadata: dict.
+            The metadata returned by extract_metadata
+        """
+        if not self.is_enabled:
+            return
+        now = time.time()
+        self._execute('INSERT OR REPLACE INTO metadata '
+                      'VALUES (?, ?, ?, ?, ?)',
+                      repo_name, identifier, json.dumps(metadata), now, now)
+        with self._put_count_lock:
+            self._put_count += 1
+            if (self._put_count - 1) % self.evict_interval != 0:
+                return
+        self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        # remove expired entries,
+        # then the least recently used ones above --cachesize
+        self._execute('DELETE FROM metadata WHERE created < ?',
+                      now - cliArg['cachettl'])
+        if not (rows := self._execute('SELECT COUNT(*) FROM metadata')) \
+                or (excess_count := rows[0][0] - cliArg['cachesize']) <= 0:
+            return
+        self._execute('DELETE FROM metadata WHERE rowid IN ('
+                      'SELECT rowid FROM metadata '
+                      'ORDER BY last_access LIMIT ?)',
+                      excess_count)
+
+
+metadata_cache = MetadataCache()
+
+
+class DOIHostCache(_SqliteStore):
+    """
+    Host of the landing pages of each DOI prefix,
+    e.g. 10.1098 -> royalsocietypublishing.org
+
+    Entries expire after --cachettl seconds
+    """
+
+    table_name = 'doi_host'
+    table_schema = ('CREATE TABLE IF NOT EXISTS doi_host ('
+                    'prefix TEXT PRIMARY KEY, '
+                    'host TEXT NOT NULL, '
+                    'created REAL NOT NULL)')
+
+    def get(self, doi_prefix: str) -> Optional[str]:
+        """
+        Get the host of a DOI prefix
+
+        :param doi_prefix: str.
+            The DOI prefix, e.g. 10.1098
+        :return: str, or None.
+            The host, or None if not cached or expired
+        """
+        if not self.is_readable:
+            return None
+        rows = self._execute('SELECT host FROM doi_host '
+                             'WHERE prefix = ? AND created >= ?',
+                             doi_prefix, time.time() - cliArg['cachettl'])
+        return rows[0][0] if rows else None
+
+    def put(self, doi_prefix: str, host: str) -> None:
+        """
+        Store the host of a DOI prefix
+
+        :param doi_prefix: str.
+            The DOI prefix, e.g. 10.1098
+        :param host: str.
+            The host of the landing pages of DOIs with this prefix
+        """
+        if not self.is_enabled:
+            return
+        self._execute('INSERT OR REPLACE INTO doi_host VALUES (?, ?, ?)',
+                      doi_prefix, host, time.time())
+
+
+doi_host_cache = DOIHostCache()
+
+
+class LinkCache(_SqliteStore):
+    """
+    Download link found at each mirror for a document,
+    keyed by (repo name, identifier, mirror)
+
+    A link is stored with NULL as link when the mirror had none,
+    so that it is not asked again.
+    Links expire after --linkttl seconds, as mirror links may expire,
+    and misses after --missttl seconds.
+    Expired entries are removed on the first store of a run,
+    then every evict_interval stores.
+    """
+
+    table_name = 'link'
+    table_schema = ('CREATE TABLE IF NOT EXISTS link ('
+                    'repo TEXT NOT NULL, '
+                    'identifier TEXT NOT NULL, '
+                    'mirror TEXT NOT NULL, '
+                    'link TEXT, '
+                    'created REAL NOT NULL, '
+                    'PRIMARY KEY (repo, identifier, mirror))')
+    index_schema_tuple = (
+        'CREATE INDEX IF NOT EXISTS link_created ON link (created)',
+    )
+
+    # number of stores between removals of expired entries
+    evict_interval = 100
+
+    def __init__(self):
+        super().__init__()
+        self._put_count_lock = threading.Lock()
+        self._put_count = 0
+
+    def _get_record(self,
+                    repo_name: str,
+                    identifier: str,
+                    mirror_link: str) -> Optional[tuple]:
+        if not self.is_readable:
+            return None
+        rows = self._execute('SELECT link, created FROM link '
+                             'WHERE repo = ? AND identifier = ? '
+                             'AND mirror = ?',
+                             repo_name, identifier, mirror_link)
+        return rows[0] if rows else None
+
+    def get_link(self,
+                 repo_name: str,
+                 identifier: str,
+                 mirror_link: str) -> Optional[str]:
+        """
+        Get the download link found at the mirror within TTL
+
+        :param repo_name: str.
+            The repo name of the handler
+        :param identifier: str.
+            The sanitized identifier
+        :param mirror_link: str.
+            The URL of the mirror
+        :return: str, or None.
+            The link, or None if not cached or expired
+        """
+        if (record := self._get_record(repo_name,
+                                       identifier,
+                                       mirror_link)) is None:
+            return None
+        link, created = record
+        return (link
+                if link is not None
+                and created >= time.time() - cliArg['linkttl']
+                else None)
+
+    def is_known_miss(self,
+                      repo_name: str,
+                      identifier: str,
+                      mirror_link: str) -> bool:
+        """
+        Check if the mirror had no download link within TTL
+
+        :param repo_name: str.
+            The repo name of the handler
+        :param identifier: str.
+            The sanitized identifier
+        :param mirror_link: str.
+            The URL of the mirror
+        :return: bool.
+        """
+        if (record := self._get_record(repo_name,
+                                       identifier,
+                                       mirror_link)) is None:
+            return False
+        link, created = record
+        return (link is None
+                and created >= time.time() - cliArg['missttl'])
+
+    def put(self,
+            repo_name: str,
+            identifier: str,
+            mirror_link: str,
+            link: Optional[str]) -> None:
+        """
+        Store the download link found at the mirror,
+        removing expired entries now and then
+
+        :param repo_name: str.
+            The repo name of the handler
+        :param identifier: str.
+            The sanitized identifier
+        :param mirror_link: str.
+            The URL of the mirror
+        :param link: str, or None.
+            The link, or None if the mirror had none
+        """
+        if not self.is_enabled:
+            return
+        now = time.time()
+        self._execute('INSERT OR REPLACE INTO link VALUES (?, ?, ?, ?, ?)',
+                      repo_name, identifier, mirror_link, link, now)
+        with self._put_count_lock:
+            self._put_count += 1
+            if (self._put_count - 1) % self.evict_interval != 0:
+                return
+        link_expiry = now - cliArg['linkttl']
+        miss_expiry = now - cliArg['missttl']
+        # the first condition is answered from the index on created
+        self._execute('DELETE FROM link WHERE created < ? '
+                      'AND ((link IS NOT NULL AND created < ?) '
+                      'OR (link IS NULL AND created < ?))',
+                      max(link_expiry, miss_expiry),
+                      link_expiry, miss_expiry)
+
+    def forget_link(self,
+                    repo_name: str,
+                    identifier: str,
+                    link: str) -> None:
+        """
+        Remove a download link, e.g. when it cannot be downloaded
+
+        :param repo_name: str.
+            The repo name of the handler
+        :param identifier: str.
+            The sanitized identifier
+        :param link: str.
+            The link
+        """
+        if not self.is_enabled:
+            return
+        self._execute('DELETE FROM link '
+                      'WHERE repo = ? AND identifier = ? AND link = ?',
+                      repo_name, identifier, link)
+
+
+link_cache = LinkCache()
+
+
+class MirrorHealthTable(_SqliteStore):
+    """
+    Health record of each mirror, shared across runs
+
+    Stores the last success, last failure, number of consecutive failures
+    and recent latencies of a mirror.
+    A record is trusted for --mirrorttl seconds.
+    The median of recent latencies shortens the probe timeout of the mirror.
+    """
+
+    table_name = 'mirror_health'
+    table_schema = ('CREATE TABLE IF NOT EXISTS mirror_health ('
+                    'mirror TEXT PRIMARY KEY, '
+                    'last_success REAL, '
+                    'last_failure REAL, '
+                    'consecutive_failures INTEGER NOT NULL DEFAULT 0, '
+                    'latencies TEXT NOT NULL DEFAULT \'[]\')')
+
+    # number of latest latencies kept for the median
+    latency_history_size = 20
+    # the probe timeout of a mirror with known latencies
+    # is this many times its median latency ...
+    probe_latency_factor = 10
+    # ... but at least this many seconds
+    min_probe_timeout = 3
+
+    def _get_record(self, mirror_link: str) -> Optional[tuple]:
+        if not self.is_readable:
+            return None
+        rows = self._execute('SELECT last_success, last_failure, '
+                             'consecutive_failures, latencies '
+                             'FROM mirror_health WHERE mirror = ?',
+                             mirror_link)
+        return rows[0] if rows else None
+
+    def is_known_up(self, mirror_link: str) -> bool:
+        """
+        Check if the mirror was online within TTL
+
+        :param mirror_link: str.
+            The URL of the mirror
+        :return: bool.
+        """
+        if (record := self._get_record(mirror_link)) is None:
+            return False
+        last_success, last_failure, _, _ = record
+        return (last_success is not None
+                and last_success >= time.time() - cliArg['mirrorttl']
+                and (last_failure is None or last_failure < last_success))
+
+    def is_known_down(self, mirror_link: str) -> bool:
+        """
+        Check if the mirror failed within TTL
+        and has not succeeded since then
+
+        :param mirror_link: str.
+            The URL of the mirror
+        :return: bool.
+        """
+        if (record := self._get_record(mirror_link)) is None:
+            return False
+        last_success, last_failure, consecutive_failures, _ = record
+        return (consecutive_failures > 0
+                and last_failure >= time.time() - cliArg['mirrorttl']
+                and (last_success is None or last_success < last_failure))
+
+    def median_latency(self, mirror_link: str) -> Optional[float]:
+        """
+        Get the median of recent latencies of the mirror
+
+        :param mirror_link: str.
+            The URL of the mirror
+        :return: float, or None.
+            The median latency in seconds, or None if not known
+        """
+        if (record := self._get_record(mirror_link)) is None:
+            return None
+        latencies = sorted(json.loads(record[3]))
+        if len(latencies) == 0:
+            return None
+        mid = len(latencies) // 2
+        return (latencies[mid]
+                if len(latencies) % 2 == 1
+                else (latencies[mid - 1] + latencies[mid]) / 2)
+
+    def probe_timeout(self, mirror_link: str) -> float:
+        """
+        Get the read timeout for checking if the mirror is online
+
+        A mirror usually answering quickly is given up on
+        probe_latency_factor times its median latency
+        (but not sooner than min_probe_timeout seconds),
+        instead of waiting for the whole --probetimeout
+
+        :param mirror_link: str.
+            The URL of the mirror
+        :return: float.
+            The read timeout in seconds
+        """
+        if (median := self.median_latency(mirror_link)) is None:
+            return cliArg['probetimeout']
+        return min(cliArg['probetimeout'],
+                   max(self.probe_latency_factor * median,
+                       self.min_probe_timeout))
+
+    def record_success(self, mirror_link: str, latency: float) -> None:
+        """
+        Record that the mirror responded
+
+        :param mirror_link: str.
+            The URL of the mirror
+        :param latency: float.
+            The response time in seconds
+        """
+        if not self.is_enabled:
+            return
+
+        def update(conn: sqlite3.Connection) -> None:
+            rows = conn.execute('SELECT latencies FROM mirror_health '
+                                'WHERE mirror = ?', (mirror_link,)) \
+                .fetchall()
+            latencies = json.loads(rows[0][0]) if rows else list()
+            latencies = (latencies + [latency])[-self.latency_history_size:]
+            conn.execute('INSERT INTO mirror_health '
+                         '(mirror, last_success, consecutive_failures, '
+                         'latencies) VALUES (?, ?, 0, ?) '
+                         'ON CONFLICT (mirror) DO UPDATE SET '
+                         'last_success = excluded.last_success, '
+                         'consecutive_failures = 0, '
+                         'latencies = excluded.latencies',
+                         (mirror_link, time.time(), json.dumps(latencies)))
+
+        self._run_transaction(update)
+
+    def record_failure(self, mirror_link: str) -> None:
+        """
+        Record that the mirror cannot be connected to
+
+        :param mirror_link: str.
+            The URL of the mirror
+        """
+        if not self.is_enabled:
+            return
+        self._execute('INSERT INTO mirror_health '
+                      '(mirror, last_failure, consecutive_failures) '
+                      'VALUES (?, ?, 1) '
+                      'ON CONFLICT (mirror) DO UPDATE SET '
+                      'last_failure = excluded.last_failure, '
+                      'consecutive_failures = consecutive_failures + 1',
+                      mirror_link, time.time())
+
+    def usable_mirrors(self, mirror_list: Tuple[str]) -> Tuple[str]:
+        """
+        Remove mirrors known to be down from the mirror list
+
+        If all mirrors are known to be down, all of them are kept
+        so that they are tried again
+
+        :param mirror_list: tuple[str].
+            The mirrors, in order of preference
+        :return: tuple[str].
+            The mirrors not known to be down, in the same order
+        """
+        usable_list = tuple(mirror_link
+                            for mirror_link in mirror_list
+                            if not self.is_known_down(mirror_link))
+        for mirror_link in mirror_list:
+            if mirror_link not in usable_list:
+                console_print(f"Mirror {PColor.PATH(mirror_link)} "
+                              "failed recently. "
+                              + ("Skipping it"
+                                 if len(usable_list) != 0
+                                 else "Trying it anyway"),
+                              msg_verbose_level=VerboseLevel.VERBOSE)
+        return usable_list if len(usable_list) != 0 else tuple(mirror_list)
+
+
+mirror_health = MirrorHealthTable()
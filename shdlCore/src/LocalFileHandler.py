@@ -1,13 +1,87 @@
-import requests as rq
+import asyncio
+import json
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from contextvars import copy_context
 from pathlib import Path
-from typing import BinaryIO, Union
+from re import match as re_match
+from typing import BinaryIO, Optional, Union
+from urllib.parse import urlparse
+
+import requests as rq
 
 from .CommonUtil import *
+from .AsyncHttpSession import async_http_transport
+from .HttpSession import http_transport
+from .RequestTimeout import RequestKind, check_deadline, get_remaining_time
+from .RetryPolicy import retry_policy
+
+# files are downloaded to <target>.part first,
+# with download state recorded in <target>.part.json
+# so that an interrupted download can be resumed in later runs
+_part_suffix = '.part'
+_part_state_suffix = '.part.json'
+# bytes downloaded between each update of the part state file
+_part_state_update_interval = 1024 ** 2
+# smallest segment in segmented download
+_min_segment_size = 1024 ** 2
+# target path -> lock held while downloading to it
+_target_lock_dict = dict()
+_target_lock_dict_lock = threading.Lock()
+# event loop -> {target path: asyncio.Lock}
+_async_target_lock_dict = weakref.WeakKeyDictionary()
+
+
+class _StreamInterruptedError(Exception):
+    """
+    Raised when a download breaks, before or after the response is received,
+    so that it can be resumed from what is written
+    """
+
+    def __init__(self, cause: rq.exceptions.RequestException):
+        super().__init__(str(cause))
+        self.cause = cause
+
+
+class _RangeMismatchError(Exception):
+    """
+    Raised when a resumed download does not start where the part file ends,
+    after the part file is emptied so that it is downloaded from start
+    """
+
+
+def _get_part_path(write_path_obj: Path) -> Path:
+    return write_path_obj.with_name(write_path_obj.name + _part_suffix)
+
+
+def _get_part_state_path(write_path_obj: Path) -> Path:
+    return write_path_obj.with_name(write_path_obj.name + _part_state_suffix)
+
+
+def _read_part_state(write_path_obj: Path) -> Optional[dict]:
+    try:
+        with _get_part_state_path(write_path_obj).open('rt') as state_handle:
+            return json.load(state_handle)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_part_state(write_path_obj: Path, part_state: dict) -> None:
+    try:
+        with _get_part_state_path(write_path_obj).open('wt') as state_handle:
+            json.dump(part_state, state_handle)
+    except OSError:
+        # only resuming is affected
+        console_print("Cannot record download state",
+                      msg_verbose_level=VerboseLevel.VERBOSE)
 
 
 def _get_local_file_write_handler(
         write_path_obj: Path) -> Union[bool, BinaryIO]:
-    if len(str(write_path_obj)) >= 250:
+    if len(str(write_path_obj)) + len(_part_state_suffix) >= 250:
         console_print(PColor.ERROR("ERROR:"), end=" ")
         console_print("Target download path is too long")
         return False
@@ -28,7 +102,8 @@ def _get_local_file_write_handler(
         return True
     # info_print(f"Downloading to {PColor.PATH(str(write_path_obj))}")
     try:
-        f_handle = write_path_obj.open('wb')
+        # append mode: keep what is downloaded for resuming
+        f_handle = _get_part_path(write_path_obj).open('ab')
     except (PermissionError, FileNotFoundError):
         # TODO better handling of exceptions
         console_print(PColor.ERROR("ERROR:"), end=" ")
@@ -44,66 +119,557 @@ def _get_local_file_write_handler(
     return f_handle
 
 
+class _DownloadProgress:
+    """
+    Progress of a download, shared by all connections downloading the file
+    """
+
+    def __init__(self, file_size: Optional[int], downloaded_size: int = 0):
+        self.file_size = file_size
+        self.downloaded_size = downloaded_size
+        self.lock = threading.RLock()
+        self._last_line_len = 0
+        self._last_state_update_size = downloaded_size
+
+    def add(self, size: int) -> bool:
+        """
+        Add downloaded bytes and print the progress
+
+        :param size: int.
+            The number of bytes downloaded
+        :return: bool.
+            If the part state file should be updated
+        """
+        with self.lock:
+            self.downloaded_size += size
+            if self.file_size is None:
+                dl_msg = "Downloaded " \
+                         + human_byte_unit_string(self.downloaded_size)
+            else:
+                percent = self.downloaded_size / self.file_size * 100
+                dl_msg = "Download " \
+                         f"{percent :.2f}% " \
+                         f"({human_byte_unit_string(self.downloaded_size)})"
+            console_print(dl_msg, end="")
+            len_dl_msg = len(dl_msg)
+            console_print(" " * (self._last_line_len - len_dl_msg), end="\r")
+            self._last_line_len = len_dl_msg
+            if self.downloaded_size - self._last_state_update_size \
+                    >= _part_state_update_interval:
+                self._last_state_update_size = self.downloaded_size
+                return True
+            return False
+
+
+def _get_if_range(part_state: dict) -> Optional[str]:
+    # only resume if the remote file is unchanged
+    if (etag := part_state.get('etag')) is not None \
+            and not etag.startswith('W/'):
+        return etag
+    return part_state.get('last_modified')
+
+
+def _get_resume_offset(target_url: str,
+                       local_file_handle: BinaryIO,
+                       part_state: Optional[dict]) -> int:
+    # only resume if the part file is what the state file says
+    part_size = local_file_handle.tell()
+    if part_size == 0 \
+            or part_state is None \
+            or 'segments' in part_state \
+            or part_state.get('url') != target_url \
+            or part_state.get('received') != part_size \
+            or part_state.get('encoded', False):
+        return 0
+    return part_size
+
+
+def _get_content_range_start(headers) -> Optional[int]:
+    # the first byte in the Content-Range of a 206 response
+    if (match_obj := re_match(r'^\s*bytes\s+(\d+)-',
+                              headers.get('Content-Range', ''))) is None:
+        return None
+    return int(match_obj.group(1))
+
+
+def _is_content_encoded(headers) -> bool:
+    # the body is decoded by requests and aiohttp,
+    # so its size is not Content-Length, and ranges are of the encoded body
+    return headers.get('Content-Encoding',
+                       'identity').strip().lower() != 'identity'
+
+
+def _get_resume_request_headers(resume_offset: int,
+                                part_state: Optional[dict]) -> dict:
+    req_headers = dict()
+    if resume_offset != 0:
+        req_headers['Range'] = f'bytes={resume_offset}-'
+        if (if_range := _get_if_range(part_state)) is not None:
+            req_headers['If-Range'] = if_range
+    return req_headers
+
+
+def _start_single_stream(target_url: str,
+                         local_file_handle: BinaryIO,
+                         write_path_obj: Path,
+                         resume_offset: int,
+                         status_code: int,
+                         headers) -> Optional[dict]:
+    # check the response and prepare the part file for writing
+    # returns the new part state, or None if failed
+    if status_code == 206 and resume_offset != 0:
+        if (range_start := _get_content_range_start(headers)) \
+                != resume_offset:
+            info_print("Remote resumed from "
+                       + ("an unknown position"
+                          if range_start is None
+                          else human_byte_unit_string(range_start))
+                       + " instead of "
+                       + human_byte_unit_string(resume_offset)
+                       + ". Download from start")
+            local_file_handle.seek(0)
+            local_file_handle.truncate()
+            raise _RangeMismatchError
+        info_print("Resuming download from "
+                   + human_byte_unit_string(resume_offset))
+    elif status_code == 200:
+        if resume_offset != 0:
+            info_print("Remote does not support resuming. "
+                       "Download from start")
+            resume_offset = 0
+        local_file_handle.seek(0)
+        local_file_handle.truncate()
+    else:
+        console_print("Failed to download from "
+                      f"target path {PColor.PATH(target_url)} "
+                      f"(HTTP {status_code})")
+        return None
+    file_size = headers.get('Content-Length', None)
+    if (is_encoded := _is_content_encoded(headers)):
+        file_size = None
+    if file_size is None:
+        console_print("File size not known")
+    else:
+        file_size = int(file_size) + resume_offset
+        console_print("File size: " + human_byte_unit_string(file_size))
+    part_state = {
+        'url':           target_url,
+        'etag':          headers.get('ETag', None),
+        'last_modified': headers.get('Last-Modified', None),
+        'size':          file_size,
+        'received':      resume_offset,
+        'encoded':       is_encoded,
+    }
+    _write_part_state(write_path_obj, part_state)
+    return part_state
+
+
+def _download_single_stream(target_url: str,
+                            local_file_handle: BinaryIO,
+                            write_path_obj: Path,
+                            part_state: Optional[dict]) -> bool:
+    resume_offset = _get_resume_offset(target_url,
+                                       local_file_handle,
+                                       part_state)
+    try:
+        dl_res = http_transport.get(
+            target_url,
+            stream=True,
+            timeout=RequestKind.DOWNLOAD,
+            headers=_get_resume_request_headers(resume_offset, part_state))
+    except rq.exceptions.RequestException as e:
+        raise _StreamInterruptedError(e) from e
+    with dl_res:
+        part_state = _start_single_stream(target_url,
+                                          local_file_handle,
+                                          write_path_obj,
+                                          resume_offset,
+                                          dl_res.status_code,
+                                          dl_res.headers)
+        if part_state is None:
+            return False
+        progress = _DownloadProgress(part_state['size'],
+                                     part_state['received'])
+        try:
+            for data_chunk in dl_res.iter_content(chunk_size=cliArg['chunk']):
+                check_deadline()
+                local_file_handle.write(data_chunk)
+                if progress.add(len(data_chunk)):
+                    local_file_handle.flush()
+                    part_state['received'] = progress.downloaded_size
+                    _write_part_state(write_path_obj, part_state)
+        except rq.exceptions.RequestException as e:
+            raise _StreamInterruptedError(e) from e
+        finally:
+            # record what is written, even if interrupted
+            local_file_handle.flush()
+            part_state['received'] = progress.downloaded_size
+            _write_part_state(write_path_obj, part_state)
+    return _finish_download(write_path_obj,
+                            part_state['size'],
+                            progress.downloaded_size)
+
+
+async def _async_download_single_stream(target_url: str,
+                                        local_file_handle: BinaryIO,
+                                        write_path_obj: Path,
+                                        part_state: Optional[dict]) -> bool:
+    # same as _download_single_stream
+    # writes are to local disk and are not awaited
+    resume_offset = _get_resume_offset(target_url,
+                                       local_file_handle,
+                                       part_state)
+    async with AsyncExitStack() as exit_stack:
+        try:
+            dl_res = await exit_stack.enter_async_context(
+                async_http_transport.stream(
+                    'GET',
+                    target_url,
+                    timeout=RequestKind.DOWNLOAD,
+                    headers=_get_resume_request_headers(resume_offset,
+                                                        part_state)))
+        except rq.exceptions.RequestException as e:
+            raise _StreamInterruptedError(e) from e
+        part_state = _start_single_stream(target_url,
+                                          local_file_handle,
+                                          write_path_obj,
+                                          resume_offset,
+                                          dl_res.status_code,
+                                          dl_res.headers)
+        if part_state is None:
+            return False
+        progress = _DownloadProgress(part_state['size'],
+                                     part_state['received'])
+        try:
+            async for data_chunk \
+                    in dl_res.iter_content(chunk_size=cliArg['chunk']):
+                check_deadline()
+                local_file_handle.write(data_chunk)
+                if progress.add(len(data_chunk)):
+                    local_file_handle.flush()
+                    part_state['received'] = progress.downloaded_size
+                    _write_part_state(write_path_obj, part_state)
+        except rq.exceptions.RequestException as e:
+            raise _StreamInterruptedError(e) from e
+        finally:
+            # record what is written, even if interrupted
+            local_file_handle.flush()
+            part_state['received'] = progress.downloaded_size
+            _write_part_state(write_path_obj, part_state)
+    return _finish_download(write_path_obj,
+                            part_state['size'],
+                            progress.downloaded_size)
+
+
+def _get_segmented_state(target_url: str,
+                         local_file_handle: BinaryIO,
+                         part_state: Optional[dict]) -> Optional[dict]:
+    # resume the segments recorded in the part state file, if it is valid
+    if part_state is not None \
+            and part_state.get('url') == target_url \
+            and part_state.get('segments') \
+            and part_state.get('size') == local_file_handle.tell():
+        return part_state
+    # otherwise check if the remote supports range requests
+    try:
+        probe_res = http_transport.head(target_url,
+                                        allow_redirects=True,
+                                        timeout=RequestKind.DOWNLOAD)
+    except rq.exceptions.RequestException as e:
+        # a single stream is tried (and resumed) instead
+        console_print(f"Cannot check segmented download support ({e})",
+                      msg_verbose_level=VerboseLevel.VERBOSE)
+        return None
+    file_size = probe_res.headers.get('Content-Length', None)
+    if probe_res.status_code != 200 \
+            or probe_res.headers.get('Accept-Ranges', '').lower() != 'bytes' \
+            or file_size is None:
+        console_print("Remote does not support segmented download",
+                      msg_verbose_level=VerboseLevel.VERBOSE)
+        return None
+    file_size = int(file_size)
+    segment_count = min(cliArg['segments'], file_size // _min_segment_size)
+    if segment_count <= 1:
+        return None
+    segment_size = -(-file_size // segment_count)
+    # preallocate the file so that each segment can be written at its offset
+    local_file_handle.seek(0)
+    local_file_handle.truncate()
+    local_file_handle.truncate(file_size)
+    return {
+        'url':           target_url,
+        'etag':          probe_res.headers.get('ETag', None),
+        'last_modified': probe_res.headers.get('Last-Modified', None),
+        'size':          file_size,
+        'received':      0,
+        # [first byte, last byte, bytes received] of each segment
+        'segments':      [[start, min(start + segment_size, file_size) - 1, 0]
+                          for start in range(0, file_size, segment_size)],
+    }
+
+
+def _download_segment(target_url: str,
+                      write_path_obj: Path,
+                      segment: list,
+                      part_state: dict,
+                      progress: _DownloadProgress,
+                      abort_event: threading.Event) -> Optional[bool]:
+    start, end, received = segment
+    if start + received > end:
+        return True
+    req_headers = {'Range': f'bytes={start + received}-{end}'}
+    if (if_range := _get_if_range(part_state)) is not None:
+        req_headers['If-Range'] = if_range
+    try:
+        # unbuffered: what is counted as received is already written
+        with _get_part_path(write_path_obj).open('r+b',
+                                                 buffering=0) as seg_handle, \
+                http_transport.get(target_url,
+                                   stream=True,
+                                   timeout=RequestKind.DOWNLOAD,
+                                   headers=req_headers) as dl_res:
+            if dl_res.status_code != 206 \
+                    or _get_content_range_start(dl_res.headers) \
+                    != start + received:
+                # range not supported, or remote file changed
+                abort_event.set()
+                return None
+            seg_handle.seek(start + received)
+            for data_chunk in dl_res.iter_content(chunk_size=cliArg['chunk']):
+                if abort_event.is_set():
+                    return False
+                check_deadline()
+                data_chunk = data_chunk[:end + 1 - (start + received)]
+                seg_handle.write(data_chunk)
+                received += len(data_chunk)
+                segment[2] = received
+                if progress.add(len(data_chunk)):
+                    with progress.lock:
+                        part_state['received'] = progress.downloaded_size
+                        _write_part_state(write_path_obj, part_state)
+                if start + received > end:
+                    break
+    except rq.exceptions.RequestException as e:
+        console_print(f"Segment starting at byte {start} failed ({e})",
+                      msg_verbose_level=VerboseLevel.VERBOSE)
+        # other segments are stopped, and the download resumed as a whole
+        raise _StreamInterruptedError(e) from e
+    return start + received > end
+
+
+def _download_segmented(target_url: str,
+                        local_file_handle: BinaryIO,
+                        write_path_obj: Path,
+                        part_state: Optional[dict]) -> Optional[bool]:
+    """
+    Download the file with several connections, each for a byte range
+
+    :param target_url: str.
+        The URL of the file
+    :param local_file_handle: BinaryIO.
+        The handle of the part file
+    :param write_path_obj: Path.
+        The target path
+    :param part_state: dict, or None.
+        The part state read from the part state file
+    :return: bool, or None.
+        If the download is done,
+        or None if the remote does not support range requests
+    """
+    part_state = _get_segmented_state(target_url,
+                                      local_file_handle,
+                                      part_state)
+    if part_state is None:
+        return None
+    local_file_handle.close()
+    segment_list = part_state['segments']
+    file_size = part_state['size']
+    downloaded_size = sum(segment[2] for segment in segment_list)
+    if downloaded_size != 0:
+        info_print("Resuming download from "
+                   + human_byte_unit_string(downloaded_size))
+    console_print("File size: " + human_byte_unit_string(file_size))
+    console_print(f"Downloading in {len(segment_list)} segments",
+                  msg_verbose_level=VerboseLevel.VERBOSE)
+    progress = _DownloadProgress(file_size, downloaded_size)
+    abort_event = threading.Event()
+    _write_part_state(write_path_obj, part_state)
+    with ThreadPoolExecutor(max_workers=len(segment_list)) as executor:
+        future_list = [executor.submit(copy_context().run,
+                                       _download_segment,
+                                       target_url, write_path_obj, segment,
+                                       part_state, progress, abort_event)
+                       for segment in segment_list]
+        try:
+            result_list = [future.result() for future in future_list]
+        finally:
+            # stop other segments and record what is written,
+            # even if interrupted
+            abort_event.set()
+            with progress.lock:
+                part_state['received'] = progress.downloaded_size
+                _write_part_state(write_path_obj, part_state)
+    if None in result_list:
+        info_print("Remote does not support segmented download. "
+                   "Download from start")
+        return None
+    return _finish_download(write_path_obj, file_size,
+                            progress.downloaded_size)
+
+
+def _finish_download(write_path_obj: Path,
+                     file_size: Optional[int],
+                     downloaded_size: int) -> bool:
+    if file_size is not None and downloaded_size < file_size:
+        # connection closed early, the rest can be resumed
+        raise _StreamInterruptedError(rq.exceptions.ChunkedEncodingError(
+            "Download ended but with a smaller file size ("
+            + human_byte_unit_string(downloaded_size)
+            + ") than excepted"))
+    _get_part_path(write_path_obj).replace(write_path_obj)
+    _get_part_state_path(write_path_obj).unlink()
+    if file_size is not None and downloaded_size > file_size:
+        # kept, as it may still be usable
+        info_print(PColor.WARNING("WARNING: ")
+                   + "Download ended but with a larger file size ("
+                   + human_byte_unit_string(downloaded_size)
+                   + ") than excepted. File may be corrupted. ")
+        return False
+    console_print(f"\n{PColor.INFO('Download done')}")
+    return True
+
+
 def _download_file_to_local(target_url: str,
-                            local_file_handle: BinaryIO) -> bool:
+                            local_file_handle: BinaryIO,
+                            write_path_obj: Optional[Path] = None) -> bool:
     if cliArg['dryrun']:
         # just to be safe
         assert local_file_handle.closed
         console_print(f"{PColor.INFO('Dryrun')}. Skipping download",
                       msg_verbose_level=VerboseLevel.PRINT)
         return True
-    downloaded_size = 0
-    last_line_len = 0
-    file_size = None
-    dl_msg = None
+    if write_path_obj is None:
+        write_path_obj = Path(local_file_handle.name[:-len(_part_suffix)])
     # console_print(f"Downloading from {PColor.PATH(target_url)} ...",
     #               msg_verbose_level=VerboseLevel.VERBOSE)
-    with rq.get(target_url, stream=True, **cliArg['rqKwargs']) as dl_res:
-        if dl_res.status_code != 200:
-            console_print("Failed to download from "
-                          f"target path {PColor.PATH(target_url)}")
-            return False
-        file_size = dl_res.headers.get('Content-Length', None)
-        if file_size is None:
-            console_print("File size not known")
-        else:
-            file_size = int(file_size)
-            console_print("File size: " + human_byte_unit_string(file_size))
+    attempt = 0
+    while True:
+        try:
+            return _download_file_once(target_url,
+                                       local_file_handle,
+                                       write_path_obj)
+        except _StreamInterruptedError as e:
+            if (delay := _get_resume_delay(target_url, attempt, e)) is None:
+                return False
+        except _RangeMismatchError:
+            # the part file is emptied
+            delay = 0
+        time.sleep(delay)
+        attempt += 1
+        local_file_handle = _get_part_path(write_path_obj).open('ab')
+
+
+def _download_file_once(target_url: str,
+                        local_file_handle: BinaryIO,
+                        write_path_obj: Path) -> bool:
+    part_state = _read_part_state(write_path_obj)
+    if cliArg['segments'] > 1:
         with local_file_handle:
-            for data_chunk in dl_res.iter_content(chunk_size=cliArg['chunk']):
-                local_file_handle.write(data_chunk)
-                downloaded_size += len(data_chunk)
-                if file_size is None:
-                    dl_msg = "Downloaded " \
-                             + human_byte_unit_string(downloaded_size)
-                else:
-                    dl_msg = "Download " \
-                             f"{downloaded_size / file_size * 100 :.2f}% " \
-                             f"({human_byte_unit_string(downloaded_size)})"
-                console_print(dl_msg, end="")
-                len_dl_msg = len(dl_msg)
-                console_print(" " * (last_line_len - len_dl_msg), end="\r")
-                last_line_len = len_dl_msg
-    if file_size is not None and file_size != downloaded_size:
-        info_print(PColor.WARNING("WARNING: ")
-                   + "Download ended but with a "
-                   + ("smaller" if downloaded_size < file_size else "larger")
-                   + " file size ("
-                   + human_byte_unit_string(downloaded_size)
-                   + ") than excepted. "
-                   + "File may be corrupted. ")
-        return False
-    console_print(f"\n{PColor.INFO('Download done')}")
-    return True
+            is_done = _download_segmented(target_url,
+                                          local_file_handle,
+                                          write_path_obj,
+                                          part_state)
+        if is_done is not None:
+            return is_done
+        # fallback, resuming only if the part file is not touched
+        local_file_handle = _get_part_path(write_path_obj).open('ab')
+        part_state = _read_part_state(write_path_obj)
+    with local_file_handle:
+        return _download_single_stream(target_url,
+                                       local_file_handle,
+                                       write_path_obj,
+                                       part_state)
+
+
+def _get_resume_delay(target_url: str,
+                      attempt: int,
+                      error: _StreamInterruptedError) -> Optional[float]:
+    # seconds to wait before resuming an interrupted download,
+    # or None if giving up
+    delay = retry_policy.get_retry_delay(urlparse(target_url).hostname or '',
+                                         attempt,
+                                         error=error.cause)
+    if delay is not None and (remaining := get_remaining_time()) is not None:
+        # the deadline is checked again when resuming
+        delay = min(delay, max(remaining, 0))
+    console_print("\n" + PColor.WARNING("WARNING:")
+                  + f" Download interrupted ({error}). "
+                  + ("Run again to resume the download"
+                     if delay is None
+                     else f"Resuming in {delay :.1f} s"))
+    return delay
+
+
+def _get_target_lock(write_path_obj: Path) -> threading.Lock:
+    with _target_lock_dict_lock:
+        return _target_lock_dict.setdefault(str(write_path_obj.absolute()),
+                                            threading.Lock())
 
 
 def fetch_url_to_local_path(target_url: str,
                             target_local_path_obj: Path) -> bool:
-    file_handle = _get_local_file_write_handler(target_local_path_obj)
-    if isinstance(file_handle, bool):
-        return file_handle
-    dl_success_status = _download_file_to_local(target_url, file_handle)
-    if cliArg['piping'] and dl_success_status:
-        console_print(str(target_local_path_obj.resolve(True)),
-                      print_suppress=False)
-    return dl_success_status
+    # documents downloaded concurrently may have the same target path
+    with _get_target_lock(target_local_path_obj):
+        file_handle = _get_local_file_write_handler(target_local_path_obj)
+        if isinstance(file_handle, bool):
+            return file_handle
+        return _download_file_to_local(target_url,
+                                       file_handle,
+                                       target_local_path_obj)
+
+
+def _get_async_target_lock(write_path_obj: Path) -> asyncio.Lock:
+    loop_lock_dict = _async_target_lock_dict.setdefault(
+        asyncio.get_running_loop(), dict())
+    return loop_lock_dict.setdefault(str(write_path_obj.absolute()),
+                                     asyncio.Lock())
+
+
+async def async_fetch_url_to_local_path(target_url: str,
+                                        target_local_path_obj: Path) -> bool:
+    """
+    Async version of fetch_url_to_local_path
+
+    Always downloads over a single connection
+
+    :param target_url: str.
+        The URL of the file
+    :param target_local_path_obj: Path.
+        The path to save the file to
+    :return: bool.
+        If the download is done
+    """
+    async with _get_async_target_lock(target_local_path_obj):
+        file_handle = _get_local_file_write_handler(target_local_path_obj)
+        if isinstance(file_handle, bool):
+            return file_handle
+        attempt = 0
+        while True:
+            with file_handle:
+                try:
+                    return await _async_download_single_stream(
+                        target_url,
+                        file_handle,
+                        target_local_path_obj,
+                        _read_part_state(target_local_path_obj))
+                except _StreamInterruptedError as e:
+                    if (delay := _get_resume_delay(target_url,
+                                                   attempt,
+                                                   e)) is None:
+                        return False
+                except _RangeMismatchError:
+                    # the part file is emptied
+                    delay = 0
+            await asyncio.sleep(delay)
+            attempt += 1
+            file_handle = _get_part_path(target_local_path_obj).open('ab')
@@ -0,0 +1,158 @@
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import requests as rq
+
+from .CommonUtil import *
+from .HttpSession import http_transport
+from .LocalCache import metadata_cache
+from .Tracing import trace_span
+
+
+class MetadataBatcher:
+    """
+    Coalesce the metadata requests of documents in a batch
+    into one request for many identifiers
+
+    Only for repos whose handler supports batch_metadata_request,
+    e.g. arXiv and PMID.
+    Documents are added when they are known to need metadata,
+    and are pending until their metadata is fetched.
+    When metadata is fetched for a document,
+    the other pending documents of its repo (up to batch_size in all)
+    are fetched in the same request,
+    waiting at most linger seconds for the chunk to fill.
+    Each document then has its part of the response
+    as its metadata response.
+    Documents left out of the response, or of a failed request,
+    are fetched on their own as without batching.
+
+    Used by the workers of one batch, from several threads
+    """
+
+    # seconds to wait for more documents before sending a chunk not full
+    linger = 0.05
+
+    def __init__(self, batch_size: int):
+        """
+        :param batch_size: int.
+            The most identifiers in a request. 1 disables batching
+        """
+        assert batch_size >= 1
+        self.batch_size = batch_size
+        self._condition = threading.Condition()
+        # repo handler class -> pending (sequence number, handler),
+        # in order of adding
+        self._pending_dict: Dict[type, List[Tuple[int, object]]] = dict()
+        # handler -> set when the chunk it was taken into is fetched
+        self._taken_dict: Dict[object, threading.Event] = dict()
+        # sequence number of the next handler added
+        self._next_sequence = 0
+
+    def add(self, repo_obj) -> None:
+        """
+        Add a document needing metadata, if its repo supports batching
+        and its metadata is not cached
+
+        :param repo_obj: _BaseRepoHandler.
+            The handler of the document
+        """
+        if self.batch_size == 1 \
+                or type(repo_obj).batch_metadata_request(
+                    [repo_obj.identifier]) is None \
+                or metadata_cache.get(repo_obj.repo_name,
+                                      repo_obj.identifier) is not None:
+            return
+        with self._condition:
+            self._pending_dict.setdefault(type(repo_obj), list()).append(
+                (self._next_sequence, repo_obj))
+            self._next_sequence += 1
+            self._condition.notify_all()
+
+    def fetch(self, repo_obj) -> None:
+        """
+        Fetch the metadata response of a document added before,
+        along with other pending documents of its repo
+
+        Does nothing if the document was not added.
+        Waits if it is being fetched in the chunk of another document.
+        The metadata response is left unfetched if the request fails
+
+        :param repo_obj: _BaseRepoHandler.
+            The handler of the document
+        """
+        repo_class = type(repo_obj)
+        with self._condition:
+            taken_event = self._taken_dict.pop(repo_obj, None)
+            pending_list = self._pending_dict.get(repo_class, list())
+            if taken_event is None \
+                    and all(pending_obj is not repo_obj
+                            for _, pending_obj in pending_list):
+                return
+            wait_until = time.monotonic() + self.linger
+            while taken_event is None \
+                    and len(pending_list) < self.batch_size \
+                    and (remaining := wait_until - time.monotonic()) > 0:
+                self._condition.wait(remaining)
+                # may be taken by another document meanwhile
+                taken_event = self._taken_dict.pop(repo_obj, None)
+            if taken_event is None:
+                own_entry = next(entry
+                                 for entry in pending_list
+                                 if entry[1] is repo_obj)
+                pending_list.remove(own_entry)
+                # in the order added, whichever document leads,
+                # so that the request is the same for the same documents
+                chunk = [pending_obj
+                         for _, pending_obj in sorted(
+                             [own_entry]
+                             + pending_list[:self.batch_size - 1])]
+                del pending_list[:self.batch_size - 1]
+                chunk_event = threading.Event()
+                for other_obj in chunk:
+                    if other_obj is not repo_obj:
+                        self._taken_dict[other_obj] = chunk_event
+        if taken_event is not None:
+            taken_event.wait()
+            return
+        try:
+            if len(chunk) > 1:
+                self._fetch_chunk(repo_class, chunk)
+        finally:
+            chunk_event.set()
+
+    @staticmethod
+    def _fetch_chunk(repo_class: type, chunk: List) -> None:
+        # duplicates are requested once
+        identifier_list = list(dict.fromkeys(repo_obj.identifier
+                                             for repo_obj in chunk))
+        console_print(f"{PColor.INFO('Fetching metadata')} "
+                      f"of {len(identifier_list)} documents "
+                      f"for type {PColor.INFO(repo_class.repo_name)}...",
+                      msg_verbose_level=VerboseLevel.VERBOSE)
+        batch_request = repo_class.batch_metadata_request(identifier_list)
+        try:
+            with trace_span('metadata',
+                            repo=repo_class.repo_name,
+                            identifier=','.join(identifier_list),
+                            url=batch_request.url) as metadata_span:
+                response_obj = http_transport.request(batch_request.method,
+                                                      batch_request.url,
+                                                      **batch_request.kwargs)
+                metadata_span.set_response(response_obj)
+        except (rq.exceptions.RequestException, ShdlError) as e:
+            console_print(f"Batched metadata request failed ({e}). "
+                          "Fetching one by one",
+                          msg_verbose_level=VerboseLevel.VERBOSE)
+            return
+        part_response_dict = repo_class.split_metadata_response(
+            response_obj, identifier_list)
+        console_print(f"Metadata of {len(part_response_dict)} "
+                      f"of {len(identifier_list)} documents found "
+                      "in batched response",
+                      msg_verbose_level=VerboseLevel.VERBOSE)
+        for repo_obj in chunk:
+            if (part_response := part_response_dict.get(
+                    repo_obj.identifier)) is not None:
+                repo_obj.metadata_response = part_response
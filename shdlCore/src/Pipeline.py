@@ -0,0 +1,151 @@
+import queue
+import threading
+from contextvars import copy_context
+from typing import Any, Callable, Iterable, Iterator, NamedTuple, \
+    Optional, Sequence, Tuple
+
+from .CommonUtil import *
+
+# marks the end of input in a queue
+_end_of_queue = object()
+
+
+class PipelineStage(NamedTuple):
+    """
+    A stage in StagedPipeline
+
+    func takes the output of the previous stage
+    (or the input item for the first stage)
+    and returns the input of the next stage.
+    queue_size is the number of items that can wait for the stage,
+    the queue_size of the pipeline if None
+    """
+    name: str
+    func: Callable[[Any], Any]
+    worker_count: int
+    queue_size: Optional[int] = None
+
+
+class StagedPipeline:
+    """
+    Run items through a sequence of stages,
+    each with its own pool of worker threads
+
+    Each stage takes its input from a bounded queue,
+    so that a stage blocks (instead of piling up results)
+    when the next stage is busy,
+    and input items are only consumed as fast as they can be processed.
+    An item is passed on as soon as a stage is done with it,
+    so that a slow item in one stage does not hold up the others.
+    If a stage raises an Exception for an item,
+    the item skips the remaining stages.
+
+    Worker threads run in copies of the context calling run,
+    so they see the same cliArg
+    """
+
+    def __init__(self,
+                 stage_list: Sequence[PipelineStage],
+                 queue_size: int):
+        assert len(stage_list) != 0
+        assert all(stage.worker_count >= 1 for stage in stage_list)
+        assert all(stage.queue_size is None or stage.queue_size >= 1
+                   for stage in stage_list)
+        assert queue_size >= 1
+        self.stage_list = tuple(stage_list)
+        self.queue_size = queue_size
+
+    def run(self, item_iterable: Iterable) \
+            -> Iterator[Tuple[Any, Any, Optional[Exception]]]:
+        """
+        Start processing items
+
+        Worker threads are started before this returns.
+        Closing the returned iterator early stops the remaining items
+        from being processed
+
+        :param item_iterable: Iterable.
+            The input items, consumed lazily in another thread
+        :return: Iterator[tuple[Any, Any, Exception | None]].
+            (item, output of last stage, exception raised) for each item,
+            in the order they are done
+        """
+        queue_list = [queue.Queue(maxsize=(self.queue_size
+                                           if stage.queue_size is None
+                                           else stage.queue_size))
+                      for stage in self.stage_list]
+        result_queue = queue.Queue()
+        abort_event = threading.Event()
+        live_worker_count = [stage.worker_count for stage in self.stage_list]
+        count_lock = threading.Lock()
+        feed_error = list()
+
+        def pass_on(stage_idx: int, job) -> None:
+            if stage_idx + 1 == len(self.stage_list):
+                result_queue.put(job)
+            else:
+                queue_list[stage_idx + 1].put(job)
+
+        def work(stage_idx: int) -> None:
+            stage = self.stage_list[stage_idx]
+            while (job := queue_list[stage_idx].get()) is not _end_of_queue:
+                item, value, error = job
+                if error is None and not abort_event.is_set():
+                    try:
+                        value = stage.func(value)
+                    except Exception as e:
+                        error = e
+                if error is not None:
+                    result_queue.put((item, value, error))
+                else:
+                    pass_on(stage_idx, (item, value, None))
+            with count_lock:
+                live_worker_count[stage_idx] -= 1
+                is_last_worker = live_worker_count[stage_idx] == 0
+            # all items of this stage are passed on
+            if is_last_worker:
+                if stage_idx + 1 == len(self.stage_list):
+                    result_queue.put(_end_of_queue)
+                else:
+                    for _ in range(self.stage_list[stage_idx + 1]
+                                           .worker_count):
+                        queue_list[stage_idx + 1].put(_end_of_queue)
+
+        def feed() -> None:
+            try:
+                for item in item_iterable:
+                    if abort_event.is_set():
+                        break
+                    queue_list[0].put((item, item, None))
+            except Exception as e:
+                feed_error.append(e)
+            finally:
+                for _ in range(self.stage_list[0].worker_count):
+                    queue_list[0].put(_end_of_queue)
+
+        thread_list = [threading.Thread(target=copy_context().run,
+                                        args=(feed,),
+                                        name='shdl-feed',
+                                        daemon=True)]
+        for stage_idx, stage in enumerate(self.stage_list):
+            thread_list.extend(
+                threading.Thread(target=copy_context().run,
+                                 args=(work, stage_idx),
+                                 name=f'shdl-{stage.name}-{worker_idx}',
+                                 daemon=True)
+                for worker_idx in range(stage.worker_count)
+            )
+        for thread in thread_list:
+            thread.start()
+
+        def iter_result():
+            try:
+                while (job := result_queue.get()) is not _end_of_queue:
+                    yield job
+                if len(feed_error) != 0:
+                    raise feed_error[0]
+            finally:
+                # remaining items are drained without processing
+                abort_event.set()
+
+        return iter_result()
@@ -0,0 +1,172 @@
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import tracemalloc
+from contextlib import nullcontext
+from typing import ContextManager, List, Optional, Union
+
+from .CommonUtil import *
+
+
+class JobProfiler:
+    """
+    Profile the CPU time (with cProfile),
+    and optionally the memory allocations (with tracemalloc), of a job
+
+    All threads started while profiling are profiled,
+    e.g. the workers of a batch.
+    When stopped, the profile is written as pstats to the profile path
+    (to be read with pstats or e.g. snakeviz),
+    and a summary of the hot functions and allocation sites
+    to the same path with .txt appended.
+
+    Used as a context manager, profiles the code within the context.
+    Messages are printed as configured in the context creating it.
+    Only one job can be profiled at a time
+    """
+
+    def __init__(self,
+                 profile_path: Union[str, Path],
+                 trace_memory: bool = False,
+                 top_count: int = 20):
+        """
+        :param profile_path: str, or Path.
+            The path to write the profile to
+        :param trace_memory: bool.
+            If memory allocations are traced. Makes the job much slower
+        :param top_count: int.
+            The number of functions and allocation sites in the summary
+        """
+        self.profile_path = Path(profile_path).expanduser().resolve()
+        self.trace_memory = trace_memory
+        self.top_count = top_count
+        self._lock = threading.Lock()
+        self._profile_list: List[cProfile.Profile] = list()
+        self._is_tracing_memory = False
+        self._print_suppress = cliArg['piping']
+
+    def __enter__(self) -> 'JobProfiler':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.stop()
+
+    def _profile_new_thread(self, frame, event, arg) -> None:
+        # set by threading.setprofile, called once in each new thread,
+        # replaced by the profile of the thread
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        with self._lock:
+            self._profile_list.append(profile)
+        profile.enable()
+
+    def start(self) -> None:
+        """
+        Start profiling the current thread and threads started later
+
+        :raise ShdlError: if another job is being profiled
+        """
+        global _active_profiler
+        with _active_profiler_lock:
+            if _active_profiler is not None:
+                raise ShdlError(ErrorType.ARG_INVALID,
+                                error_msg="Another job is being profiled")
+            _active_profiler = self
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._is_tracing_memory = True
+        profile = cProfile.Profile()
+        self._profile_list.append(profile)
+        # before 3.12, a profile only sees the thread enabling it
+        if sys.version_info < (3, 12):
+            threading.setprofile(self._profile_new_thread)
+        profile.enable()
+
+    def stop(self) -> None:
+        """
+        Stop profiling, and write the profile and its summary
+
+        Threads still running stop being profiled before 3.12
+        only when they end.
+        Failing to write is reported but not raised,
+        so that the result of the job is not lost
+        """
+        global _active_profiler
+        self._profile_list[0].disable()
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)
+        memory_snapshot = None
+        memory_peak = 0
+        if self._is_tracing_memory:
+            memory_snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+            ))
+            memory_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        with _active_profiler_lock:
+            _active_profiler = None
+        with self._lock:
+            stats = pstats.Stats(*self._profile_list)
+        summary_path = self.profile_path.with_name(self.profile_path.name
+                                                   + '.txt')
+        try:
+            stats.dump_stats(str(self.profile_path))
+            summary_path.write_text(self._get_summary(stats,
+                                                      memory_snapshot,
+                                                      memory_peak),
+                                    encoding='utf-8')
+        except OSError as e:
+            console_print(PColor.ERROR("ERROR:"), end=" ",
+                          print_suppress=self._print_suppress)
+            console_print(f"Cannot write profile: {e}",
+                          print_suppress=self._print_suppress)
+            return
+        console_print("Profile written to "
+                      + PColor.PATH(str(self.profile_path)),
+                      print_suppress=self._print_suppress)
+        console_print("Profile summary written to "
+                      + PColor.PATH(str(summary_path)),
+                      print_suppress=self._print_suppress)
+
+    def _get_summary(self,
+                     stats: pstats.Stats,
+                     memory_snapshot: Optional[tracemalloc.Snapshot],
+                     memory_peak: int) -> str:
+        summary_stream = io.StringIO()
+        stats.stream = summary_stream
+        stats.strip_dirs()
+        for sort_key, title in (('tottime', 'own time'),
+                                ('cumulative', 'cumulative time')):
+            summary_stream.write(f"Hot functions by {title}\n")
+            stats.sort_stats(sort_key).print_stats(self.top_count)
+        if memory_snapshot is not None:
+            summary_stream.write("Allocation sites by size of memory "
+                                 "still allocated at the end\n\n")
+            for stat in memory_snapshot.statistics('lineno')[:self.top_count]:
+                summary_stream.write(f"{stat}\n")
+            summary_stream.write(f"\nPeak traced memory: "
+                                 f"{human_byte_unit_string(memory_peak)}\n")
+        return summary_stream.getvalue()
+
+
+_active_profiler: Optional[JobProfiler] = None
+_active_profiler_lock = threading.Lock()
+
+
+def profile_by_arg() -> ContextManager:
+    """
+    Profile as in cliArg['profile'], cliArg['profilemem']
+    and cliArg['profiletop']
+
+    :return: ContextManager.
+        JobProfiler, or a context doing nothing if not profiling
+    """
+    if cliArg['profile'] is None:
+        return nullcontext()
+    return JobProfiler(cliArg['profile'],
+                       cliArg['profilemem'],
+                       cliArg['profiletop'])
@@ -1,10 +1,11 @@
 from urllib.parse import urljoin
 from xml.etree import ElementTree as eTree
 from re import match as re_match
+from re import sub as re_sub
 from re import IGNORECASE
-import requests as rq
 
 from ..CommonUtil import *
+from ..HttpSession import HttpRequest
 from ._BaseRepoHandler import _BaseRepoHandler
 
 
@@ -34,17 +35,59 @@ class ArxivRepoHandler(_BaseRepoHandler):
         return response_obj.status_code == 200 \
                and 'http://arxiv.org/api/errors' not in response_obj.text
 
-    def get_metadata_response(self):
+    def metadata_response_steps(self):
         console_print(f"{PColor.INFO('Fetching metadata')} "
                       f"for type {PColor.INFO(self.repo_name)}...",
                       msg_verbose_level=VerboseLevel.VERBOSE)
-        return rq.get(
+        return (yield HttpRequest.get(
             'http://export.arxiv.org/api/query?id_list={id}'.format(
                 id=self.identifier
-            ),
-            **cliArg['rqKwargs']
+            )
+        ))
+
+    @classmethod
+    def batch_metadata_request(cls, identifier_list):
+        # at most 10 entries are returned by default
+        return HttpRequest.get(
+            'http://export.arxiv.org/api/query?id_list={id}'
+            '&max_results={count}'.format(id=','.join(identifier_list),
+                                          count=len(identifier_list))
         )
 
+    @classmethod
+    def split_metadata_response(cls, response_obj, identifier_list):
+        # not _is_meta_query_response_valid,
+        # an invalid identifier only gives an error entry of its own
+        if response_obj.status_code != 200:
+            return dict()
+        atom_str = '{http://www.w3.org/2005/Atom}'
+        try:
+            feed_root = eTree.fromstring(response_obj.content)
+        except eTree.ParseError:
+            return dict()
+
+        def strip_version(arxiv_id):
+            return re_sub(r'v\d+$', '', arxiv_id)
+
+        # entry id is e.g. http://arxiv.org/abs/2101.00001v1
+        entry_dict = {
+            strip_version(entry_id.rsplit('/abs/', 1)[-1]): entry_root
+            for entry_root in feed_root.findall(f'{atom_str}entry')
+            if '/abs/' in (entry_id := entry_root.findtext(f'{atom_str}id',
+                                                           ''))
+        }
+        part_response_dict = dict()
+        for identifier in identifier_list:
+            if (entry_root := entry_dict.get(strip_version(identifier))) \
+                    is None:
+                continue
+            part_root = eTree.Element(feed_root.tag)
+            part_root.append(entry_root)
+            part_response_dict[identifier] = cls._get_part_response(
+                response_obj,
+                eTree.tostring(part_root, encoding='unicode').encode('utf-8'))
+        return part_response_dict
+
     def extract_metadata(self):
         if not self._is_meta_query_response_valid(self.metadata_response):
             info_print(f"Response is not a valid {self.repo_name} response")
@@ -63,5 +106,7 @@ class ArxivRepoHandler(_BaseRepoHandler):
             'year':   entry_root.find(f'{atom_str}updated').text[:4],
         }
 
-    def get_download_url(self, mirror_link):
+    def download_url_steps(self, mirror_link):
+        # no request needed
+        yield from ()
         return urljoin(mirror_link, self.identifier + '.pdf')
@@ -1,6 +1,14 @@
+import json
+
 import requests as rq
 
-from urllib.parse import urljoin, urlparse, urlunparse
+from ..HttpSession import HttpRequest, RequestSteps, StepsRace, \
+    http_transport
+from ..LocalCache import doi_host_cache, link_cache, mirror_health
+from ..RequestTimeout import RequestKind
+from ..RetryPolicy import retry_policy
+
+from urllib.parse import urlencode, urljoin, urlparse, urlunparse
 from re import match as re_match
 from re import search as re_search
 from re import sub as re_sub
@@ -11,19 +19,36 @@ from html import unescape, escape
 from unicodedata import category as ud_category
 from unicodedata import name as ud_name
 from xml.etree import ElementTree as eTree
-from typing import Union, Callable
+from typing import Callable, Set, Union
 
 from ..CommonUtil import *
 from ._BaseRepoHandler import _BaseRepoHandler
 
 
+def _print_mirror_error(mirror_link: str,
+                        error: rq.exceptions.RequestException) -> None:
+    info_print(PColor.ERROR("ERROR:"), end=" ")
+    if isinstance(error, rq.exceptions.ConnectionError):
+        info_print(f"Cannot connect to {mirror_link}. "
+                   "Maybe it is not online (for you)?")
+    else:
+        info_print(f"No complete response from {mirror_link} ({error})")
+
+
+def _print_mirror_busy(mirror_link: str, status_code: int) -> None:
+    info_print(PColor.ERROR("ERROR:"), end=" ")
+    info_print(f"{mirror_link} is busy or unavailable "
+               f"(HTTP {status_code}). "
+               "Try again later")
+
+
 class DOIRepoHandler(_BaseRepoHandler):
     repo_name = "DOI"
     query_extract_pattern \
         = (r'^(https?://)?((www\.|dx\.)?doi(\.org)?|'
            r'(link\.)?springer(\.com/(\w+))?)'
            r'(:|/)?\s*(.+)$')
-    mirror_list = cliArg['mirror']
+    mirror_list = CliArgView('mirror')
 
     # TODO change into a class property?
     link_extractor = re_compile(
@@ -38,6 +63,24 @@ class DOIRepoHandler(_BaseRepoHandler):
     )
     aims_xml_sanitizer = re_compile('\\s*<(.+?)>(.+?)</\\1>\\s*',
                                     flags=IGNORECASE | MULTILINE)
+    # name -> host of each alternative metadata source,
+    # the steps of which is alt_metadata_<name>_steps, see --metapriority
+    alt_metadata_source_dict = {
+        'jstor':       'www.jstor.org',
+        'aims':        'www.aimsciences.org',
+        'royalsocpub': 'royalsocietypublishing.org',
+        'springer':    'link.springer.com',
+    }
+    # hosts of DOI prefixes with alternative metadata sources,
+    # others are found with doc_host_steps and kept in doi_host_cache
+    doi_prefix_host_dict = {
+        '10.2307': 'www.jstor.org',
+        '10.3934': 'www.aimsciences.org',
+        '10.1098': 'royalsocietypublishing.org',
+        '10.1007': 'link.springer.com',
+    }
+    # redirects followed to find the document host, as in requests
+    max_host_redirect_count = 30
 
     # Why is this a class method?
     # TODO check if this has to be a class method
@@ -65,22 +108,77 @@ class DOIRepoHandler(_BaseRepoHandler):
             'application/vnd.citationstyles.csl+json'
         )
 
-    def get_metadata_response(self):
+    def metadata_response_steps(self):
         console_print(f"{PColor.INFO('Fetching metadata')} "
                       f"for type {PColor.INFO(self.repo_name)}...",
                       msg_verbose_level=VerboseLevel.VERBOSE)
-        return rq.get(
+        return (yield HttpRequest.get(
             'https://doi.org/{id}'.format(id=self.identifier),
-            headers={**cliArg['rqKwargs']['headers'],
-                     "Accept": "application/vnd.citationstyles.csl+json"},
-            proxies=cliArg['rqKwargs']['proxies']
+            headers={"Accept": "application/vnd.citationstyles.csl+json"}
+        ))
+
+    @classmethod
+    def batch_metadata_request(cls, identifier_list):
+        # a comma would split the filter
+        if cliArg['crossref'] == '' \
+                or any(',' in identifier for identifier in identifier_list):
+            return None
+        return HttpRequest.get(
+            '{base}/works?{query}'.format(
+                base=cliArg['crossref'].rstrip('/'),
+                query=urlencode({
+                    'filter': ','.join(f'doi:{identifier}'
+                                       for identifier in identifier_list),
+                    'rows':   len(identifier_list),
+                }))
         )
 
+    @classmethod
+    def split_metadata_response(cls, response_obj, identifier_list):
+        if response_obj.status_code != 200:
+            return dict()
+        try:
+            item_list = response_obj.json()['message']['items']
+            # DOI is case-insensitive
+            item_dict = {item['DOI'].lower(): item for item in item_list}
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return dict()
+        part_response_dict = dict()
+        for identifier in identifier_list:
+            if (item := item_dict.get(identifier.lower())) is None:
+                continue
+            # a works item is CSL-JSON,
+            # except that these are lists of strings
+            csl_dict = dict(item)
+            for key in ('title', 'container-title'):
+                if isinstance(item.get(key), list) and len(item[key]) != 0:
+                    csl_dict[key] = item[key][0]
+            part_response = cls._get_part_response(
+                response_obj, json.dumps(csl_dict).encode('utf-8'))
+            # as from doi.org
+            part_response.headers['Content-Type'] \
+                = 'application/vnd.citationstyles.csl+json'
+            part_response_dict[identifier] = part_response
+        return part_response_dict
+
     def extract_metadata(self):
-        if not self._is_meta_query_response_valid(self.metadata_response):
+        return http_transport.run_steps(self.extract_metadata_steps())
+
+    def extract_csl_metadata(self, response_obj: rq.Response) \
+            -> Union[bool, dict, None]:
+        """
+        Get metadata from the CSL-JSON response of doi.org only
+
+        :param response_obj: requests.Response.
+            The response of self.metadata_response_steps
+        :return: bool (False), None or dict.
+            Same as self.extract_metadata,
+            None if the response does not have enough metadata
+        """
+        if not self._is_meta_query_response_valid(response_obj):
             info_print(f"Response is not a valid {self.repo_name} response")
             return False
-        meta_json_dict = self.metadata_response.json()
+        meta_json_dict = response_obj.json()
         if all(k in meta_json_dict for k in ('author', 'title')) \
                 and all(all(k in aDict for k in ('given', 'family'))
                         for aDict in meta_json_dict['author']) \
@@ -106,100 +204,206 @@ class DOIRepoHandler(_BaseRepoHandler):
                 'title':  doc_title,
                 'year':   publish_year
             }
+        return None
+
+    def extract_metadata_steps(self):
+        if (metadata := self.extract_csl_metadata(self.metadata_response)) \
+                is not None:
+            return metadata
         # DOI does not return enough metadata
         info_print(PColor.WARNING("WARNING:"), end=" ")
         info_print("DOI query does not return enough metadata. "
                    "Trying alternative methods ...")
-        alt_metadata = self.alt_extract_metadata()
+        alt_metadata = yield from self.alt_metadata_steps()
         if alt_metadata is None:
             info_print(PColor.ERROR("Error:"), end=" ")
             info_print("Response does not have enough metadata. "
                        "Please report this DOI as a bug")
         return alt_metadata
 
-    def get_download_url(
+    def fetch_metadata_steps(self):
+        # the publisher source of the document host (if known)
+        # is run along with doi.org,
+        # as doi.org is known not to give enough metadata for some hosts
+        known_host = self._get_known_host()
+        source_name_list = [
+            source_name
+            for source_name in cliArg['metapriority']
+            if source_name == 'csl'
+            or self.alt_metadata_source_dict.get(source_name) == known_host
+        ]
+        if self._is_metadata_response_fetched \
+                or known_host is None \
+                or source_name_list == ['csl']:
+            return (yield from super().fetch_metadata_steps())
+
+        csl_response_list = list()
+
+        def csl_metadata_steps():
+            # not setting self.metadata_response in another thread
+            response_obj = yield from self._traced_metadata_response_steps()
+            csl_response_list.append(response_obj)
+            return self.extract_csl_metadata(response_obj)
+
+        console_print(f"{PColor.INFO('Fetching metadata')} "
+                      f"from {', '.join(source_name_list)} at the same time",
+                      msg_verbose_level=VerboseLevel.VERBOSE)
+        result_dict = yield StepsRace(
+            tuple((csl_metadata_steps
+                   if source_name == 'csl'
+                   else getattr(self, f'alt_metadata_{source_name}_steps'))()
+                  for source_name in source_name_list),
+            is_accepted=lambda metadata: isinstance(metadata, dict),
+            window=cliArg['racewindow'] / 1000)
+        if len(csl_response_list) != 0:
+            self.metadata_response = csl_response_list[0]
+        accepted_index_list = sorted(
+            source_idx
+            for source_idx, metadata in result_dict.items()
+            if isinstance(metadata, dict))
+        if len(accepted_index_list) == 0:
+            info_print(PColor.ERROR("Error:"), end=" ")
+            info_print("No metadata source has enough metadata")
+            return None if None in result_dict.values() else False
+        console_print("Using metadata from "
+                      f"{source_name_list[accepted_index_list[0]]}",
+                      msg_verbose_level=VerboseLevel.VERBOSE)
+        return result_dict[accepted_index_list[0]]
+
+    def download_url_steps(
             self,
             mirror_link,
             identifier_override: Optional[str] = None,
-            init_query_method_override: Optional[Callable] = None):
+            query_request_override: Optional[
+                Callable[[str], HttpRequest]] = None):
         """
-        Get file download link
-
-        Returns the direct download link to the file.
-        If unable to get the download link, returns None
+        Request steps giving the file download link
 
         :param mirror_link: str.
             The URL of the mirror used to fetch the file
         :param identifier_override: Optional[str].
             The path used for querying mirror.
             If None, will use self.identifier
-        :param init_query_method_override: Optional[Callable]
-            The method used to get the initial query page
-            If None, will use rq.get
-        :return: str, or None.
+        :param query_request_override: Optional[Callable]
+            Takes the query URL and returns the request
+            for the initial query page.
+            If None, will use a GET request
+        :return: RequestSteps, returning str or None.
         """
 
         # test mirror
         if identifier_override is None:
             identifier_override = self.identifier
-        if init_query_method_override is None:
-            init_query_method_override = rq.get
-        console_print("Checking if mirror "
-                      + PColor.PATH(mirror_link)
-                      + " is online ...",
-                      msg_verbose_level=VerboseLevel.VERBOSE)
-        try:
-            if rq.get(mirror_link, **cliArg['rqKwargs']).status_code != 200:
-                raise rq.exceptions.ConnectionError
-        except (rq.exceptions.MissingSchema,
-                rq.exceptions.InvalidSchema,
-                rq.exceptions.InvalidURL):
-            info_print(PColor.ERROR("ERROR:"), end=" ")
-            info_print(f"{mirror_link} does not seem valid")
-            return None
-        except rq.exceptions.ConnectionError:
-            info_print(PColor.ERROR("ERROR:"), end=" ")
-            info_print(f"Cannot connect to {mirror_link}. "
-                       "Maybe it is not online (for you)?")
+        if query_request_override is None:
+            query_request_override = HttpRequest.get
+        link_key = (self.repo_name, self.identifier, mirror_link)
+        if (dl_url := link_cache.get_link(*link_key)) is not None:
+            console_print("Download link found in cache for mirror "
+                          + PColor.PATH(mirror_link),
+                          msg_verbose_level=VerboseLevel.VERBOSE)
+            return dl_url
+        if link_cache.is_known_miss(*link_key):
+            info_print(f"No download link at {mirror_link} recently. "
+                       "Skipping it")
             return None
+        if mirror_health.is_known_up(mirror_link):
+            console_print("Mirror "
+                          + PColor.PATH(mirror_link)
+                          + " was online recently",
+                          msg_verbose_level=VerboseLevel.VERBOSE)
+        else:
+            console_print("Checking if mirror "
+                          + PColor.PATH(mirror_link)
+                          + " is online ...",
+                          msg_verbose_level=VerboseLevel.VERBOSE)
+            try:
+                with self._trace_span('probe', mirror_link) as probe_span:
+                    probe_resp = yield HttpRequest.get(
+                        mirror_link,
+                        timeout=(cliArg['connecttimeout'],
+                                 mirror_health.probe_timeout(mirror_link)))
+                    probe_span.set_response(probe_resp)
+                if retry_policy.is_busy_status(probe_resp.status_code):
+                    # online, so not recorded as a failure
+                    _print_mirror_busy(mirror_link, probe_resp.status_code)
+                    return None
+                if probe_resp.status_code != 200:
+                    raise rq.exceptions.ConnectionError
+            except (rq.exceptions.MissingSchema,
+                    rq.exceptions.InvalidSchema,
+                    rq.exceptions.InvalidURL):
+                info_print(PColor.ERROR("ERROR:"), end=" ")
+                info_print(f"{mirror_link} does not seem valid")
+                return None
+            except rq.exceptions.RequestException as e:
+                # e.g. cannot connect, timed out or cut off
+                mirror_health.record_failure(mirror_link)
+                _print_mirror_error(mirror_link, e)
+                return None
+            mirror_health.record_success(
+                mirror_link,
+                probe_resp.elapsed.total_seconds())
 
         # query mirror
         query_url = urljoin(mirror_link, identifier_override)
         console_print("Querying " + PColor.PATH(query_url) + " ...",
                       msg_verbose_level=VerboseLevel.VERBOSE)
-        preview_resp = init_query_method_override(query_url,
-                                                  **cliArg['rqKwargs'])
+        query_request = query_request_override(query_url)
+        query_request.kwargs.setdefault('timeout', RequestKind.QUERY)
+        try:
+            with self._trace_span('query', query_url) as query_span:
+                preview_resp = yield query_request
+                query_span.set_response(preview_resp)
+        except rq.exceptions.RequestException as e:
+            mirror_health.record_failure(mirror_link)
+            _print_mirror_error(mirror_link, e)
+            return None
+        if retry_policy.is_retryable_status(preview_resp.status_code):
+            # still failing after retries, not the same as no result.
+            # A busy mirror is online, and is tried again next time
+            if not retry_policy.is_busy_status(preview_resp.status_code):
+                mirror_health.record_failure(mirror_link)
+            _print_mirror_busy(mirror_link, preview_resp.status_code)
+            return None
+        mirror_health.record_success(mirror_link,
+                                     preview_resp.elapsed.total_seconds())
         if (not preview_resp.headers['Content-Type'].startswith('text/html')) \
                 or len(preview_resp.text.strip('\n ')) == 0:
             info_print(PColor.ERROR("ERROR:"), end=" ")
             info_print("Response is empty. Perhaps no search result? ")
+            link_cache.put(*link_key, None)
             return None
 
         # parse response
         console_print("Finding download link ...",
                       msg_verbose_level=VerboseLevel.DEBUG)
         possible_link = list()
-        for line in preview_resp.text.splitlines():
-            line = unescape(line).strip()
-            if (match_obj := self
-                    .link_extractor.search(line, IGNORECASE)) is not None:
-                console_print(f"Line with possible link: {PColor.INFO(line)}",
-                              msg_verbose_level=VerboseLevel.DETAIL)
-                dl_url = urlparse(match_obj.group(1)
-                             .rsplit('#', 1)[0]  # rm fragment
-                             .replace(r'\/', '/'),  # unescape \/
-                             scheme='https')  # force scheme if missing
-                # hotfix: deal with relative url
-                if dl_url.netloc == '':
-                    dl_url = dl_url._replace(netloc=urlparse(mirror_link).netloc)
-                dl_url = urlunparse(dl_url)
-                console_print("Link found: " + PColor.PATH(dl_url),
-                              msg_verbose_level=VerboseLevel.VERBOSE)
-                possible_link.append(dl_url)
+        with self._trace_span('linkparse') as parse_span:
+            parse_span.bytes = len(preview_resp.content)
+            for line in preview_resp.text.splitlines():
+                line = unescape(line).strip()
+                if (match_obj := self
+                        .link_extractor.search(line, IGNORECASE)) is not None:
+                    console_print("Line with possible link: "
+                                  + PColor.INFO(line),
+                                  msg_verbose_level=VerboseLevel.DETAIL)
+                    dl_url = urlparse(match_obj.group(1)
+                                 .rsplit('#', 1)[0]  # rm fragment
+                                 .replace(r'\/', '/'),  # unescape \/
+                                 scheme='https')  # force scheme if missing
+                    # hotfix: deal with relative url
+                    if dl_url.netloc == '':
+                        dl_url = dl_url._replace(
+                            netloc=urlparse(mirror_link).netloc)
+                    dl_url = urlunparse(dl_url)
+                    console_print("Link found: " + PColor.PATH(dl_url),
+                                  msg_verbose_level=VerboseLevel.VERBOSE)
+                    possible_link.append(dl_url)
         if len(possible_link) == 0:
             info_print(PColor.ERROR("ERROR:"), end=" ")
             info_print("No download link found. "
                        "File not available, or response format not understood")
+            link_cache.put(*link_key, None)
             return None
         elif len(possible_link) > 1:
             info_print(PColor.WARNING("WARNING: "), end=" ")
@@ -208,24 +412,34 @@ class DOIRepoHandler(_BaseRepoHandler):
                 info_print(PColor.PATH(link))
             info_print("Using only the first link")
             possible_link = possible_link[:1]
+        link_cache.put(*link_key, possible_link[0])
         return possible_link[0]
 
     # TODO simplify alt methods?
 
-    def alt_extract_metadata_jstor(self) -> Union[bool, dict, None]:
+    def jstor_ris_response_steps(self) -> RequestSteps:
         """
-        Alternative method to get metadata from JSTOR.
-        Also set self.metadata_response
+        Request steps giving the RIS citation record from JSTOR
 
-        :return: bool (False), None or dict.
-            Same as self.extract_metadata
+        :return: RequestSteps, returning requests.Response
         """
         query_url = 'https://www.jstor.org/citation/ris/{id}'.format(
             id=self.identifier)
         console_print(f"Fetching from {PColor.PATH(query_url)}",
                       msg_verbose_level=VerboseLevel.INFO)
-        jstor_resp = rq.get(query_url, **cliArg['rqKwargs'])
-        self.metadata_response = jstor_resp
+        return (yield HttpRequest.get(query_url))
+
+    @staticmethod
+    def extract_jstor_ris_metadata(
+            jstor_resp: rq.Response) -> Union[bool, dict, None]:
+        """
+        Get metadata from the RIS citation record from JSTOR
+
+        :param jstor_resp: requests.Response
+            The response from self.jstor_ris_response_steps
+        :return: bool (False), None or dict.
+            Same as self.extract_metadata
+        """
         if jstor_resp.status_code == 200 \
                 and jstor_resp.headers['Content-Type'].lower() \
                 .startswith('application/x-research-info-systems'):
@@ -259,18 +473,27 @@ class DOIRepoHandler(_BaseRepoHandler):
                        "Maybe JSTOR blocked the requests?")
             return False
 
-    def alt_extract_metadata_aims(self) -> Union[bool, dict, None]:
+    def alt_metadata_jstor_steps(self) -> RequestSteps:
+        """
+        Alternative method to get metadata from JSTOR.
+
+        :return: RequestSteps, returning bool (False), None or dict.
+            Same as self.extract_metadata
+        """
+        jstor_resp = yield from self.jstor_ris_response_steps()
+        return self.extract_jstor_ris_metadata(jstor_resp)
+
+    def alt_metadata_aims_steps(self) -> RequestSteps:
         """
         Alternative method to get metadata from AIMS.
-        Also set self.metadata_response
 
-        :return: bool (False), None or dict.
+        :return: RequestSteps, returning bool (False), None or dict.
             Same as self.extract_metadata
         """
         query_url = 'https://www.aimsciences.org/article/doi/{id}'.format(
             id=self.identifier)
         info_print(f"Fetching from {PColor.PATH(query_url)}")
-        aims_resp = rq.get(query_url, **cliArg['rqKwargs'])
+        aims_resp = yield HttpRequest.get(query_url)
         # TODO check valid
         aims_internal_id = None
         for line in aims_resp.text.splitlines():
@@ -283,13 +506,11 @@ class DOIRepoHandler(_BaseRepoHandler):
             return False
         console_print(f"AIMS ID: {aims_internal_id}",
                       msg_verbose_level=VerboseLevel.VERBOSE)
-        xml_resp = rq.get(
+        xml_resp = yield HttpRequest.get(
             'https://www.aimsciences.org/article/'
             'exportXML?ids={id}&downType=XML'.format(
-                id=aims_internal_id),
-            **cliArg['rqKwargs']
+                id=aims_internal_id)
         )
-        self.metadata_response = xml_resp
         # TODO check valid
         xml_root = eTree.fromstring(
             self.aims_xml_sanitizer.sub(
@@ -310,19 +531,18 @@ class DOIRepoHandler(_BaseRepoHandler):
                        else pDate.text.strip()[:4])
         }
 
-    def alt_extract_metadata_royalsocpub(self) -> Union[bool, dict, None]:
+    def alt_metadata_royalsocpub_steps(self) -> RequestSteps:
         """
         Alternative method to get metadata from Royal Society Publishing.
-        Also set self.metadata_response
 
-        :return: bool (False), None or dict.
+        :return: RequestSteps, returning bool (False), None or dict.
             Same as self.extract_metadata
         """
         query_url = 'https://royalsocietypublishing.org/doi/{id}'.format(
             id=self.identifier)
         console_print(f"Fetching from {PColor.PATH(query_url)}",
                       msg_verbose_level=VerboseLevel.INFO)
-        royal_resp = rq.get(query_url, **cliArg['rqKwargs'])
+        royal_resp = yield HttpRequest.get(query_url)
         # PaRsInG HtMl wItH rEgEx !!!1!11!!!
         # TODO need better method
         article_title = (
@@ -357,12 +577,11 @@ class DOIRepoHandler(_BaseRepoHandler):
             # even webpage record is incomplete
             return None
 
-    def alt_extract_metadata_springer(self) -> Union[bool, dict, None]:
+    def alt_metadata_springer_steps(self) -> RequestSteps:
         """
         Alternative method to get metadata from Springer.
-        Also set self.metadata_response
 
-        :return: bool (False), None or dict.
+        :return: RequestSteps, returning bool (False), None or dict.
             Same as self.extract_metadata
         """
         query_url = ('https://citation-needed.springer.com/v2/'
@@ -370,8 +589,7 @@ class DOIRepoHandler(_BaseRepoHandler):
             id=self.identifier)
         console_print(f"Fetching from {PColor.PATH(query_url)}",
                       msg_verbose_level=VerboseLevel.INFO)
-        springer_resp = rq.get(query_url, **cliArg['rqKwargs'])
-        self.metadata_response = springer_resp
+        springer_resp = yield HttpRequest.get(query_url)
         if springer_resp.status_code == 200 \
                 and springer_resp.headers['Content-Type'].lower() \
                 .startswith('application/x-research-info-systems'):
@@ -405,30 +623,76 @@ class DOIRepoHandler(_BaseRepoHandler):
                        "Maybe Springer blocked the requests?")
             return False
 
-    def alt_extract_metadata(self) -> Union[bool, dict, None]:
+    def _get_known_host(self) -> Optional[str]:
+        # the document host of the DOI prefix, if known without a request
+        doi_prefix = self.identifier.split('/', 1)[0]
+        return (self.doi_prefix_host_dict.get(doi_prefix)
+                or doi_host_cache.get(doi_prefix))
+
+    def doc_host_steps(self, known_host_set: Set[str]) -> RequestSteps:
+        """
+        Request steps giving the host of the document landing page
+
+        Only the redirects from doi.org are followed, with HEAD requests,
+        so that no page is downloaded.
+        Stops early at a host in known_host_set
+
+        :param known_host_set: set[str].
+            Hosts to stop at
+        :return: RequestSteps, returning str.
+            The host of the last URL redirected to
+        """
+        host_query_url = 'https://doi.org/{id}'.format(id=self.identifier)
+        with self._trace_span('althost', host_query_url) as host_span:
+            for _ in range(self.max_host_redirect_count):
+                host_resp = yield HttpRequest.head(host_query_url,
+                                                   allow_redirects=False)
+                host_span.set_response(host_resp)
+                if not host_resp.is_redirect:
+                    break
+                host_query_url = urljoin(host_query_url,
+                                         host_resp.headers['Location'])
+                if urlparse(host_query_url).netloc in known_host_set:
+                    break
+        return urlparse(host_query_url).netloc
+
+    def alt_metadata_steps(self) -> RequestSteps:
         """
         Alternative method to get metadata.
 
-        :return: bool (False), None or dict.
+        :return: RequestSteps, returning bool (False), None or dict.
             Same as self.extract_metadata
         """
-        # get doc host
-        self_host = urlparse(rq.get('https://doi.org/{id}'
-                                    .format(id=self.identifier),
-                                    **cliArg['rqKwargs']).url).netloc
-        console_print(f"Document host: {self_host}",
-                      msg_verbose_level=VerboseLevel.VERBOSE)
-        metadata_getter_func = {
-            'www.jstor.org':       self.alt_extract_metadata_jstor,
-            'www.aimsciences.org': self.alt_extract_metadata_aims,
-            'royalsocietypublishing.org':
-                                   self.alt_extract_metadata_royalsocpub,
-            'link.springer.com':   self.alt_extract_metadata_springer,
-        }.get(self_host, None)
-        if metadata_getter_func is None:
+        # the sources not listed in --metapriority are not used
+        metadata_steps_func_dict = {
+            self.alt_metadata_source_dict[source_name]:
+                getattr(self, f'alt_metadata_{source_name}_steps')
+            for source_name in cliArg['metapriority']
+            if source_name in self.alt_metadata_source_dict
+        }
+        # get doc host, from its DOI prefix if known
+        doi_prefix = self.identifier.split('/', 1)[0]
+        if (self_host := self._get_known_host()) is not None:
+            console_print(f"Document host of DOI prefix {doi_prefix}: "
+                          f"{self_host}",
+                          msg_verbose_level=VerboseLevel.VERBOSE)
+        else:
+            known_host_set = set(self.alt_metadata_source_dict.values())
+            self_host = yield from self.doc_host_steps(known_host_set)
+            console_print(f"Document host: {self_host}",
+                          msg_verbose_level=VerboseLevel.VERBOSE)
+            if self_host in known_host_set:
+                doi_host_cache.put(doi_prefix, self_host)
+        metadata_steps_func = metadata_steps_func_dict.get(self_host, None)
+        if metadata_steps_func is None \
+                and self_host in self.alt_metadata_source_dict.values():
+            info_print(f"Metadata source of {self_host} "
+                       "is not in metapriority")
+            return None
+        elif metadata_steps_func is None:
             info_print(PColor.ERROR("ERROR:"), end=" ")
             info_print(f"{self_host} is not a recognized host. "
                        "Please report this on repo page")
             return False
         else:
-            return metadata_getter_func()
+            return (yield from metadata_steps_func())
@@ -1,7 +1,10 @@
 from re import match as re_match
 from re import IGNORECASE
+import requests as rq
 
 from ..CommonUtil import *
+from ..HttpSession import HttpRequest
+from ._BaseRepoHandler import _BaseRepoHandler
 from .DOIRepoHandler import DOIRepoHandler
 
 
@@ -9,7 +12,15 @@ class IEEERepoHandler(DOIRepoHandler):
     repo_name = "IEEE"
     query_extract_pattern \
         = r'^(https?://ieeexplore\.)?ieee(\.org/document/|:|/)?\s*(\d+)$'
-    mirror_list = cliArg['mirror']
+    mirror_list = CliArgView('mirror')
+
+    # no alternative metadata sources as for DOI
+    extract_metadata_steps = _BaseRepoHandler.extract_metadata_steps
+    fetch_metadata_steps = _BaseRepoHandler.fetch_metadata_steps
+    # no batched metadata requests as for DOI
+    batch_metadata_request = _BaseRepoHandler.batch_metadata_request
+    # the mirror is queried with the DOI in the citation record
+    is_metadata_response_for_download = True
 
     @classmethod
     def get_identifier(cls, raw_query_str):
@@ -24,19 +35,20 @@ class IEEERepoHandler(DOIRepoHandler):
                           msg_verbose_level=VerboseLevel.VERBOSE)
             return None
 
-    def get_metadata_response(self):
+    def metadata_response_steps(self):
         console_print(f"{PColor.INFO('Fetching metadata')} "
                       f"for type {PColor.INFO(self.repo_name)}...",
                       msg_verbose_level=VerboseLevel.VERBOSE)
-        return rq.get(
+        return (yield HttpRequest.get(
             'http://ieeexplore.ieee.org/rest/search/citation/format'
             '?recordIds={id}&download-format=download-ris'
             '&lite=true'.format(id=self.identifier),
             headers={
                 'Referer': 'https://ieeexplore.ieee.org/document/{id}'.format(
-                    id=self.identifier)},
-            proxies=cliArg['rqKwargs']['proxies']
-        )
+                    id=self.identifier),
+                # not using the configured user agent
+                'User-Agent': rq.utils.default_user_agent()}
+        ))
 
     @classmethod
     def _is_meta_query_response_valid(cls, response_obj):
@@ -71,17 +83,15 @@ class IEEERepoHandler(DOIRepoHandler):
             # even citation record is incomplete
             return None
 
-    def get_download_url(self, mirror_link, **kwargs):
-        assert self.metadata_response is not None
+    def download_url_steps(self, mirror_link, **kwargs):
         identifier_override = None
-        for line in self.metadata_response.json()['data'].splitlines():
+        metadata_response = yield from self.fetched_metadata_response_steps()
+        for line in metadata_response.json()['data'].splitlines():
             if line.startswith('DO  - '):
                 # doc has DOI
-                self.identifier = line[6:]
-                info_print(f"Document has DOI {self.identifier}. "
+                identifier_override = line[6:]
+                info_print(f"Document has DOI {identifier_override}. "
                            "Will use this for querying mirror")
-
-                identifier_override = self.identifier
                 break
         if identifier_override is None:
             identifier_override = (
@@ -91,7 +101,7 @@ class IEEERepoHandler(DOIRepoHandler):
 
         console_print("Calling JSTOR super get_download_url",
                       msg_verbose_level=VerboseLevel.DEBUG)
-        return super(IEEERepoHandler, self).get_download_url(
+        return (yield from super(IEEERepoHandler, self).download_url_steps(
             mirror_link,
             # hacky
-            identifier_override=identifier_override)
+            identifier_override=identifier_override))
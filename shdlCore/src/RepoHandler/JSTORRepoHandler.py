@@ -2,6 +2,7 @@ from re import match as re_match
 from re import IGNORECASE
 
 from ..CommonUtil import *
+from ._BaseRepoHandler import _BaseRepoHandler
 from .DOIRepoHandler import DOIRepoHandler
 
 
@@ -9,9 +10,16 @@ class JSTORRepoHandler(DOIRepoHandler):
     repo_name = "JSTOR"
     query_extract_pattern \
         = r'^(https?://)?(www\.)?jstor(\.org/stable/|:)?\s*(.+)$'
-    mirror_list = cliArg['mirror']
+    mirror_list = CliArgView('mirror')
 
-    extract_metadata = DOIRepoHandler.alt_extract_metadata_jstor
+    metadata_response_steps = DOIRepoHandler.jstor_ris_response_steps
+    # no alternative metadata sources as for DOI
+    extract_metadata_steps = _BaseRepoHandler.extract_metadata_steps
+    fetch_metadata_steps = _BaseRepoHandler.fetch_metadata_steps
+    # no batched metadata requests as for DOI
+    batch_metadata_request = _BaseRepoHandler.batch_metadata_request
+    # the mirror is queried with the DOI in the citation record
+    is_metadata_response_for_download = True
 
     @classmethod
     def get_identifier(cls, raw_query_str):
@@ -37,15 +45,13 @@ class JSTORRepoHandler(DOIRepoHandler):
             'application/x-research-info-systems'
         )
 
-    def get_metadata_response(self):
-        # metadata is fetch in self.extract_metadata
-        # TODO better resolution
-        return None
+    def extract_metadata(self):
+        return self.extract_jstor_ris_metadata(self.metadata_response)
 
-    def get_download_url(self, mirror_link, **kwargs):
-        assert self.metadata_response is not None
+    def download_url_steps(self, mirror_link, **kwargs):
         identifier_override = None
-        for line in self.metadata_response.text.splitlines():
+        metadata_response = yield from self.fetched_metadata_response_steps()
+        for line in metadata_response.text.splitlines():
             if line.startswith('DO  -'):
                 # doc has DOI
                 identifier_override = line[6:]
@@ -55,7 +61,7 @@ class JSTORRepoHandler(DOIRepoHandler):
                                   + self.identifier
         console_print("Calling JSTOR super get_download_url",
                       msg_verbose_level=VerboseLevel.DEBUG)
-        return super(JSTORRepoHandler, self).get_download_url(
+        return (yield from super(JSTORRepoHandler, self).download_url_steps(
             mirror_link,
             # hacky
-            identifier_override=identifier_override)
+            identifier_override=identifier_override))
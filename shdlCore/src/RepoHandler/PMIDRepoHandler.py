@@ -1,7 +1,10 @@
+import json
 from re import match as re_match
 from re import IGNORECASE
 
 from ..CommonUtil import *
+from ..HttpSession import HttpRequest
+from ._BaseRepoHandler import _BaseRepoHandler
 from .DOIRepoHandler import DOIRepoHandler
 
 
@@ -9,7 +12,11 @@ class PMIDRepoHandler(DOIRepoHandler):
     repo_name = "PMID"
     query_extract_pattern \
         = r'^(https?://)?((pubmed|www)\.ncbi\.nlm\.nih\.gov(/pubmed)?|pmid:?)\s*/?(\d+)/?$'
-    mirror_list = cliArg['mirror']
+    mirror_list = CliArgView('mirror')
+
+    # no alternative metadata sources as for DOI
+    extract_metadata_steps = _BaseRepoHandler.extract_metadata_steps
+    fetch_metadata_steps = _BaseRepoHandler.fetch_metadata_steps
 
     @classmethod
     def get_identifier(cls, raw_query_str):
@@ -24,16 +31,43 @@ class PMIDRepoHandler(DOIRepoHandler):
                           msg_verbose_level=VerboseLevel.VERBOSE)
             return None
 
-    def get_metadata_response(self):
+    def metadata_response_steps(self):
         console_print(f"{PColor.INFO('Fetching metadata')} "
                       f"for type {PColor.INFO(self.repo_name)}...",
                       msg_verbose_level=VerboseLevel.VERBOSE)
-        return rq.get(
+        return (yield HttpRequest.get(
+            'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?'
+            'db=pubmed&id={id}]&retmode=json'.format(id=self.identifier)
+        ))
+
+    @classmethod
+    def batch_metadata_request(cls, identifier_list):
+        return HttpRequest.get(
             'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esummary.fcgi?'
-            'db=pubmed&id={id}]&retmode=json'.format(id=self.identifier),
-            **cliArg['rqKwargs']
+            'db=pubmed&id={id}&retmode=json'.format(
+                id=','.join(identifier_list))
         )
 
+    @classmethod
+    def split_metadata_response(cls, response_obj, identifier_list):
+        if not cls._is_meta_query_response_valid(response_obj):
+            return dict()
+        try:
+            response_json = response_obj.json()
+            result_dict = response_json['result']
+        except (ValueError, KeyError, TypeError):
+            return dict()
+        # the same as the response of each identifier on its own
+        return {
+            identifier: cls._get_part_response(response_obj, json.dumps({
+                **response_json,
+                'result': {'uids':     [identifier],
+                           identifier: result_dict[identifier]},
+            }).encode('utf-8'))
+            for identifier in identifier_list
+            if identifier in result_dict
+        }
+
     @classmethod
     def _is_meta_query_response_valid(cls, response_obj):
         console_print("Return status code: " + str(response_obj.status_code),
@@ -67,15 +101,12 @@ class PMIDRepoHandler(DOIRepoHandler):
             # even citation record is incomplete
             return None
 
-    def get_download_url(self, mirror_link, **kwargs):
-        assert self.metadata_response is not None
+    def download_url_steps(self, mirror_link, **kwargs):
         console_print("Calling PMID super get_download_url",
                       msg_verbose_level=VerboseLevel.DEBUG)
-        return super(PMIDRepoHandler, self).get_download_url(
+        return (yield from super(PMIDRepoHandler, self).download_url_steps(
             mirror_link,
             # hacky
-            init_query_method_override=lambda u, **qkwargs: rq.post(
-                u,
-                data={'request': self.identifier},
-                **qkwargs)
-        )
+            query_request_override=lambda u:
+            HttpRequest.post(u, data={'request': self.identifier})
+        ))
@@ -1,7 +1,10 @@
 from re import match as re_match
 from re import IGNORECASE
+from typing import Tuple
 
 from ..CommonUtil import *
+from ..HttpSession import HttpRequest
+from ._BaseRepoHandler import _BaseRepoHandler
 from .DOIRepoHandler import DOIRepoHandler
 
 
@@ -10,9 +13,15 @@ class SciDirRepoHandler(DOIRepoHandler):
     query_extract_pattern \
         = r'^(https?://)?(www\.)?sci(ence)?dir(ect)?' \
           r'(\.com/science/article/|:|/)\s*((.+?/)?\s*.+)$'
-    mirror_list = cliArg['mirror']
+    mirror_list = CliArgView('mirror')
 
-    doc_type = None
+    # no alternative metadata sources as for DOI
+    extract_metadata_steps = _BaseRepoHandler.extract_metadata_steps
+    fetch_metadata_steps = _BaseRepoHandler.fetch_metadata_steps
+    # no batched metadata requests as for DOI
+    batch_metadata_request = _BaseRepoHandler.batch_metadata_request
+    # the mirror is queried with the DOI in the citation record
+    is_metadata_response_for_download = True
 
     @classmethod
     def get_identifier(cls, raw_query_str):
@@ -27,28 +36,40 @@ class SciDirRepoHandler(DOIRepoHandler):
                           msg_verbose_level=VerboseLevel.VERBOSE)
             return None
 
-    def get_metadata_response(self):
+    def _split_identifier(self) -> Tuple[str, str]:
+        # (identifier type, identifier of that type), e.g. ('pii', 'S00...')
+        # parsed on each use, self.identifier is left as given
+        splitted_id = self.identifier.split('/', 1)
+        if len(splitted_id) == 1:
+            return 'pii', self.identifier
+        return splitted_id[0], splitted_id[1]
+
+    @property
+    def doc_type(self) -> str:
+        return self._split_identifier()[0]
+
+    @property
+    def metadata_identifier(self) -> str:
+        return self._split_identifier()[1]
+
+    def metadata_response_steps(self):
         console_print(f"{PColor.INFO('Fetching metadata')} "
                       f"for type {PColor.INFO(self.repo_name)}...",
                       msg_verbose_level=VerboseLevel.VERBOSE)
-        splitted_id = self.identifier.split('/', 1)
-        if len(splitted_id) == 1:
+        if '/' not in self.identifier:
             info_print(PColor.WARNING("WARNING:"), end=" ")
             info_print("Cannot decide identifier type. "
                        "Assuming it is PII")
-            self.doc_type, self.identifier = 'pii', self.identifier
-        else:
-            self.doc_type, self.identifier = splitted_id
-        console_print(f"Discovered identifier type: {self.doc_type}",
+        doc_type, type_identifier = self._split_identifier()
+        console_print(f"Discovered identifier type: {doc_type}",
                       msg_verbose_level=VerboseLevel.VERBOSE)
-        return rq.get(
+        return (yield HttpRequest.get(
             'https://www.sciencedirect.com/sdfe/arp/cite?'
             '{type}={id}'
             '&format=application%2Fx-research-info-systems'
-            '&withabstract=false'.format(id=self.identifier,
-                                         type=self.doc_type),
-            **cliArg['rqKwargs']
-        )
+            '&withabstract=false'.format(id=type_identifier,
+                                         type=doc_type)
+        ))
 
     @classmethod
     def _is_meta_query_response_valid(cls, response_obj):
@@ -87,17 +108,16 @@ class SciDirRepoHandler(DOIRepoHandler):
             # even citation record is incomplete
             return None
 
-    def get_download_url(self, mirror_link, **kwargs):
-        assert self.metadata_response is not None
+    def download_url_steps(self, mirror_link, **kwargs):
         identifier_override = None
-        for line in self.metadata_response.text.splitlines():
+        metadata_response = yield from self.fetched_metadata_response_steps()
+        for line in metadata_response.text.splitlines():
             if line.startswith('DO  - '):
                 # doc has DOI
-                self.identifier = re_match(r'^DO {2}- .+?doi.+?/(.+)$',
-                                           line).group(1)
-                info_print(f"Document has DOI {self.identifier}. "
+                identifier_override = re_match(r'^DO {2}- .+?doi.+?/(.+)$',
+                                               line).group(1)
+                info_print(f"Document has DOI {identifier_override}. "
                            "Will use this for querying mirror")
-                identifier_override = self.identifier
                 break
             elif identifier_override is not None and line.startswith('UR  - '):
                 identifier_override = line[6:]
@@ -106,12 +126,11 @@ class SciDirRepoHandler(DOIRepoHandler):
             identifier_override = (
                     mirror_link
                     + 'https://www.sciencedirect.com/science/article/'
-                    + f'{self.doc_type}/'
-                    + self.identifier)
+                    + '{}/{}'.format(*self._split_identifier()))
 
         console_print("Calling SciDir super get_download_url",
                       msg_verbose_level=VerboseLevel.DEBUG)
-        return super(SciDirRepoHandler, self).get_download_url(
+        return (yield from super(SciDirRepoHandler, self).download_url_steps(
             mirror_link,
             # hacky
-            identifier_override=identifier_override)
+            identifier_override=identifier_override))
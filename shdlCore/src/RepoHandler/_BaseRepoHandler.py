@@ -1,41 +1,361 @@
+import asyncio
+import threading
 from abc import ABC, abstractmethod
 from requests import Response as rq_Response
 
-from typing import Optional, Tuple, Union
+from typing import ContextManager, Dict, Optional, Sequence, Tuple, Union
 
+from ..AsyncHttpSession import async_http_transport
 from ..CommonUtil import *
+from ..HttpSession import HttpRequest, RequestSteps, StepsRace, \
+    http_transport
+from ..LocalCache import metadata_cache
+from ..Tracing import TraceSpan, trace_span
 
 
 class _BaseRepoHandler(ABC):
     # properties
     identifier = None
     is_query_valid = None
-    metadata = None
-    metadata_response = None
-    is_meta_response_valid = None
+    # if download_url_steps reads the metadata response,
+    # which is then fetched once before finding links at any mirror
+    is_metadata_response_for_download = False
 
     # init
     def __init__(self, raw_query_str: Optional[str] = None):
         console_print("Initiating _Base",
                       msg_verbose_level=VerboseLevel.DETAIL)
+        # metadata is fetched on first use, possibly from several threads
+        self._metadata_lock = threading.RLock()
+        self._metadata_response = None
+        self._is_metadata_response_fetched = False
+        # fetching the metadata response in async_get_download_url,
+        # shared by the tasks of a mirror race
+        self._metadata_response_task = None
+        self._metadata = None
+        self._is_metadata_loaded = False
         if raw_query_str is None:
             return
         self.identifier = self.get_identifier(raw_query_str)
         self.is_query_valid = (self.identifier is not None)
         if not self.is_query_valid:
             return
-        console_print(PColor.INFO("Fetching metadata response"),
-                      msg_verbose_level=VerboseLevel.DEBUG)
-        self.metadata_response = self.get_metadata_response()
-        console_print("Extracting metadata",
-                      msg_verbose_level=VerboseLevel.DEBUG)
-        self.metadata = self.extract_metadata()
-        self.is_meta_response_valid = self.metadata is not False
-        if self.is_meta_response_valid:
-            self.metadata.update({
-                'id':   self.identifier,
+        self._cache_key = (self.repo_name, self.identifier)
+
+    @property
+    def metadata_response(self) -> Optional[rq_Response]:
+        """
+        The metadata response, fetched on first access
+
+        :return: requests.Response, or None.
+        """
+        with self._metadata_lock:
+            if not self._is_metadata_response_fetched:
+                http_transport.run_steps(
+                    self.fetched_metadata_response_steps())
+        return self._metadata_response
+
+    @metadata_response.setter
+    def metadata_response(self, response_obj: Optional[rq_Response]):
+        with self._metadata_lock:
+            self._metadata_response = response_obj
+            self._is_metadata_response_fetched = True
+
+    @property
+    def metadata(self) -> Union[bool, dict, None]:
+        """
+        The metadata, read from cache or fetched on first access
+
+        :return: bool (False), None or dict.
+            Same as self.extract_metadata,
+            with key 'id' and 'repo' added if it is a dict
+        """
+        with self._metadata_lock:
+            if not self._is_metadata_loaded:
+                self._metadata = http_transport.run_steps(
+                    self._load_metadata_steps())
+                self._is_metadata_loaded = True
+        return self._metadata
+
+    @property
+    def metadata_identifier(self) -> str:
+        """
+        The identifier put in the metadata (as 'id'), used in file names
+
+        :return: str.
+        """
+        return self.identifier
+
+    @property
+    def is_meta_response_valid(self) -> bool:
+        return self.metadata is not False
+
+    def _load_metadata_steps(self) -> RequestSteps:
+        metadata = metadata_cache.get(*self._cache_key)
+        if metadata is not None:
+            console_print(f"{PColor.INFO('Metadata found in cache')} "
+                          f"for type {PColor.INFO(self.repo_name)}",
+                          msg_verbose_level=VerboseLevel.VERBOSE)
+        else:
+            metadata = yield from self.fetch_metadata_steps()
+            if isinstance(metadata, dict):
+                metadata_cache.put(*self._cache_key, metadata)
+        if isinstance(metadata, dict):
+            metadata.update({
+                'id':   self.metadata_identifier,
                 'repo': self.repo_name
             })
+        return metadata
+
+    def fetched_metadata_response_steps(self) -> RequestSteps:
+        """
+        Request steps giving self.metadata_response,
+        fetching it only if not yet fetched
+
+        :return: RequestSteps, returning requests.Response or None.
+        """
+        if not self._is_metadata_response_fetched:
+            console_print(PColor.INFO("Fetching metadata response"),
+                          msg_verbose_level=VerboseLevel.DEBUG)
+            self.metadata_response \
+                = yield from self._traced_metadata_response_steps()
+        return self._metadata_response
+
+    def _traced_metadata_response_steps(self) -> RequestSteps:
+        # self.metadata_response_steps, traced as the metadata stage
+        with self._trace_span('metadata') as metadata_span:
+            response_obj = yield from self.metadata_response_steps()
+            if response_obj is not None:
+                metadata_span.set_response(response_obj)
+        return response_obj
+
+    def fetch_metadata_steps(self) -> RequestSteps:
+        """
+        Request steps fetching self.metadata_response if not yet fetched,
+        and extracting the metadata
+
+        Override this if metadata can be fetched
+        from several sources at the same time
+
+        :return: RequestSteps, returning the same as self.extract_metadata
+        """
+        # make sure response is fetched before extracting
+        yield from self.fetched_metadata_response_steps()
+        console_print("Extracting metadata",
+                      msg_verbose_level=VerboseLevel.DEBUG)
+        return (yield from self.extract_metadata_steps())
+
+    def race_download_url_steps(self,
+                                mirror_list: Sequence[str]) -> RequestSteps:
+        """
+        Request steps querying all mirrors at the same time
+
+        The first link found wins, unless a mirror earlier in mirror_list
+        also gives a link within --racewindow, see StepsRace
+
+        :param mirror_list: Sequence[str].
+            The URLs of the mirrors, in order of preference
+        :return: RequestSteps, returning str or None.
+            Same as self.get_download_url
+        """
+        result_dict = yield StepsRace(
+            tuple(self.download_url_steps(mirror_link)
+                  for mirror_link in mirror_list),
+            is_accepted=lambda dl_url: dl_url is not None,
+            window=cliArg['racewindow'] / 1000)
+        if len(found_index_list := sorted(
+                mirror_idx
+                for mirror_idx, dl_url in result_dict.items()
+                if dl_url is not None)) == 0:
+            return None
+        info_print("Using link from mirror "
+                   + PColor.PATH(mirror_list[found_index_list[0]]))
+        return result_dict[found_index_list[0]]
+
+    def _trace_span(self,
+                    stage: str,
+                    url: Optional[str] = None) -> ContextManager[TraceSpan]:
+        # a span of fetching this document, see trace_span
+        return trace_span(stage,
+                          repo=self.repo_name,
+                          identifier=self.identifier,
+                          url=url)
+
+    def extract_metadata_steps(self) -> RequestSteps:
+        """
+        Request steps giving the result of self.extract_metadata
+
+        Override this if extracting metadata needs more requests
+
+        :return: RequestSteps, returning the same as self.extract_metadata
+        """
+        yield from ()
+        return self.extract_metadata()
+
+    # batched metadata, see MetadataBatcher
+    @classmethod
+    def batch_metadata_request(cls, identifier_list: Sequence[str]) \
+            -> Optional[HttpRequest]:
+        """
+        Get the request for the metadata of many identifiers at once
+
+        Override this, along with split_metadata_response,
+        if the repo can answer many identifiers in one request
+
+        :param identifier_list: Sequence[str].
+            The sanitized identifiers, without duplicates
+        :return: HttpRequest, or None if not supported
+        """
+        return None
+
+    @classmethod
+    def split_metadata_response(cls,
+                                response_obj: rq_Response,
+                                identifier_list: Sequence[str]) \
+            -> Dict[str, rq_Response]:
+        """
+        Split the response of batch_metadata_request
+        into the metadata response of each identifier
+
+        :param response_obj: requests.Response.
+            The response of batch_metadata_request
+        :param identifier_list: Sequence[str].
+            The identifiers requested
+        :return: dict[str, requests.Response].
+            Maps identifiers to their metadata response,
+            in the same form as from metadata_response_steps.
+            Identifiers not found in the response are left out
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def _get_part_response(response_obj: rq_Response,
+                           content: bytes) -> rq_Response:
+        # a copy of the response with only part of its body
+        part_response = rq_Response()
+        part_response.status_code = response_obj.status_code
+        part_response.reason = response_obj.reason
+        part_response.headers = response_obj.headers.copy()
+        part_response.headers.pop('Content-Length', None)
+        part_response.url = response_obj.url
+        part_response.encoding = response_obj.encoding
+        part_response.elapsed = response_obj.elapsed
+        part_response.request = response_obj.request
+        part_response._content = content
+        part_response._content_consumed = True
+        return part_response
+
+    # blocking entry points
+    def get_metadata_response(self) -> rq_Response:
+        """
+        Fetch the metadata response
+
+        :return: requests.Response
+        """
+        return http_transport.run_steps(self.metadata_response_steps())
+
+    def get_download_url(self, mirror_link: str) -> Optional[str]:
+        """
+        Get file download link
+
+        Returns the direct download link to the file.
+        If unable to get the download link, returns None
+
+        :param mirror_link: str.
+            The URL of the mirror used to fetch the file
+        :return: str, or None.
+        """
+        self._prepare_download()
+        return http_transport.run_steps(self.download_url_steps(mirror_link))
+
+    def race_download_url(self, mirror_list: Sequence[str]) -> Optional[str]:
+        """
+        Get file download link, querying all mirrors at the same time
+
+        :param mirror_list: Sequence[str].
+            The URLs of the mirrors, in order of preference
+        :return: str, or None.
+            Same as self.get_download_url
+        """
+        self._prepare_download()
+        return http_transport.run_steps(
+            self.race_download_url_steps(mirror_list))
+
+    def _prepare_download(self) -> None:
+        if self.is_metadata_response_for_download:
+            # fetched once under the lock, not by each mirror of a race
+            _ = self.metadata_response
+
+    # async entry points
+    async def async_get_metadata_response(self) -> rq_Response:
+        """
+        Async version of get_metadata_response
+        """
+        return await async_http_transport.run_steps(
+            self.metadata_response_steps())
+
+    async def async_get_metadata(self) -> Union[bool, dict, None]:
+        """
+        Async version of self.metadata
+
+        :return: bool (False), None or dict.
+            Same as self.metadata
+        """
+        if not self._is_metadata_loaded:
+            # not locked across awaits, concurrent calls may fetch twice
+            metadata = await async_http_transport.run_steps(
+                self._load_metadata_steps())
+            with self._metadata_lock:
+                if not self._is_metadata_loaded:
+                    self._metadata = metadata
+                    self._is_metadata_loaded = True
+        return self._metadata
+
+    async def async_get_download_url(self, mirror_link: str) -> Optional[str]:
+        """
+        Async version of get_download_url
+        """
+        await self._async_prepare_download()
+        return await async_http_transport.run_steps(
+            self.download_url_steps(mirror_link))
+
+    async def async_race_download_url(self,
+                                      mirror_list: Sequence[str]) \
+            -> Optional[str]:
+        """
+        Async version of race_download_url
+        """
+        await self._async_prepare_download()
+        return await async_http_transport.run_steps(
+            self.race_download_url_steps(mirror_list))
+
+    async def _async_prepare_download(self) -> None:
+        if self.is_metadata_response_for_download:
+            await self._async_fetch_metadata_response()
+
+    async def _async_fetch_metadata_response(self) -> None:
+        # fetch self.metadata_response in one task,
+        # awaited by every caller until it is done
+        with self._metadata_lock:
+            if self._is_metadata_response_fetched:
+                return
+            if self._metadata_response_task is None:
+                self._metadata_response_task = asyncio.ensure_future(
+                    async_http_transport.run_steps(
+                        self._traced_metadata_response_steps()))
+            fetch_task = self._metadata_response_task
+        try:
+            # a cancelled caller (e.g. a race loser) leaves it running
+            response_obj = await asyncio.shield(fetch_task)
+        except Exception:
+            with self._metadata_lock:
+                if self._metadata_response_task is fetch_task:
+                    # tried again by the next caller
+                    self._metadata_response_task = None
+            raise
+        with self._metadata_lock:
+            if not self._is_metadata_response_fetched:
+                self.metadata_response = response_obj
 
     # abstract properties
     @classmethod
@@ -96,9 +416,11 @@ class _BaseRepoHandler(ABC):
 
     # abstract methods
     @abstractmethod
-    def get_metadata_response(self) -> rq_Response:
+    def metadata_response_steps(self) -> RequestSteps:
         """
-        Get the metadata response and set it to self.metadata_response
+        Request steps giving the metadata response
+
+        :return: RequestSteps, returning requests.Response
         """
         raise NotImplementedError
 
@@ -121,15 +443,13 @@ class _BaseRepoHandler(ABC):
         raise NotImplementedError
 
     @abstractmethod
-    def get_download_url(self, mirror_link: str) -> Optional[str]:
+    def download_url_steps(self, mirror_link: str) -> RequestSteps:
         """
-        Get file download link
-
-        Returns the direct download link to the file.
-        If unable to get the download link, returns None
+        Request steps giving the file download link
 
         :param mirror_link: str.
             The URL of the mirror used to fetch the file
-        :return: str, or None.
+        :return: RequestSteps, returning str or None.
+            Same as self.get_download_url
         """
         raise NotImplementedError
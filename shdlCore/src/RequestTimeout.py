@@ -0,0 +1,152 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import Enum, unique
+from typing import Iterator, Optional, Tuple, Union
+
+from .CommonUtil import *
+
+
+@unique
+class RequestKind(Enum):
+    """
+    The kind of a request, deciding its read timeout
+
+    Values are the keys in cliArg of the read timeouts, in seconds.
+    Given as the timeout of a request to the transports,
+    and replaced by (connect timeout, read timeout) when sent
+    """
+    METADATA = 'metatimeout'
+    PROBE = 'probetimeout'
+    QUERY = 'querytimeout'
+    # the longest wait for more data while downloading a file
+    DOWNLOAD = 'stalltimeout'
+
+
+_current_deadline = ContextVar('shdl_deadline', default=None)
+
+
+class Deadline:
+    """
+    Time budget for fetching a document
+
+    Only time spent working on the document
+    (within applied, including in the threads started there) is counted,
+    so that a document waiting for a free worker in batch mode
+    does not use up its budget.
+    Requests check the budget of the current context
+    and have their timeouts cut to what is left
+    """
+
+    def __init__(self, seconds: Optional[float]):
+        """
+        :param seconds: float, or None.
+            The time budget. None means unlimited
+        """
+        self.seconds = seconds
+        self._spent = 0.0
+        # time when the current application started, None if not applied
+        self._applied_since: Optional[float] = None
+
+    @classmethod
+    def for_document(cls) -> 'Deadline':
+        """
+        Create a deadline with the budget in cliArg['deadline']
+
+        :return: Deadline
+        """
+        return cls(cliArg['deadline'] if cliArg['deadline'] != 0 else None)
+
+    @staticmethod
+    def current() -> Optional['Deadline']:
+        """
+        Get the deadline applied in the current context
+
+        :return: Deadline, or None if there is none
+        """
+        return _current_deadline.get()
+
+    def remaining(self) -> Optional[float]:
+        """
+        Get the time left
+
+        :return: float, or None.
+            Seconds left (negative if passed), or None if unlimited
+        """
+        if self.seconds is None:
+            return None
+        spent = self._spent
+        if self._applied_since is not None:
+            spent += time.monotonic() - self._applied_since
+        return self.seconds - spent
+
+    def check(self) -> None:
+        """
+        :raise ShdlError: if the deadline has passed
+        """
+        if (remaining := self.remaining()) is not None and remaining <= 0:
+            raise ShdlError(ErrorType.NETWORK_ERROR,
+                            error_msg="Not done within the deadline "
+                                      f"of {self.seconds} seconds")
+
+    @contextmanager
+    def applied(self) -> Iterator['Deadline']:
+        """
+        Make this the deadline of the current context, and count the time
+
+        :return: Iterator[Deadline].
+            Yields self
+        """
+        token = _current_deadline.set(self)
+        self._applied_since = time.monotonic()
+        try:
+            yield self
+        finally:
+            self._spent += time.monotonic() - self._applied_since
+            self._applied_since = None
+            _current_deadline.reset(token)
+
+
+def check_deadline() -> None:
+    """
+    Check the deadline of the current context, if any
+
+    :raise ShdlError: if the deadline has passed
+    """
+    if (deadline := Deadline.current()) is not None:
+        deadline.check()
+
+
+def get_remaining_time() -> Optional[float]:
+    """
+    Get the time left before the deadline of the current context
+
+    :return: float, or None.
+        Seconds left, or None if unlimited
+    """
+    if (deadline := Deadline.current()) is None:
+        return None
+    return deadline.remaining()
+
+
+def get_request_timeout(
+        timeout: Union[RequestKind, float, Tuple[float, float]]) \
+        -> Tuple[float, float]:
+    """
+    Get the timeout of a request, cut to the time left before the deadline
+
+    :param timeout: RequestKind, float, or tuple[float, float].
+        The kind of the request,
+        or a timeout as in requests (seconds, or (connect, read))
+    :return: tuple[float, float].
+        (connect timeout, read timeout), in seconds
+    """
+    if isinstance(timeout, RequestKind):
+        timeout = (cliArg['connecttimeout'], cliArg[timeout.value])
+    elif not isinstance(timeout, tuple):
+        timeout = (timeout, timeout)
+    if (remaining := get_remaining_time()) is not None:
+        # must not be 0, which means no timeout in some clients
+        remaining = max(remaining, 0.001)
+        timeout = (min(timeout[0], remaining), min(timeout[1], remaining))
+    return timeout
@@ -0,0 +1,225 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+import requests as rq
+
+from .CommonUtil import *
+
+
+class HostUnavailableError(rq.exceptions.ConnectionError):
+    """
+    Raised instead of sending a request
+    to a host whose circuit breaker is open
+
+    A ConnectionError, so that it is handled as the host being offline
+    """
+
+
+class _BreakerState:
+    __slots__ = ('consecutive_failures', 'opened_at')
+
+    def __init__(self):
+        self.consecutive_failures = 0
+        # None if closed
+        self.opened_at: Optional[float] = None
+
+
+class RetryPolicy:
+    """
+    Decide when failed requests are retried,
+    and stop sending requests to hosts that keep failing
+
+    Connection errors, timeouts and
+    HTTP 408, 429, 500, 502, 503, 504 are retried
+    up to cliArg['retries'] times,
+    after an exponential backoff with full jitter
+    (starting from cliArg['backoff'] milliseconds),
+    or after the time given in the Retry-After header.
+
+    Each host has a circuit breaker.
+    After cliArg['breaker'] consecutive failures, it opens,
+    and requests to the host fail at once with HostUnavailableError.
+    After cliArg['breakercooldown'] seconds,
+    it lets a single request through (half-open):
+    the breaker closes if it succeeds,
+    and stays open for another cooldown otherwise.
+    Breakers are shared by all library calls in the process
+    """
+
+    retryable_status_code_set = frozenset((408, 429, 500, 502, 503, 504))
+    # the host is up, but turns requests away for now
+    busy_status_code_set = frozenset((429, 503))
+    # seconds, upper bound of backoff
+    max_backoff = 30
+    # seconds, do not retry if asked to wait longer than this
+    max_retry_after = 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breaker_dict: Dict[str, _BreakerState] = dict()
+
+    @staticmethod
+    def is_retryable_error(error: Exception) -> bool:
+        """
+        Check if a request that raised error may succeed if sent again
+
+        :param error: Exception.
+            The exception raised
+        :return: bool
+        """
+        return isinstance(error, (rq.exceptions.ConnectionError,
+                                  rq.exceptions.Timeout,
+                                  rq.exceptions.ChunkedEncodingError)) \
+            and not isinstance(error, (rq.exceptions.SSLError,
+                                       HostUnavailableError))
+
+    def is_retryable_status(self, status_code: int) -> bool:
+        """
+        Check if a response with status_code is a temporary failure
+
+        :param status_code: int.
+            The HTTP status code
+        :return: bool
+        """
+        return status_code in self.retryable_status_code_set
+
+    def is_busy_status(self, status_code: int) -> bool:
+        """
+        Check if a response with status_code means the host is up but busy,
+        e.g. rate limiting
+
+        :param status_code: int.
+            The HTTP status code
+        :return: bool
+        """
+        return status_code in self.busy_status_code_set
+
+    @staticmethod
+    def _parse_retry_after(retry_after: str) -> Optional[float]:
+        # either seconds or an HTTP date
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp()
+                       - time.time())
+        except (TypeError, ValueError, IndexError):
+            return None
+
+    def get_backoff(self, attempt: int) -> float:
+        """
+        Get the time to wait before sending a request again
+
+        :param attempt: int.
+            The number of failed attempts before this one, starting from 0
+        :return: float.
+            Seconds to wait
+        """
+        return random.uniform(
+            0, min(self.max_backoff,
+                   cliArg['backoff'] / 1000 * 2 ** attempt))
+
+    def get_retry_delay(self,
+                        host: str,
+                        attempt: int,
+                        error: Optional[Exception] = None,
+                        status_code: Optional[int] = None,
+                        retry_after: Optional[str] = None) -> Optional[float]:
+        """
+        Record the outcome of a request to host, and decide if it is retried
+
+        Exactly one of error and status_code should be given
+
+        :param host: str.
+            The host name
+        :param attempt: int.
+            The number of failed attempts before this one, starting from 0
+        :param error: Exception, or None.
+            The exception raised, if the request failed
+        :param status_code: int, or None.
+            The HTTP status code, if a response is received
+        :param retry_after: str, or None.
+            The Retry-After header of the response
+        :return: float, or None.
+            Seconds to wait before retrying,
+            or None if the outcome should be used as it is
+        """
+        if error is not None:
+            if not self.is_retryable_error(error):
+                return None
+            self.record_failure(host)
+        elif not self.is_retryable_status(status_code):
+            self.record_success(host)
+            return None
+        elif status_code != 429:
+            # too many requests: the host is up, just busy
+            self.record_failure(host)
+        if attempt >= cliArg['retries']:
+            return None
+        if retry_after is not None \
+                and (delay := self._parse_retry_after(retry_after)) \
+                is not None:
+            return delay if delay <= self.max_retry_after else None
+        return self.get_backoff(attempt)
+
+    def check_host(self, host: str) -> None:
+        """
+        Check if requests can be sent to host
+
+        :param host: str.
+            The host name
+        :raise HostUnavailableError: if the circuit breaker of host is open
+        """
+        with self._lock:
+            if (state := self._breaker_dict.get(host)) is None \
+                    or state.opened_at is None:
+                return
+            now = time.monotonic()
+            if now - state.opened_at >= cliArg['breakercooldown']:
+                # half-open: let this request through,
+                # others wait for another cooldown
+                state.opened_at = now
+                return
+            failure_count = state.consecutive_failures
+        raise HostUnavailableError(f"{host} failed {failure_count} times "
+                                   "in a row. Skipped for now")
+
+    def record_failure(self, host: str) -> None:
+        """
+        Record a failed request to host
+
+        :param host: str.
+            The host name
+        """
+        with self._lock:
+            state = self._breaker_dict.setdefault(host, _BreakerState())
+            state.consecutive_failures += 1
+            if cliArg['breaker'] == 0 \
+                    or state.consecutive_failures < cliArg['breaker']:
+                return
+            is_opening = state.opened_at is None
+            state.opened_at = time.monotonic()
+        if is_opening:
+            info_print(PColor.WARNING("WARNING:")
+                       + f" {host} keeps failing. "
+                         "Requests to it are paused "
+                         f"for {cliArg['breakercooldown']} seconds")
+
+    def record_success(self, host: str) -> None:
+        """
+        Record a successful request to host
+
+        :param host: str.
+            The host name
+        """
+        with self._lock:
+            if (state := self._breaker_dict.get(host)) is not None:
+                state.consecutive_failures = 0
+                state.opened_at = None
+
+
+retry_policy = RetryPolicy()
@@ -0,0 +1,251 @@
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, TextIO, Union
+
+from .CommonUtil import *
+
+
+class TraceSpan:
+    """
+    The timing of a stage of fetching a document, see trace_span
+
+    Attributes other than stage are None if not known
+    """
+
+    __slots__ = ('stage', 'repo', 'identifier', 'host', 'status', 'bytes',
+                 'error', 'start', 'duration')
+
+    def __init__(self,
+                 stage: str,
+                 repo: Optional[str] = None,
+                 identifier: Optional[str] = None,
+                 host: Optional[str] = None):
+        self.stage = stage
+        self.repo = repo
+        self.identifier = identifier
+        self.host = host
+        # HTTP status code of the response, if any
+        self.status: Optional[int] = None
+        # bytes received
+        self.bytes: Optional[int] = None
+        # the exception raised, if the stage failed
+        self.error: Optional[str] = None
+        # unix time
+        self.start = time.time()
+        # seconds
+        self.duration: Optional[float] = None
+
+    def set_response(self, response) -> None:
+        """
+        Record the status, size and host of a response read in full
+
+        :param response: requests.Response.
+            The response
+        """
+        self.status = response.status_code
+        self.bytes = len(response.content)
+        if self.host is None:
+            self.host = urlparse(response.url).hostname
+
+    def as_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+def _get_percentile(sorted_list: List[float], percentile: float) -> float:
+    # nearest-rank percentile
+    return sorted_list[max(0,
+                           math.ceil(percentile / 100 * len(sorted_list)) - 1)]
+
+
+class Tracer:
+    """
+    Write spans to a trace file as JSON lines,
+    and keep their durations for a summary
+
+    Spans are appended to the file as soon as they end,
+    so that a trace of an interrupted batch is still usable
+    """
+
+    summary_percentile_tuple = (50, 95, 99)
+
+    def __init__(self, trace_path: Path):
+        """
+        :param trace_path: Path.
+            The trace file, appended to
+        :raise OSError: if the file cannot be opened
+        """
+        self.trace_path = trace_path
+        self._lock = threading.Lock()
+        self._trace_file: Optional[TextIO] = trace_path.open(
+            'a', encoding='utf-8')
+        self._stage_duration_dict: Dict[str, List[float]] = defaultdict(list)
+        self._host_duration_dict: Dict[str, List[float]] = defaultdict(list)
+
+    def record(self, span: TraceSpan) -> None:
+        """
+        Write a span that has ended
+
+        :param span: TraceSpan.
+            The span
+        """
+        span_line = json.dumps(span.as_dict())
+        with self._lock:
+            self._stage_duration_dict[span.stage].append(span.duration)
+            if span.host is not None:
+                self._host_duration_dict[span.host].append(span.duration)
+            if self._trace_file is not None:
+                self._trace_file.write(span_line + '\n')
+                self._trace_file.flush()
+
+    def summary(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        """
+        Get the percentiles of span durations
+
+        :return: dict[str, dict[str, dict[str, float]]].
+            Maps 'stage' and 'host' to dicts
+            mapping each stage (or host) to
+            {'count': ..., 'p50': ..., 'p95': ..., 'p99': ...},
+            durations in seconds
+        """
+        def get_percentile_dict(duration_list: List[float]) \
+                -> Dict[str, float]:
+            sorted_list = sorted(duration_list)
+            return {
+                'count': len(sorted_list),
+                **{f'p{percentile}': _get_percentile(sorted_list, percentile)
+                   for percentile in self.summary_percentile_tuple}
+            }
+
+        with self._lock:
+            return {
+                'stage': {stage: get_percentile_dict(duration_list)
+                          for stage, duration_list
+                          in self._stage_duration_dict.items()},
+                'host':  {host: get_percentile_dict(duration_list)
+                          for host, duration_list
+                          in sorted(self._host_duration_dict.items())},
+            }
+
+    def print_summary(self) -> None:
+        """
+        Print the percentiles of span durations by stage and by host
+        """
+        summary_dict = self.summary()
+        percentile_header = ''.join(f"{f'p{percentile}':>9}"
+                                    for percentile
+                                    in self.summary_percentile_tuple)
+        for group in ('stage', 'host'):
+            if len(summary_dict[group]) == 0:
+                continue
+            console_print(PColor.INFO(f"{'Time by ' + group:<32}")
+                          + f"{'count':>7}{percentile_header}")
+            for key, percentile_dict in summary_dict[group].items():
+                console_print(
+                    f"{PColor.PATH(f'{key:<32}')}"
+                    f"{percentile_dict['count']:>7}"
+                    + ''.join(f"{percentile_dict[f'p{percentile}']:>8.3f}s"
+                              for percentile
+                              in self.summary_percentile_tuple))
+        console_print(f"Trace written to {PColor.PATH(str(self.trace_path))}")
+
+    def close(self) -> None:
+        """
+        Close the trace file. Later spans are only kept for the summary
+        """
+        with self._lock:
+            if self._trace_file is not None:
+                self._trace_file.close()
+                self._trace_file = None
+
+
+# trace path -> tracer, shared by library calls with the same path
+_tracer_dict: Dict[Path, Tracer] = dict()
+_tracer_dict_lock = threading.Lock()
+
+
+def open_tracer(trace_path: Union[str, Path]) -> Tracer:
+    """
+    Get the tracer writing to trace_path, opening the file if needed
+
+    :param trace_path: str, or Path.
+        The trace file
+    :return: Tracer
+    :raise ShdlError: if the file cannot be opened
+    """
+    trace_path = Path(trace_path).expanduser().resolve()
+    with _tracer_dict_lock:
+        if (tracer := _tracer_dict.get(trace_path)) is None:
+            try:
+                tracer = _tracer_dict[trace_path] = Tracer(trace_path)
+            except OSError as e:
+                raise ShdlError(ErrorType.ARG_INVALID,
+                                error_msg="Cannot open trace file "
+                                          f"{trace_path}: {e.strerror}")
+        return tracer
+
+
+def get_tracer() -> Optional[Tracer]:
+    """
+    Get the tracer of cliArg['trace']
+
+    :return: Tracer, or None if not tracing
+    """
+    if cliArg['trace'] is None:
+        return None
+    # already resolved and opened in process_cli_arg
+    if (tracer := _tracer_dict.get(cliArg['trace'])) is not None:
+        return tracer
+    return open_tracer(cliArg['trace'])
+
+
+def close_tracers() -> None:
+    """
+    Close all trace files
+    """
+    with _tracer_dict_lock:
+        for tracer in _tracer_dict.values():
+            tracer.close()
+
+
+@contextmanager
+def trace_span(stage: str,
+               repo: Optional[str] = None,
+               identifier: Optional[str] = None,
+               url: Optional[str] = None) -> Iterator[TraceSpan]:
+    """
+    Time the code within the context as a stage of fetching a document
+
+    The span is written to the trace file when the context ends,
+    with the exception raised (if any) as its error.
+    Does nothing but time if not tracing.
+    Can be used across yields in request steps
+
+    :param stage: str.
+        The name of the stage, e.g. 'metadata'
+    :param repo: str, or None.
+        The name of the repo of the document
+    :param identifier: str, or None.
+        The identifier of the document
+    :param url: str, or None.
+        The URL requested, giving the host
+    :return: Iterator[TraceSpan].
+        Yields the span, so that its status and bytes can be set
+    """
+    span = TraceSpan(stage,
+                     repo=repo,
+                     identifier=identifier,
+                     host=None if url is None else urlparse(url).hostname)
+    start_time = time.monotonic()
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}".rstrip(': ')
+        raise
+    finally:
+        span.duration = time.monotonic() - start_time
+        if (tracer := get_tracer()) is not None:
+            tracer.record(span)
@@ -3,7 +3,19 @@ from re import split as re_split
 
 from shdlCore.src.CliArg import *
 from shdlCore.src.CommonUtil import *
+from shdlCore.src.RequestTimeout import *
+from shdlCore.src.HostScheduler import *
+from shdlCore.src.RetryPolicy import *
+from shdlCore.src.Hedging import *
+from shdlCore.src.Tracing import *
+from shdlCore.src.Profiling import *
+from shdlCore.src.HttpSession import *
+from shdlCore.src.AsyncHttpSession import *
+from shdlCore.src.Cassette import *
 from shdlCore.src.StringTransformer import *
 from shdlCore.src.LocalFileHandler import *
+from shdlCore.src.LocalCache import *
+from shdlCore.src.Pipeline import *
+from shdlCore.src.MetadataBatch import *
 
 from .RepoHandler import *
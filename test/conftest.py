@@ -0,0 +1,48 @@
+from contextlib import ExitStack
+from pathlib import Path
+
+import pytest
+
+from shdlCore import FetchOptions
+from shdlCore.src import Cassette, default_host_limit_dict, use_arg_dict
+
+cassette_dir = Path(__file__).parent / 'cassettes'
+
+
+@pytest.fixture
+def fetch_options(tmp_path):
+    # no config file, cache, host limits or retries,
+    # so that only the requests in the cassette are sent
+    return FetchOptions(mirror=['sci-hub.st'],
+                        dir=tmp_path,
+                        nocache=True,
+                        retries=0,
+                        hostlimit=[f'{host},0'
+                                   for host in default_host_limit_dict])
+
+
+@pytest.fixture
+def mirror_link(fetch_options):
+    # the mirror used when the cassettes were recorded
+    return fetch_options.arg_dict['mirror'][0]
+
+
+@pytest.fixture(autouse=True)
+def fetch_args(fetch_options):
+    # handlers read their arguments from cliArg
+    with use_arg_dict(fetch_options.arg_dict) as arg_dict:
+        yield arg_dict
+
+
+@pytest.fixture
+def replay():
+    """
+    Call with a name to answer requests from test/cassettes/<name>.json
+    for the rest of the test
+    """
+    with ExitStack() as exit_stack:
+        def replay_cassette(name: str) -> Cassette:
+            return exit_stack.enter_context(
+                Cassette.load(cassette_dir / f'{name}.json').replaying())
+
+        yield replay_cassette
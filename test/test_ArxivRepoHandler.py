@@ -0,0 +1,44 @@
+import pytest
+
+from shdlCore.src import ArxivRepoHandler
+
+
+@pytest.mark.parametrize('raw_identifier', [
+    'arxiv:1501.00001',
+    'arXiv: 1501.00001',
+    'https://arxiv.org/abs/1501.00001',
+    'arxiv.org/abs/1501.00001',
+])
+def test_identifier(raw_identifier):
+    handler = ArxivRepoHandler(raw_identifier)
+    assert handler.is_query_valid
+    assert handler.identifier == '1501.00001'
+
+
+def test_identifier_invalid():
+    assert not ArxivRepoHandler('doi:10.1109/5.771073').is_query_valid
+
+
+def test_metadata(replay):
+    replay('arxiv')
+    handler = ArxivRepoHandler('arxiv:1501.00001')
+    assert handler.metadata == {
+        'author': ({'given': 'Jane Q.', 'family': 'Doe'},
+                   {'given': 'Richard', 'family': 'Roe'}),
+        'title':  'Regularity of the free boundary in a two-phase problem',
+        'year':   '2015',
+        'id':     '1501.00001',
+        'repo':   'arXiv',
+    }
+
+
+def test_metadata_error(replay):
+    replay('arxiv')
+    assert ArxivRepoHandler('arxiv:1501.999999').metadata is False
+
+
+def test_download_url():
+    # no request is sent
+    handler = ArxivRepoHandler('arxiv:1501.00001')
+    assert handler.get_download_url(handler.mirror_list[0]) \
+           == 'https://arxiv.org/pdf/1501.00001.pdf'
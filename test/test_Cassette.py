@@ -0,0 +1,158 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import aiohttp
+import pytest
+import requests as rq
+
+from shdlCore import FetchOptions, async_fetch, fetch, fetch_many
+from shdlCore.src import Cassette, DOIRepoHandler, ErrorType, ShdlError, \
+    async_http_transport, default_host_limit_dict, http_transport
+
+
+def _get_fetch_options(tmp_path) -> FetchOptions:
+    return FetchOptions(mirror=['sci-hub.st'],
+                        dir=tmp_path,
+                        nocache=True,
+                        autoname=True,
+                        retries=0,
+                        hostlimit=[f'{host},0'
+                                   for host in default_host_limit_dict])
+
+
+async def _async_fetch_closing(identifier: str, options: FetchOptions):
+    try:
+        return await async_fetch(identifier, options)
+    finally:
+        await async_http_transport.close()
+
+
+def test_fetch(replay, tmp_path):
+    replay('doi')
+    result = fetch('https://doi.org/10.1109/5.771073',
+                   _get_fetch_options(tmp_path))
+    assert result.ok, result.message
+    assert result.path.parent == tmp_path
+    assert result.path.name == ('[N. Paskin, doi 10.1109@5.771073]'
+                                'Toward Unique Identifiers.pdf')
+    assert result.path.read_bytes().startswith(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3')
+
+
+def test_async_fetch(replay, tmp_path):
+    replay('doi')
+    result = asyncio.run(_async_fetch_closing(
+        'https://doi.org/10.1109/5.771073', _get_fetch_options(tmp_path)))
+    assert result.ok, result.message
+    assert result.path.name == ('[N. Paskin, doi 10.1109@5.771073]'
+                                'Toward Unique Identifiers.pdf')
+    # the same file as fetched by the blocking transport
+    sync_dir = tmp_path / 'sync'
+    sync_dir.mkdir()
+    assert result.path.read_bytes() \
+           == fetch('https://doi.org/10.1109/5.771073',
+                    _get_fetch_options(sync_dir)).path.read_bytes()
+
+
+class _TimeoutSession:
+    # every request times out, with either transport
+
+    def request(self, method: str, url: str, **kwargs):
+        raise rq.exceptions.ReadTimeout(f"{method} {url} timed out")
+
+    def get(self, url: str, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def close(self) -> None:
+        pass
+
+
+class _AsyncTimeoutSession:
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, **kwargs):
+        raise aiohttp.ServerTimeoutError(f"{method} {url} timed out")
+        yield
+
+
+def test_fetch_network_error(tmp_path):
+    with http_transport.use_session(_TimeoutSession()):
+        result = fetch('https://doi.org/10.1109/5.771073',
+                       _get_fetch_options(tmp_path))
+    assert result.status == ErrorType.NETWORK_ERROR
+    assert 'timed out' in result.message
+    with async_http_transport.use_session(_AsyncTimeoutSession()):
+        result = asyncio.run(_async_fetch_closing(
+            'https://doi.org/10.1109/5.771073',
+            _get_fetch_options(tmp_path)))
+    assert result.status == ErrorType.NETWORK_ERROR
+    assert 'timed out' in result.message
+
+
+def test_fetch_many_network_error(tmp_path):
+    # every document fails, but the batch goes on
+    identifier_list = ['https://doi.org/10.1109/5.771073',
+                       'https://doi.org/10.1006/jfan.1999.3500']
+    with http_transport.use_session(_TimeoutSession()):
+        result_list = list(fetch_many(identifier_list,
+                                      _get_fetch_options(tmp_path)))
+    assert sorted(result.identifier for result in result_list) \
+           == sorted(identifier_list)
+    assert all(result.status == ErrorType.NETWORK_ERROR
+               for result in result_list)
+
+
+def test_record(replay, tmp_path, mirror_link):
+    # record from the replayed responses
+    replay('doi')
+    cassette = Cassette(tmp_path / 'doi.json')
+    with cassette.recording():
+        handler = DOIRepoHandler('doi:10.1109/5.771073')
+        metadata = handler.metadata
+        download_url = handler.get_download_url(mirror_link)
+    request_list = [interaction['request']
+                    for interaction
+                    in json.loads(cassette.cassette_path.read_text())[
+                        'interactions']]
+    assert [request['url'] for request in request_list] \
+           == ['https://doi.org/10.1109/5.771073',
+               mirror_link,
+               mirror_link + '/10.1109/5.771073']
+    with Cassette.load(cassette.cassette_path).replaying():
+        handler = DOIRepoHandler('doi:10.1109/5.771073')
+        assert handler.metadata == metadata
+        assert handler.get_download_url(mirror_link) == download_url
+
+
+def test_async_record(replay, tmp_path, mirror_link):
+    replay('doi')
+    cassette = Cassette(tmp_path / 'doi.json')
+
+    async def fetch_download_url():
+        try:
+            return await DOIRepoHandler('doi:10.1109/5.771073') \
+                .async_get_download_url(mirror_link)
+        finally:
+            await async_http_transport.close()
+
+    with cassette.recording():
+        download_url = asyncio.run(fetch_download_url())
+    assert [interaction['request']['url']
+            for interaction
+            in json.loads(cassette.cassette_path.read_text())[
+                'interactions']] \
+           == [mirror_link, mirror_link + '/10.1109/5.771073']
+    # replayed by the blocking transport
+    with Cassette.load(cassette.cassette_path).replaying():
+        assert DOIRepoHandler('doi:10.1109/5.771073') \
+                   .get_download_url(mirror_link) == download_url
+
+
+def test_load_invalid(tmp_path):
+    cassette_path = tmp_path / 'invalid.json'
+    cassette_path.write_text('{"interactions": []}')
+    with pytest.raises(ShdlError) as exc_info:
+        Cassette.load(cassette_path)
+    assert exc_info.value.error_type == ErrorType.ARG_INVALID
+    with pytest.raises(ShdlError):
+        Cassette.load(tmp_path / 'missing.json')
@@ -0,0 +1,217 @@
+import asyncio
+
+import pytest
+import requests as rq
+
+from shdlCore import FetchOptions
+from shdlCore.src import DOIRepoHandler, ShdlError, UnrecordedRequestError, \
+    async_http_transport, doi_host_cache, http_transport, link_cache, \
+    mirror_health
+
+
+@pytest.mark.parametrize('raw_identifier', [
+    'doi:10.1109/5.771073',
+    'doi: 10.1109/5.771073',
+    'https://doi.org/10.1109/5.771073',
+    'http://dx.doi.org/10.1109/5.771073',
+])
+def test_identifier(raw_identifier):
+    handler = DOIRepoHandler(raw_identifier)
+    assert handler.is_query_valid
+    assert handler.identifier == '10.1109/5.771073'
+
+
+def test_metadata(replay):
+    replay('doi')
+    handler = DOIRepoHandler('doi:10.1109/5.771073')
+    assert handler.metadata == {
+        'author': ({'given': 'N.', 'family': 'Paskin'},),
+        'title':  'Toward unique identifiers',
+        'year':   '1999',
+        'id':     '10.1109/5.771073',
+        'repo':   'DOI',
+    }
+
+
+def test_metadata_not_found(replay):
+    replay('doi')
+    handler = DOIRepoHandler('doi:10.1000/no.such.doi')
+    assert handler.metadata is False
+    assert not handler.is_meta_response_valid
+
+
+def test_download_url(replay, mirror_link):
+    replay('doi')
+    handler = DOIRepoHandler('doi:10.1109/5.771073')
+    assert handler.get_download_url(mirror_link) \
+           == ('https://zero.sci-hub.st/2227/'
+               '2c6a0a5b0bd0e1c4b1b0f6c7a3e1d2f4/paskin1999.pdf')
+
+
+def test_race_download_url(replay, fetch_args):
+    replay('mirrorrace')
+    # the earlier mirror is preferred if found within the window
+    fetch_args['racewindow'] = 1000
+    mirror_list = ('https://sci-hub.se', 'https://sci-hub.st')
+    assert DOIRepoHandler('doi:10.1109/5.771073') \
+               .race_download_url(mirror_list) \
+           == ('https://twin.sci-hub.se/2227/'
+               '2c6a0a5b0bd0e1c4b1b0f6c7a3e1d2f4/paskin1999.pdf')
+    assert DOIRepoHandler('doi:10.1000/no.such.doi') \
+               .race_download_url(mirror_list) is None
+
+
+def test_async_race_download_url(replay, fetch_args):
+    replay('mirrorrace')
+    fetch_args['racewindow'] = 1000
+    mirror_list = ('https://sci-hub.se', 'https://sci-hub.st')
+
+    async def race_download_url(identifier: str):
+        try:
+            return await DOIRepoHandler(identifier) \
+                .async_race_download_url(mirror_list)
+        finally:
+            await async_http_transport.close()
+
+    assert asyncio.run(race_download_url('doi:10.1109/5.771073')) \
+           == ('https://twin.sci-hub.se/2227/'
+               '2c6a0a5b0bd0e1c4b1b0f6c7a3e1d2f4/paskin1999.pdf')
+    assert asyncio.run(race_download_url('doi:10.1000/no.such.doi')) is None
+
+
+def test_link_cache(replay, fetch_args, tmp_path, mirror_link):
+    fetch_args.update(nocache=False, cache=tmp_path / 'shdlcache')
+    replay('doi')
+    dl_url = DOIRepoHandler('doi:10.1109/5.771073') \
+        .get_download_url(mirror_link)
+    replay('linkcache')
+    assert DOIRepoHandler('doi:10.1000/no.such.doi') \
+               .get_download_url(mirror_link) is None
+    assert link_cache.is_known_miss('DOI', '10.1000/no.such.doi',
+                                    mirror_link)
+    # neither the link nor the miss is asked again
+    replay('arxiv')
+    assert DOIRepoHandler('doi:10.1109/5.771073') \
+               .get_download_url(mirror_link) == dl_url
+    assert DOIRepoHandler('doi:10.1000/no.such.doi') \
+               .get_download_url(mirror_link) is None
+    link_cache.forget_link('DOI', '10.1109/5.771073', dl_url)
+    assert link_cache.get_link('DOI', '10.1109/5.771073',
+                               mirror_link) is None
+
+
+def test_mirror_busy(replay, fetch_args, tmp_path):
+    fetch_args.update(nocache=False, cache=tmp_path / 'shdlcache')
+    replay('mirrorbusy')
+    for mirror_link in ('https://sci-hub.se', 'https://sci-hub.st',
+                        'https://sci-hub.ru'):
+        assert DOIRepoHandler('doi:10.1109/5.771073') \
+                   .get_download_url(mirror_link) is None
+    # rate limiting or overloaded mirrors are not down
+    assert not mirror_health.is_known_down('https://sci-hub.se')
+    assert not mirror_health.is_known_down('https://sci-hub.st')
+    assert mirror_health.is_known_down('https://sci-hub.ru')
+
+
+class _StallingSession:
+    # requests to failing_url_dict fail, others are sent by inner_session
+
+    def __init__(self, inner_session, failing_url_dict: dict):
+        self.inner_session = inner_session
+        self.failing_url_dict = failing_url_dict
+
+    def request(self, method: str, url: str, **kwargs):
+        if (error_type := self.failing_url_dict.get(url)) is not None:
+            raise error_type(f"{method} {url} failed")
+        return self.inner_session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def close(self) -> None:
+        pass
+
+
+def test_mirror_timeout(replay, fetch_args, tmp_path):
+    fetch_args.update(nocache=False, cache=tmp_path / 'shdlcache')
+    replay('mirrorrace')
+    stalling_session = _StallingSession(None, {
+        # timed out when probed
+        'https://sci-hub.ru': rq.exceptions.ReadTimeout,
+        # cut off when queried
+        'https://sci-hub.se/10.1109/5.771073':
+            rq.exceptions.ChunkedEncodingError,
+    })
+    with http_transport.use_session(stalling_session) as replay_session:
+        stalling_session.inner_session = replay_session
+        for mirror_link in ('https://sci-hub.ru', 'https://sci-hub.se'):
+            assert DOIRepoHandler('doi:10.1109/5.771073') \
+                       .get_download_url(mirror_link) is None
+            assert mirror_health.is_known_down(mirror_link)
+        # the next mirror is tried
+        assert DOIRepoHandler('doi:10.1109/5.771073') \
+                   .get_download_url('https://sci-hub.st') \
+               == ('https://zero.sci-hub.st/2227/'
+                   '2c6a0a5b0bd0e1c4b1b0f6c7a3e1d2f4/paskin1999.pdf')
+
+
+def test_unrecorded_request(replay):
+    replay('doi')
+    handler = DOIRepoHandler('doi:10.1109/5.000000')
+    with pytest.raises(UnrecordedRequestError):
+        handler.get_metadata_response()
+
+
+def test_alt_metadata_known_prefix(replay):
+    # the host of 10.2307 is known, so doi.org is not asked for it
+    replay('doihost')
+    handler = DOIRepoHandler('doi:10.2307/2589462')
+    assert handler.metadata == {
+        'author': ({'family': 'Lax', 'given': 'Peter D.'},),
+        'title':  'Change of Variables in Multiple Integrals',
+        'year':   '1999',
+        'id':     '10.2307/2589462',
+        'repo':   'DOI',
+    }
+
+
+def test_alt_metadata_learned_prefix(replay, fetch_args, tmp_path,
+                                     monkeypatch):
+    replay('doihost')
+    fetch_args.update(nocache=False, cache=tmp_path / 'shdlcache')
+    handler = DOIRepoHandler('doi:10.1140/epjc/s10052-019-6560-9')
+    assert handler.metadata['author'][0] \
+           == {'family': 'Sirunyan', 'given': 'A. M.'}
+    assert doi_host_cache.get('10.1140') == 'link.springer.com'
+    # the host of the prefix is not looked up again
+    monkeypatch.setattr(DOIRepoHandler, 'doc_host_steps', None)
+    handler = DOIRepoHandler('doi:10.1140/epjc/s10052-019-6561-8')
+    assert handler.metadata['title'] == 'Measurement of the top quark mass'
+
+
+def test_metadata_race(replay, fetch_args):
+    # doi.org and JSTOR, both complete, are queried at the same time
+    replay('metarace')
+    fetch_args['racewindow'] = 1000
+    handler = DOIRepoHandler('doi:10.2307/2975688')
+    assert handler.metadata['title'] == 'The Fundamental Theorem of Algebra'
+    fetch_args['metapriority'] = ('jstor', 'csl')
+    handler = DOIRepoHandler('doi:10.2307/2975688')
+    assert handler.metadata['title'] \
+           == 'The fundamental theorem of algebra and linear algebra'
+    # the response of doi.org is kept
+    assert handler.metadata_response.json()['DOI'] == '10.2307/2975688'
+
+
+def test_metadata_source_unlisted(replay, fetch_args, monkeypatch):
+    replay('doihost')
+    fetch_args['metapriority'] = ('csl',)
+    monkeypatch.setattr(DOIRepoHandler, 'alt_metadata_jstor_steps', None)
+    assert DOIRepoHandler('doi:10.2307/2589462').metadata is None
+
+
+def test_metapriority_arg():
+    assert FetchOptions(metapriority='springer, JSTOR') \
+               .arg_dict['metapriority'] == ('springer', 'jstor', 'csl')
+    with pytest.raises(ShdlError):
+        FetchOptions(metapriority=['csl', 'elsevier'])
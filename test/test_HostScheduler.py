@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import time
+from contextvars import copy_context
+
+import pytest
+
+from shdlCore.src import HostLimit, HostScheduler, ShdlError, \
+    default_host_key, parse_host_limit
+
+
+@pytest.fixture
+def host_scheduler(fetch_args):
+    fetch_args['hostlimit'] = {
+        default_host_key: HostLimit(rate=0, inflight=0, burst=1),
+        'rate.example.org': HostLimit(rate=10, inflight=0, burst=2),
+        'inflight.example.org': HostLimit(rate=0, inflight=1, burst=1),
+    }
+    return HostScheduler()
+
+
+def test_parse_host_limit():
+    assert parse_host_limit('Doi.org,5,4') \
+           == ('doi.org', HostLimit(rate=5, inflight=4, burst=5))
+    assert parse_host_limit('*,0.5') \
+           == ('*', HostLimit(rate=0.5, inflight=0, burst=1))
+    for limit_str in ('doi.org', 'doi.org,-1', ',5', 'doi.org,5,4,0'):
+        with pytest.raises(ShdlError):
+            parse_host_limit(limit_str)
+
+
+def test_rate(host_scheduler):
+    start_time = time.monotonic()
+    # the burst is sent at once, then 10 per second
+    for _ in range(4):
+        with host_scheduler.slot('rate.example.org'):
+            pass
+    assert 0.15 <= time.monotonic() - start_time < 1
+    # other hosts are not limited
+    start_time = time.monotonic()
+    for _ in range(4):
+        with host_scheduler.slot('other.example.org'):
+            pass
+    assert time.monotonic() - start_time < 0.1
+
+
+def test_inflight(host_scheduler):
+    acquired_event = threading.Event()
+
+    def acquire() -> None:
+        with host_scheduler.slot('inflight.example.org'):
+            acquired_event.set()
+
+    with host_scheduler.slot('inflight.example.org'):
+        thread = threading.Thread(target=copy_context().run,
+                                  args=(acquire,))
+        thread.start()
+        assert not acquired_event.wait(0.1)
+    assert acquired_event.wait(5)
+    thread.join()
+
+
+def test_async_inflight(host_scheduler):
+    inflight_list = [0]
+    max_inflight_list = [0]
+
+    async def request() -> None:
+        async with host_scheduler.async_slot('inflight.example.org'):
+            inflight_list[0] += 1
+            max_inflight_list[0] = max(max_inflight_list[0],
+                                       inflight_list[0])
+            await asyncio.sleep(0.01)
+            inflight_list[0] -= 1
+
+    async def request_all() -> None:
+        await asyncio.gather(*(request() for _ in range(3)))
+
+    asyncio.run(request_all())
+    assert max_inflight_list[0] == 1
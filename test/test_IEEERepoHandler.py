@@ -0,0 +1,41 @@
+import pytest
+
+from shdlCore.src import IEEERepoHandler
+
+
+@pytest.mark.parametrize('raw_identifier', [
+    'ieee:771073',
+    'ieee 771073',
+    'https://ieeexplore.ieee.org/document/771073',
+])
+def test_identifier(raw_identifier):
+    handler = IEEERepoHandler(raw_identifier)
+    assert handler.is_query_valid
+    assert handler.identifier == '771073'
+
+
+def test_identifier_invalid():
+    assert not IEEERepoHandler('ieee:abc').is_query_valid
+
+
+def test_metadata(replay):
+    replay('ieee')
+    handler = IEEERepoHandler('ieee:771073')
+    assert handler.metadata == {
+        'author': ({'given': 'N.', 'family': 'Paskin'},),
+        'title':  'Toward unique identifiers',
+        'year':   '1999',
+        'id':     '771073',
+        'repo':   'IEEE',
+    }
+
+
+def test_download_url(replay, mirror_link):
+    replay('ieee')
+    handler = IEEERepoHandler('ieee:771073')
+    assert handler.get_download_url(mirror_link) \
+           == ('https://zero.sci-hub.st/2227/'
+               '2c6a0a5b0bd0e1c4b1b0f6c7a3e1d2f4/paskin1999.pdf')
+    # the mirror is queried with the DOI in the citation record,
+    # the identifier is left as given
+    assert handler.identifier == '771073'
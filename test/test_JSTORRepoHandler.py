@@ -0,0 +1,68 @@
+from collections import Counter
+
+import pytest
+
+from shdlCore.src import JSTORRepoHandler, http_transport
+
+
+@pytest.mark.parametrize('raw_identifier', [
+    'jstor:2589462',
+    'jstor: 2589462',
+    'https://www.jstor.org/stable/2589462',
+])
+def test_identifier(raw_identifier):
+    handler = JSTORRepoHandler(raw_identifier)
+    assert handler.is_query_valid
+    assert handler.identifier == '2589462'
+
+
+def test_metadata(replay):
+    replay('jstor')
+    handler = JSTORRepoHandler('jstor:2589462')
+    assert handler.metadata == {
+        'author': ({'family': 'Lax', 'given': 'Peter D.'},),
+        'title':  'Change of Variables in Multiple Integrals',
+        'year':   '1999',
+        'id':     '2589462',
+        'repo':   'JSTOR',
+    }
+
+
+def test_download_url(replay, mirror_link):
+    replay('jstor')
+    handler = JSTORRepoHandler('jstor:2589462')
+    # the mirror is queried with the DOI in the citation record
+    assert handler.get_download_url(mirror_link) \
+           == ('https://zero.sci-hub.st/2227/'
+               '2c6a0a5b0bd0e1c4b1b0f6c7a3e1d2f4/lax1999.pdf')
+
+
+class _CountingSession:
+    # counts the requests sent by inner_session
+
+    def __init__(self):
+        self.inner_session = None
+        self.url_counter = Counter()
+
+    def request(self, method: str, url: str, **kwargs):
+        self.url_counter[url] += 1
+        return self.inner_session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def close(self) -> None:
+        pass
+
+
+def test_metadata_doi_form(replay):
+    # the citation record is the only metadata source, fetched once
+    replay('doihost')
+    counting_session = _CountingSession()
+    with http_transport.use_session(counting_session) as replay_session:
+        counting_session.inner_session = replay_session
+        handler = JSTORRepoHandler('jstor:10.2307/2589462')
+        assert handler.metadata['title'] \
+               == 'Change of Variables in Multiple Integrals'
+    assert counting_session.url_counter \
+           == {'https://www.jstor.org/citation/ris/10.2307/2589462': 1}
@@ -0,0 +1,81 @@
+from contextvars import copy_context
+from threading import Thread
+
+import pytest
+
+from shdlCore.src import LinkCache, MetadataCache, MirrorHealthTable
+
+
+def test_metadata_cache_eviction(fetch_args, tmp_path, monkeypatch):
+    fetch_args.update(nocache=False, cache=tmp_path / 'shdlcache',
+                      cachesize=3)
+    monkeypatch.setattr(MetadataCache, 'evict_interval', 5)
+    metadata_cache = MetadataCache()
+    metadata = {'author': (), 'title': 'Title', 'year': '2000'}
+    for doc_idx in range(5):
+        metadata_cache.put('DOI', f'10.1000/{doc_idx}', metadata)
+    # only evicted on the first store until evict_interval stores
+    assert metadata_cache._execute('SELECT COUNT(*) FROM metadata') \
+           == [(5,)]
+    metadata_cache.put('DOI', '10.1000/5', metadata)
+    assert metadata_cache._execute('SELECT identifier FROM metadata '
+                                   'ORDER BY identifier') \
+           == [('10.1000/3',), ('10.1000/4',), ('10.1000/5',)]
+    assert metadata_cache.get('DOI', '10.1000/0') is None
+    assert metadata_cache.get('DOI', '10.1000/5') == metadata
+    assert {'metadata_created', 'metadata_last_access'} <= {
+        name
+        for name, in metadata_cache._execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def test_mirror_health_latency(fetch_args, tmp_path):
+    fetch_args.update(nocache=False, cache=tmp_path / 'shdlcache',
+                      probetimeout=15)
+    mirror_health = MirrorHealthTable()
+    mirror_link = 'https://sci-hub.st'
+    assert mirror_health.probe_timeout(mirror_link) == 15
+    # concurrent updates are not lost
+    thread_list = [Thread(target=copy_context().run,
+                          args=(mirror_health.record_success,
+                                mirror_link, 0.1 * (thread_idx + 1)))
+                   for thread_idx in range(10)]
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+    assert mirror_health.median_latency(mirror_link) \
+           == pytest.approx(0.55)
+    assert mirror_health.probe_timeout(mirror_link) \
+           == pytest.approx(5.5)
+    mirror_health.record_success('https://sci-hub.se', 0.01)
+    assert mirror_health.probe_timeout('https://sci-hub.se') \
+           == MirrorHealthTable.min_probe_timeout
+
+
+def test_link_cache_eviction(fetch_args, tmp_path, monkeypatch):
+    fetch_args.update(nocache=False, cache=tmp_path / 'shdlcache',
+                      linkttl=60, missttl=600)
+    monkeypatch.setattr(LinkCache, 'evict_interval', 3)
+    link_cache = LinkCache()
+    mirror_link = 'https://sci-hub.st'
+
+    def put_aged(identifier: str, link, age: float) -> None:
+        link_cache.put('DOI', identifier, mirror_link, link)
+        link_cache._execute('UPDATE link SET created = created - ? '
+                            'WHERE identifier = ?', age, identifier)
+
+    put_aged('10.1000/0', 'https://zero.sci-hub.st/0.pdf', 120)
+    put_aged('10.1000/1', None, 120)
+    put_aged('10.1000/2', 'https://zero.sci-hub.st/2.pdf', 0)
+    # only removed on the first store until evict_interval stores
+    assert link_cache._execute('SELECT COUNT(*) FROM link') == [(3,)]
+    put_aged('10.1000/3', None, 0)
+    # the expired link is removed, the miss is kept for longer
+    assert link_cache._execute('SELECT identifier FROM link '
+                               'ORDER BY identifier') \
+           == [('10.1000/1',), ('10.1000/2',), ('10.1000/3',)]
+    assert 'link_created' in str(link_cache._execute(
+        'EXPLAIN QUERY PLAN DELETE FROM link WHERE created < ? '
+        'AND ((link IS NOT NULL AND created < ?) '
+        'OR (link IS NULL AND created < ?))', 0, 0, 0))
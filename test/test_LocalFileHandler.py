@@ -0,0 +1,139 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import aiohttp
+import requests as rq
+
+from shdlCore.src import LocalFileHandler, async_fetch_url_to_local_path, \
+    async_http_transport, fetch_url_to_local_path, http_transport
+
+file_url = 'https://files.example.org/'
+file_body = b'0123456789'
+
+
+def write_part(target_path, content: bytes, url: str) -> None:
+    # as left by an interrupted download
+    target_path.with_name(target_path.name + '.part').write_bytes(content)
+    target_path.with_name(target_path.name + '.part.json').write_text(
+        json.dumps({'url': url, 'etag': None, 'last_modified': None,
+                    'size': 10, 'received': len(content)}))
+
+
+class _FlakySession:
+    # the first requests time out, the others are sent by inner_session
+
+    def __init__(self, inner_session, timeout_count: int):
+        self.inner_session = inner_session
+        self.timeout_count = timeout_count
+
+    def request(self, method: str, url: str, **kwargs):
+        if self.timeout_count > 0:
+            self.timeout_count -= 1
+            raise rq.exceptions.ReadTimeout(f"{method} {url} timed out")
+        return self.inner_session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def close(self) -> None:
+        pass
+
+
+class _AsyncFlakySession(_FlakySession):
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, **kwargs):
+        if self.timeout_count > 0:
+            self.timeout_count -= 1
+            raise aiohttp.ServerTimeoutError(f"{method} {url} timed out")
+        async with self.inner_session.request(method, url, **kwargs) \
+                as aio_response:
+            yield aio_response
+
+
+def test_resume(replay, tmp_path):
+    replay('download')
+    target_path = tmp_path / 'resume.pdf'
+    write_part(target_path, file_body[:4], file_url + 'resume.pdf')
+    assert fetch_url_to_local_path(file_url + 'resume.pdf', target_path)
+    assert target_path.read_bytes() == file_body
+    assert not target_path.with_name('resume.pdf.part.json').exists()
+
+
+def test_resume_range_mismatch(replay, tmp_path):
+    # resumed at byte 2 instead of 4, downloaded again from start
+    replay('download')
+    target_path = tmp_path / 'mismatch.pdf'
+    write_part(target_path, file_body[:4], file_url + 'mismatch.pdf')
+    assert fetch_url_to_local_path(file_url + 'mismatch.pdf', target_path)
+    assert target_path.read_bytes() == file_body
+
+
+def test_larger_than_expected(replay, tmp_path):
+    replay('download')
+    target_path = tmp_path / 'larger.pdf'
+    assert not fetch_url_to_local_path(file_url + 'larger.pdf', target_path)
+    # kept, with a warning
+    assert target_path.read_bytes() == file_body
+
+
+def test_content_encoded(replay, tmp_path):
+    # Content-Length is of the encoded body
+    replay('download')
+    target_path = tmp_path / 'encoded.pdf'
+    assert fetch_url_to_local_path(file_url + 'encoded.pdf', target_path)
+    assert target_path.read_bytes() == file_body
+
+
+def test_segmented(replay, fetch_args, tmp_path, monkeypatch):
+    replay('download')
+    fetch_args['segments'] = 2
+    monkeypatch.setattr(LocalFileHandler, '_min_segment_size', 5)
+    target_path = tmp_path / 'segmented.pdf'
+    assert fetch_url_to_local_path(file_url + 'segmented.pdf', target_path)
+    assert target_path.read_bytes() == file_body
+
+
+def test_timeout_before_response(replay, fetch_args, tmp_path):
+    # timed out even after retrying the request,
+    # then resumed as an interrupted download
+    replay('download')
+    fetch_args.update(retries=1, backoff=0)
+    target_path = tmp_path / 'resume.pdf'
+    write_part(target_path, file_body[:4], file_url + 'resume.pdf')
+    flaky_session = _FlakySession(None, 2)
+    with http_transport.use_session(flaky_session) as replay_session:
+        flaky_session.inner_session = replay_session
+        assert fetch_url_to_local_path(file_url + 'resume.pdf', target_path)
+    assert flaky_session.timeout_count == 0
+    assert target_path.read_bytes() == file_body
+
+
+def test_async_timeout_before_response(replay, fetch_args, tmp_path):
+    replay('download')
+    fetch_args.update(retries=1, backoff=0)
+    target_path = tmp_path / 'resume.pdf'
+    write_part(target_path, file_body[:4], file_url + 'resume.pdf')
+    flaky_session = _AsyncFlakySession(None, 2)
+    with async_http_transport.use_session(flaky_session) as replay_session:
+        flaky_session.inner_session = replay_session
+        assert asyncio.run(async_fetch_url_to_local_path(
+            file_url + 'resume.pdf', target_path))
+    assert flaky_session.timeout_count == 0
+    assert target_path.read_bytes() == file_body
+
+
+def test_segmented_probe_timeout(replay, fetch_args, tmp_path, monkeypatch):
+    # downloaded in a single stream if the HEAD probe fails
+    replay('download')
+    fetch_args['segments'] = 2
+    monkeypatch.setattr(LocalFileHandler, '_min_segment_size', 5)
+    target_path = tmp_path / 'segmented.pdf'
+    flaky_session = _FlakySession(None, 1)
+    with http_transport.use_session(flaky_session) as replay_session:
+        flaky_session.inner_session = replay_session
+        assert fetch_url_to_local_path(file_url + 'segmented.pdf',
+                                       target_path)
+    assert flaky_session.timeout_count == 0
+    assert target_path.read_bytes() == file_body
@@ -0,0 +1,121 @@
+import threading
+from contextvars import copy_context
+
+from shdlCore.src import ArxivRepoHandler, DOIRepoHandler, \
+    JSTORRepoHandler, MetadataBatcher, PMIDRepoHandler
+
+
+def test_arxiv(replay):
+    replay('metabatch')
+    batcher = MetadataBatcher(3)
+    handler_list = [ArxivRepoHandler(f'arxiv:{arxiv_id}')
+                    for arxiv_id in ('1501.00001', '1501.00002v1',
+                                     '1501.99999')]
+    for handler in handler_list:
+        batcher.add(handler)
+    for handler in handler_list:
+        batcher.fetch(handler)
+    assert handler_list[0].metadata == {
+        'author': ({'given': 'Jane Q.', 'family': 'Doe'},
+                   {'given': 'Richard', 'family': 'Roe'}),
+        'title':  'Regularity of the free boundary in a two-phase problem',
+        'year':   '2015',
+        'id':     '1501.00001',
+        'repo':   'arXiv',
+    }
+    assert handler_list[1].metadata['title'] \
+           == 'Counting points on curves over finite fields'
+    # left out of the batched response, fetched on its own
+    assert handler_list[2].metadata is False
+
+
+def test_pmid(replay):
+    replay('metabatch')
+    batcher = MetadataBatcher(20)
+    handler_list = [PMIDRepoHandler(f'pmid:{pmid}')
+                    for pmid in ('10021234', '10021235')]
+    for handler in handler_list:
+        batcher.add(handler)
+    # each fetched in its own thread, as by the batch workers
+    thread_list = [threading.Thread(target=copy_context().run,
+                                    args=(batcher.fetch, handler))
+                   for handler in handler_list]
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+    assert [handler.metadata for handler in handler_list] == [
+        {'title':  'Binding of a receptor to its ligand in vitro',
+         'author': ({'family': 'Smith', 'given': 'J'},
+                    {'family': 'Garcia', 'given': 'ML'}),
+         'year':   '1999',
+         'id':     '10021234',
+         'repo':   'PMID'},
+        {'title':  'Kinetics of ligand release',
+         'author': ({'family': 'Chen', 'given': 'X'},),
+         'year':   '1999',
+         'id':     '10021235',
+         'repo':   'PMID'},
+    ]
+
+
+def test_order(replay):
+    replay('metabatch')
+    batcher = MetadataBatcher(20)
+    handler_list = [PMIDRepoHandler(f'pmid:{pmid}')
+                    for pmid in ('10021234', '10021235')]
+    for handler in handler_list:
+        batcher.add(handler)
+    # requested in the order added, as recorded
+    batcher.fetch(handler_list[1])
+    # fetched in that chunk, not again
+    assert list(batcher._taken_dict) == [handler_list[0]]
+    batcher.fetch(handler_list[0])
+    assert handler_list[0].metadata['id'] == '10021234'
+    assert handler_list[1].metadata['id'] == '10021235'
+    # no handler kept once fetched
+    assert not any(batcher._pending_dict.values())
+    assert len(batcher._taken_dict) == 0
+
+
+def test_crossref(replay):
+    replay('metabatch')
+    batcher = MetadataBatcher(20)
+    handler_list = [DOIRepoHandler(f'doi:{doi}')
+                    for doi in ('10.1109/5.771073', '10.1000/no.such.doi')]
+    for handler in handler_list:
+        batcher.add(handler)
+    batcher.fetch(handler_list[0])
+    assert handler_list[0].metadata == {
+        'author': ({'given': 'N.', 'family': 'Paskin'},),
+        'title':  'Toward unique identifiers',
+        'year':   '1999',
+        'id':     '10.1109/5.771073',
+        'repo':   'DOI',
+    }
+    # not found in Crossref, fetched from doi.org on its own
+    batcher.fetch(handler_list[1])
+    assert handler_list[1].metadata is False
+
+
+def test_crossref_url(fetch_args):
+    fetch_args['crossref'] = 'http://127.0.0.1:8080/'
+    assert DOIRepoHandler.batch_metadata_request(['10.1109/5.771073']).url \
+           == ('http://127.0.0.1:8080/works'
+               '?filter=doi%3A10.1109%2F5.771073&rows=1')
+    fetch_args['crossref'] = ''
+    assert DOIRepoHandler.batch_metadata_request(['10.1109/5.771073']) \
+           is None
+
+
+def test_not_batched(replay):
+    replay('arxiv')
+    handler = ArxivRepoHandler('arxiv:1501.00001')
+    # batching disabled, and a repo without batched requests
+    for batcher, batcher_handler in ((MetadataBatcher(1), handler),
+                                     (MetadataBatcher(20),
+                                      JSTORRepoHandler('jstor:2589462'))):
+        batcher.add(batcher_handler)
+        batcher.fetch(batcher_handler)
+    # fetched on its own
+    assert handler.metadata['year'] == '2015'
@@ -0,0 +1,41 @@
+import pytest
+
+from shdlCore.src import PMIDRepoHandler
+
+
+@pytest.mark.parametrize('raw_identifier', [
+    'pmid:10021234',
+    'pmid 10021234',
+    'https://pubmed.ncbi.nlm.nih.gov/10021234/',
+])
+def test_identifier(raw_identifier):
+    handler = PMIDRepoHandler(raw_identifier)
+    assert handler.is_query_valid
+    assert handler.identifier == '10021234'
+
+
+def test_identifier_invalid():
+    assert not PMIDRepoHandler('pmid:abc').is_query_valid
+
+
+def test_metadata(replay):
+    replay('pmid')
+    handler = PMIDRepoHandler('pmid:10021234')
+    # collective names are not authors
+    assert handler.metadata == {
+        'author': ({'family': 'Smith', 'given': 'J'},
+                   {'family': 'Garcia', 'given': 'ML'}),
+        'title':  'Binding of a receptor to its ligand in vitro',
+        'year':   '1999',
+        'id':     '10021234',
+        'repo':   'PMID',
+    }
+
+
+def test_download_url(replay, mirror_link):
+    replay('pmid')
+    handler = PMIDRepoHandler('pmid:10021234')
+    # the mirror is queried with a form
+    assert handler.get_download_url(mirror_link) \
+           == ('https://zero.sci-hub.st/2227/'
+               '2c6a0a5b0bd0e1c4b1b0f6c7a3e1d2f4/smith1999.pdf')
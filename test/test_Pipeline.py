@@ -0,0 +1,64 @@
+import threading
+import time
+
+from shdlCore.src import PipelineStage, StagedPipeline
+
+
+def test_stages():
+    def check_odd(value: int) -> int:
+        if value % 2 == 0:
+            raise ValueError(value)
+        return value
+
+    pipeline = StagedPipeline((PipelineStage('double', lambda x: x * 2, 2),
+                               PipelineStage('add', lambda x: x + 1, 2),
+                               PipelineStage('check', check_odd, 1)),
+                              queue_size=2)
+    result_dict = {item: (value, error)
+                   for item, value, error in pipeline.run(range(10))}
+    assert result_dict == {item: (item * 2 + 1, None) for item in range(10)}
+    # a failed item skips the remaining stages
+    pipeline = StagedPipeline((PipelineStage('check', check_odd, 1),
+                               PipelineStage('double', lambda x: x * 2, 1)),
+                              queue_size=2)
+    result_dict = {item: (value, error)
+                   for item, value, error in pipeline.run(range(4))}
+    assert [result_dict[item][0] for item in range(4)] == [0, 2, 2, 6]
+    assert isinstance(result_dict[0][1], ValueError)
+    assert result_dict[1][1] is None
+
+
+def test_concurrency():
+    # fails unless the 3 workers of the stage run at the same time
+    barrier = threading.Barrier(3, timeout=5)
+
+    def wait_for_others(value: int) -> int:
+        barrier.wait()
+        return value
+
+    pipeline = StagedPipeline((PipelineStage('wait', wait_for_others, 3),),
+                              queue_size=1)
+    assert sorted((item, error)
+                  for item, _, error in pipeline.run(range(3))) \
+           == [(0, None), (1, None), (2, None)]
+
+
+def test_bounded_queue():
+    release_event = threading.Event()
+    pulled_list = list()
+
+    def item_iter():
+        for item in range(10):
+            pulled_list.append(item)
+            yield item
+
+    pipeline = StagedPipeline(
+        (PipelineStage('block', lambda x: release_event.wait(5) and x, 1),),
+        queue_size=1)
+    result_iter = pipeline.run(item_iter())
+    time.sleep(0.1)
+    # one item in the worker, one in the queue
+    # and one waiting to be put in the queue
+    assert len(pulled_list) <= 3
+    release_event.set()
+    assert sorted(item for item, _, _ in result_iter) == list(range(10))
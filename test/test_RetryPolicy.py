@@ -0,0 +1,51 @@
+import time
+
+import pytest
+import requests as rq
+
+from shdlCore.src import HostUnavailableError, RetryPolicy
+
+
+@pytest.fixture
+def retry_policy(fetch_args):
+    fetch_args.update(retries=2, backoff=100, breaker=2,
+                      breakercooldown=0.1)
+    return RetryPolicy()
+
+
+def test_retry_delay(retry_policy):
+    host = 'example.org'
+    assert 0 <= retry_policy.get_retry_delay(host, 0, status_code=503) <= 0.1
+    assert 0 <= retry_policy.get_retry_delay(host, 1, status_code=503) <= 0.2
+    # out of retries
+    assert retry_policy.get_retry_delay(host, 2, status_code=503) is None
+    assert retry_policy.get_retry_delay(host, 0, status_code=404) is None
+    assert retry_policy.get_retry_delay(host, 0, status_code=429,
+                                        retry_after='2') == 2
+    # waiting too long
+    assert retry_policy.get_retry_delay(host, 0, status_code=429,
+                                        retry_after='120') is None
+    assert retry_policy.get_retry_delay(
+        host, 0, error=rq.exceptions.ConnectionError()) is not None
+    assert retry_policy.get_retry_delay(
+        host, 0, error=rq.exceptions.SSLError()) is None
+
+
+def test_circuit_breaker(retry_policy):
+    host = 'example.org'
+    retry_policy.record_failure(host)
+    # too many requests does not count as a failure
+    retry_policy.get_retry_delay(host, 0, status_code=429)
+    retry_policy.check_host(host)
+    retry_policy.record_failure(host)
+    with pytest.raises(HostUnavailableError):
+        retry_policy.check_host(host)
+    # other hosts are not affected
+    retry_policy.check_host('other.example.org')
+    time.sleep(0.15)
+    # half-open: a single request is let through
+    retry_policy.check_host(host)
+    with pytest.raises(HostUnavailableError):
+        retry_policy.check_host(host)
+    retry_policy.get_retry_delay(host, 0, status_code=200)
+    retry_policy.check_host(host)
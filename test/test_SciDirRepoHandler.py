@@ -0,0 +1,77 @@
+import threading
+import time
+from contextvars import copy_context
+
+import pytest
+
+from shdlCore.src import SciDirRepoHandler
+
+
+@pytest.mark.parametrize('raw_identifier', [
+    'scidir:pii/S0022123699935009',
+    'sciencedirect: pii/S0022123699935009',
+    'https://www.sciencedirect.com/science/article/pii/S0022123699935009',
+])
+def test_identifier(raw_identifier):
+    handler = SciDirRepoHandler(raw_identifier)
+    assert handler.is_query_valid
+    assert handler.identifier == 'pii/S0022123699935009'
+
+
+def test_metadata(replay):
+    replay('scidir')
+    handler = SciDirRepoHandler('scidir:pii/S0022123699935009')
+    assert handler.metadata == {
+        'author': ({'family': 'Doe', 'given': 'Jane'},
+                   {'family': 'Roe', 'given': 'Richard'}),
+        'title':  'Spectral theory of a class of operators',
+        'year':   '2000',
+        'id':     'S0022123699935009',
+        'repo':   'ScienceDirect',
+    }
+    assert handler.doc_type == 'pii'
+
+
+def test_download_url(replay, mirror_link):
+    replay('scidir')
+    handler = SciDirRepoHandler('scidir:pii/S0022123699935009')
+    assert handler.get_download_url(mirror_link) \
+           == ('https://zero.sci-hub.st/2227/'
+               '2c6a0a5b0bd0e1c4b1b0f6c7a3e1d2f4/doe2000.pdf')
+    # the mirror is queried with the DOI in the citation record,
+    # the identifier is left as given
+    assert handler.identifier == 'pii/S0022123699935009'
+
+
+def test_download_url_concurrent(replay, mirror_link, monkeypatch):
+    replay('scidir')
+    fetch_count = 0
+    metadata_response_steps = SciDirRepoHandler.metadata_response_steps
+
+    def counted_metadata_response_steps(self):
+        nonlocal fetch_count
+        fetch_count += 1
+        # so that the other thread would fetch meanwhile
+        time.sleep(0.05)
+        return (yield from metadata_response_steps(self))
+
+    monkeypatch.setattr(SciDirRepoHandler, 'metadata_response_steps',
+                        counted_metadata_response_steps)
+    handler = SciDirRepoHandler('scidir:doi/10.1006/jfan.1999.3500')
+    # as in a mirror race
+    dl_url_list = list()
+    thread_list = [threading.Thread(
+        target=copy_context().run,
+        args=(lambda: dl_url_list.append(
+            handler.get_download_url(mirror_link)),))
+        for _ in range(2)]
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+    assert fetch_count == 1
+    assert dl_url_list \
+           == [('https://zero.sci-hub.st/2227/'
+                '2c6a0a5b0bd0e1c4b1b0f6c7a3e1d2f4/doe2000.pdf')] * 2
+    assert (handler.identifier, handler.doc_type) \
+           == ('doi/10.1006/jfan.1999.3500', 'doi')